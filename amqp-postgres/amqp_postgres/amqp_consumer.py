@@ -23,6 +23,18 @@ from cloudify.constants import EVENTS_EXCHANGE_NAME, LOGS_EXCHANGE_NAME
 
 
 class AckingAMQPConnection(AMQPConnection):
+    """AMQPConnection that acknowledges the messages put in .acks_queue
+
+    Messages are acknowledged cumulatively: once all the messages up to
+    some delivery tag are done with, that tag is acked with multiple=True,
+    so that a whole batch is acked using a single frame. Messages might be
+    done with out of order (eg. when stored by several writers), so those
+    are only acked once all the preceding messages are done with as well.
+    """
+    def __init__(self, *args, **kwargs):
+        super(AckingAMQPConnection, self).__init__(*args, **kwargs)
+        self._ack_trackers = {}
+
     def _process_publish(self, channel):
         self._process_acks()
         super(AckingAMQPConnection, self)._process_publish(channel)
@@ -31,9 +43,45 @@ class AckingAMQPConnection(AMQPConnection):
         while True:
             try:
                 channel, tag = self.acks_queue.get_nowait()
-                channel.basic_ack(tag)
             except queue.Empty:
-                return
+                break
+            if channel not in self._ack_trackers:
+                self._ack_trackers[channel] = _AckTracker()
+            self._ack_trackers[channel].done(tag)
+
+        for channel, tracker in list(self._ack_trackers.items()):
+            if channel.is_closed:
+                # tags are per-channel: after reconnecting, there's a new
+                # channel, and the unacked messages will be redelivered
+                del self._ack_trackers[channel]
+                continue
+            tag = tracker.advance()
+            if tag is not None:
+                channel.basic_ack(tag, multiple=True)
+
+
+class _AckTracker(object):
+    """Keep track of which messages of a channel can be acked.
+
+    Delivery tags on a channel are consecutive, starting from 1.
+    """
+    def __init__(self):
+        self.acked = 0
+        self._done = set()
+
+    def done(self, tag):
+        if tag > self.acked:
+            self._done.add(tag)
+
+    def advance(self):
+        """Return the new tag to ack cumulatively, or None if there's none"""
+        previous = self.acked
+        while self.acked + 1 in self._done:
+            self.acked += 1
+            self._done.remove(self.acked)
+        if self.acked != previous:
+            return self.acked
+        return None
 
 
 logger = logging.getLogger(__name__)
@@ -41,15 +89,20 @@ logger = logging.getLogger(__name__)
 
 class AMQPLogsEventsConsumer(object):
 
-    def __init__(self, message_processor):
+    def __init__(self, message_processor, prefetch_count=None):
         self.queue = 'cloudify-logs-events'
         self._message_processor = message_processor
+        self._prefetch_count = prefetch_count
+        self._connection = None
 
         # This is here because AMQPConnection expects it
         self.routing_key = ''
 
     def register(self, connection, channel):
+        self._connection = connection
         channel.confirm_delivery()
+        if self._prefetch_count:
+            channel.basic_qos(prefetch_count=self._prefetch_count)
         channel.queue_declare(queue=self.queue,
                               durable=True,
                               auto_delete=False)
@@ -67,7 +120,7 @@ class AMQPLogsEventsConsumer(object):
     def process(self, channel, method, properties, body):
         try:
             if method.routing_key == 'events.hooks':
-                channel.basic_ack(method.delivery_tag)
+                self._ack(channel, method.delivery_tag)
                 return
             parsed_body = json.loads(body)
             self._message_processor(parsed_body, method.exchange,
@@ -75,6 +128,17 @@ class AMQPLogsEventsConsumer(object):
         except Exception as e:
             logger.warn('Failed message processing: %s', e)
             logger.debug('Message was: %s', body)
+            # drop the message: leaving it unacked would hold back acking
+            # all the messages that come after it
+            self._ack(channel, method.delivery_tag)
+
+    def _ack(self, channel, tag):
+        """Ack a message that doesn't need to be stored.
+
+        This goes through the acks queue like all the stored messages, so
+        that the acks can be sent cumulatively.
+        """
+        self._connection.acks_queue.put((channel, tag))
 
     def _bind_queue_to_exchange(self,
                                 channel,
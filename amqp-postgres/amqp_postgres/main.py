@@ -1,13 +1,24 @@
 import logging
 import argparse
 import queue
+from time import sleep
+
+from sqlalchemy.exc import OperationalError
 
 from cloudify.amqp_client import get_client
 from manager_rest import config
 from manager_rest.flask_utils import setup_flask_app
 
+from . import metrics
 from .amqp_consumer import AMQPLogsEventsConsumer, AckingAMQPConnection
-from .postgres_publisher import DBLogEventPublisher
+from .postgres_publisher import (
+    MAX_BATCH_SIZE,
+    MAX_RECONNECT_DELAY,
+    MIN_RECONNECT_DELAY,
+    DBLogEventPublisher,
+    DiskSpool,
+    ShardedDBLogEventPublisher,
+)
 
 logger = logging.getLogger(__name__)
 BROKER_PORT_SSL = 5671
@@ -15,9 +26,12 @@ BROKER_PORT_NO_SSL = 5672
 
 DEFAULT_LOG_PATH = '/var/log/cloudify/amqp-postgres/amqp_postgres.log'
 CONFIG_PATH = '/opt/manager/cloudify-rest.conf'
+DEFAULT_METRICS_PORT = 8016
+DEFAULT_SPOOL_PATH = '/var/lib/cloudify/amqp-postgres/spool'
+DEFAULT_SPOOL_MAX_SIZE_MB = 1024
 
 
-def _create_connections():
+def _create_connections(use_copy=False, writers=1, spool=None):
     acks_queue = queue.Queue()
     cfy_config = config.instance
     port = BROKER_PORT_SSL if cfy_config.amqp_ca else BROKER_PORT_NO_SSL
@@ -32,25 +46,76 @@ def _create_connections():
         cls=AckingAMQPConnection
     )
     amqp_client.acks_queue = acks_queue
-    db_publisher = DBLogEventPublisher(config.instance, amqp_client)
+    if writers > 1:
+        db_publisher = ShardedDBLogEventPublisher(
+            config.instance, amqp_client, writers,
+            use_copy=use_copy, spool=spool)
+    else:
+        db_publisher = DBLogEventPublisher(
+            config.instance, amqp_client, use_copy=use_copy,
+            spool=spool.shards(1)[0] if spool else None)
+    # allow each writer to have a full batch in flight, while the next one
+    # is already being received
     amqp_consumer = AMQPLogsEventsConsumer(
-        message_processor=db_publisher.process
+        message_processor=db_publisher.process,
+        prefetch_count=2 * MAX_BATCH_SIZE * writers,
     )
 
     amqp_client.add_handler(amqp_consumer)
+    metrics.pending_messages.set_function(db_publisher.backlog)
+    metrics.ack_backlog.set_function(acks_queue.qsize)
     db_publisher.start()
     return amqp_client, db_publisher
 
 
+def _load_config_from_db():
+    """Load the config stored in the db, waiting for the db if needed.
+
+    If the config file already tells where the broker is, don't wait:
+    go on with the config file alone, so that logs and events can be
+    spooled until the db is back.
+    """
+    delay = MIN_RECONNECT_DELAY
+    while True:
+        try:
+            with setup_flask_app().app_context():
+                config.instance.load_from_db()
+            return
+        except OperationalError as e:
+            if config.instance.amqp_host:
+                logger.error('Cannot load the config from the database, '
+                             'using the config file only: %s', e)
+                config.instance.can_load_from_db = False
+                return
+            logger.error('Cannot load the config from the database, '
+                         'retrying in %d seconds: %s', delay, e)
+        sleep(delay)
+        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
 def main(args):
     logging.basicConfig(
         level=args.get('loglevel', 'INFO').upper(),
         filename=args.get('logfile', DEFAULT_LOG_PATH),
         format="%(asctime)s %(message)s")
     config.instance.load_from_file(args['config'])
-    with setup_flask_app().app_context():
-        config.instance.load_from_db()
-    amqp_client, db_publisher = _create_connections()
+    _load_config_from_db()
+    if args.get('metrics_port'):
+        metrics.start_metrics_server(
+            args['metrics_port'],
+            args.get('metrics_address', 'localhost'),
+        )
+    spool = None
+    if args.get('spool_path'):
+        spool = DiskSpool(
+            args['spool_path'],
+            args.get('spool_max_size', DEFAULT_SPOOL_MAX_SIZE_MB) * 1024**2,
+        )
+    amqp_client, db_publisher = _create_connections(
+        use_copy=args.get('use_copy', False),
+        writers=args.get('writers', 1),
+        spool=spool,
+    )
 
     logger.info('Starting consuming...')
     amqp_client.consume()
@@ -67,6 +132,27 @@ def cli():
                         help='Path to the log file')
     parser.add_argument('--log-level', dest='loglevel', default='INFO',
                         help='Logging level')
+    parser.add_argument('--copy', dest='use_copy', action='store_true',
+                        help='Store logs and events using COPY instead '
+                             'of INSERT')
+    parser.add_argument('--writers', type=int, default=1,
+                        help='Number of db connections used for storing '
+                             'logs and events in parallel. Items of a single '
+                             'execution are always stored in order.')
+    parser.add_argument('--metrics-port', type=int,
+                        default=DEFAULT_METRICS_PORT,
+                        help='Port to serve the Prometheus metrics on; '
+                             'use 0 to disable')
+    parser.add_argument('--metrics-address', default='localhost',
+                        help='Address to serve the Prometheus metrics on')
+    parser.add_argument('--spool-path', default=DEFAULT_SPOOL_PATH,
+                        help='File to keep logs and events in while the '
+                             'database is unavailable, until they can be '
+                             'stored; use an empty value to disable')
+    parser.add_argument('--spool-max-size', type=int,
+                        default=DEFAULT_SPOOL_MAX_SIZE_MB,
+                        help='Maximum size of the spool, in MB. When it is '
+                             'full, the service exits.')
     args = parser.parse_args()
     main(vars(args))
 
@@ -0,0 +1,83 @@
+########
+# Copyright (c) 2023 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+"""Prometheus metrics of the logs & events ingestion.
+
+The metrics are served over HTTP (see start_metrics_server), for the
+manager's Prometheus to scrape, same as the other manager services.
+"""
+
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'amqp_postgres'
+
+messages_consumed = Counter(
+    f'{METRICS_PREFIX}_messages_consumed',
+    'Number of messages received from the broker',
+    ['exchange'],
+)
+rows_inserted = Counter(
+    f'{METRICS_PREFIX}_rows_inserted',
+    'Number of rows stored in the database',
+    ['table'],
+)
+batch_size = Histogram(
+    f'{METRICS_PREFIX}_batch_size',
+    'Number of messages in each stored batch',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+insert_latency = Histogram(
+    f'{METRICS_PREFIX}_insert_latency_seconds',
+    'Time it took to store a batch, including the commit',
+)
+execution_cache_hits = Counter(
+    f'{METRICS_PREFIX}_execution_cache_hits',
+    'Number of messages whose execution was found in the cache',
+)
+execution_cache_misses = Counter(
+    f'{METRICS_PREFIX}_execution_cache_misses',
+    'Number of messages whose execution had to be fetched from the db',
+)
+fallback_stores = Counter(
+    f'{METRICS_PREFIX}_fallback_stores',
+    'Number of times messages had to be stored one by one, because '
+    'storing them in a batch failed',
+)
+pending_messages = Gauge(
+    f'{METRICS_PREFIX}_pending_messages',
+    'Number of messages received, but not yet stored',
+)
+ack_backlog = Gauge(
+    f'{METRICS_PREFIX}_ack_backlog',
+    'Number of stored messages not yet acknowledged to the broker',
+)
+
+
+def start_metrics_server(port, address='localhost'):
+    """Serve the metrics over HTTP, in a background thread.
+
+    Failing to do so is not fatal: the ingestion must go on regardless.
+    """
+    try:
+        start_http_server(port, addr=address)
+    except Exception as e:
+        logger.error('Could not serve metrics on %s:%s: %s',
+                     address, port, e)
+    else:
+        logger.info('Serving metrics on %s:%s', address, port)
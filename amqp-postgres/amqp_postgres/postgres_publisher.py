@@ -1,21 +1,43 @@
+import io
+import os
+import glob
 import json
 import logging
 import queue
+import zlib
+from itertools import islice
 from time import time
 from threading import Thread, Lock
 
 import psycopg2
 import psycopg2.errorcodes
 from psycopg2.extras import execute_values, DictCursor
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
 
 from cloudify.constants import EVENTS_EXCHANGE_NAME, LOGS_EXCHANGE_NAME
 from manager_rest.flask_utils import setup_flask_app
 
+from . import metrics
+
 
 logger = logging.getLogger(__name__)
 
+# the longest time an item can wait in the batch before being stored
 BATCH_DELAY = 0.5
+# bounds for the adaptive batch size: the batch grows while there is
+# a backlog of items waiting, and shrinks back when the queue is drained
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 5000
+# smoothing factor for the moving average of the insert latency
+LATENCY_SMOOTHING = 0.2
+# how many executions to keep cached, and for how long (in seconds)
+# to remember that an execution doesn't exist
+EXECUTIONS_CACHE_SIZE = 1000
+MISSING_EXECUTION_TTL = 1
+# bounds for the delay between attempts to reconnect to the db, while
+# the items are being spooled to disk
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
 
 EVENT_INSERT_QUERY = """
     INSERT INTO events (
@@ -91,6 +113,82 @@ LOG_VALUES_TEMPLATE = """(
     )
 """
 
+# The COPY variants of the queries above. COPY can't evaluate expressions,
+# so the insertion timestamp is fetched from the db beforehand (see
+# DB_NOW_QUERY), and passed in as the first column of every row.
+# The *_COPY_FIELDS lists are the keys of the items, in column order.
+EVENT_COPY_QUERY = """
+    COPY events (
+        timestamp,
+        reported_timestamp,
+        _execution_fk,
+        _tenant_id,
+        _creator_id,
+        event_type,
+        message,
+        message_code,
+        operation,
+        node_id,
+        error_causes,
+        visibility,
+        source_id,
+        target_id)
+    FROM STDIN
+"""
+
+EVENT_COPY_FIELDS = [
+    'timestamp',
+    'execution_id',
+    'tenant_id',
+    'creator_id',
+    'event_type',
+    'message',
+    'message_code',
+    'operation',
+    'node_id',
+    'error_causes',
+    'visibility',
+    'source_id',
+    'target_id',
+]
+
+LOG_COPY_QUERY = """
+    COPY logs (
+        timestamp,
+        reported_timestamp,
+        _execution_fk,
+        _tenant_id,
+        _creator_id,
+        logger,
+        level,
+        message,
+        message_code,
+        operation,
+        node_id,
+        visibility,
+        source_id,
+        target_id)
+    FROM STDIN
+"""
+
+LOG_COPY_FIELDS = [
+    'timestamp',
+    'execution_id',
+    'tenant_id',
+    'creator_id',
+    'logger',
+    'level',
+    'message',
+    'message_code',
+    'operation',
+    'node_id',
+    'visibility',
+    'source_id',
+    'target_id',
+]
+
+DB_NOW_QUERY = "SELECT now() at time zone 'utc'"
+
 EXECUTION_SELECT_QUERY = """
     SELECT
         id,
@@ -102,6 +200,17 @@ EXECUTION_SELECT_QUERY = """
     WHERE id = %s
 """
 
+EXECUTIONS_SELECT_QUERY = """
+    SELECT
+        id,
+        _storage_id,
+        _creator_id,
+        _tenant_id,
+        visibility
+    FROM executions
+    WHERE id = ANY(%s)
+"""
+
 
 def _strip_nul(text):
     """Remove NUL values from the text, so that it can be treated as text
@@ -111,34 +220,82 @@ def _strip_nul(text):
     return text.replace('\x00', '<NUL>')
 
 
+_COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+})
+
+
+def _copy_value(value):
+    """Format a single value for the COPY text format"""
+    if value is None:
+        return '\\N'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class DBConnectionLost(Exception):
+    """The db connection failed while storing a batch.
+
+    unstored are the items of the batch that were not stored yet; they
+    can be retried once the db is available again.
+    """
+    def __init__(self, error, unstored):
+        super().__init__(error)
+        self.error = error
+        self.unstored = list(unstored)
+
+
+def _copy_rows(rows, fields, timestamp):
+    """Prepare the COPY input for the given rows.
+
+    Each row is prefixed with the insertion timestamp, followed by the
+    values of fields, in order.
+    """
+    buf = io.StringIO()
+    prefix = _copy_value(timestamp)
+    for row in rows:
+        buf.write(prefix)
+        for field in fields:
+            buf.write('\t')
+            buf.write(_copy_value(row[field]))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
 class DBLogEventPublisher(object):
+    # initial estimate of how long storing a batch takes; this is then
+    # adjusted based on the observed insert latency
     COMMIT_DELAY = 0.1  # seconds
 
-    def __init__(self, config, connection):
+    def __init__(self, config, connection, use_copy=False, spool=None):
         self._lock = Lock()
         self._batch = queue.Queue()
 
         self._last_commit = time()
+        self._batch_size = MIN_BATCH_SIZE
+        self._insert_latency = self.COMMIT_DELAY
         self.config = config
         self._amqp_connection = connection
+        # use COPY instead of multi-row INSERTs for storing the batches
+        self.use_copy = use_copy
+        # a DiskSpool, keeping the items while the db is unavailable;
+        # without it, losing the db connection is fatal
+        self._spool = spool
+        # are there any items in the spool, waiting to be replayed
+        self._spooled = spool is not None and spool.size() > 0
+        self._reconnect_delay = MIN_RECONNECT_DELAY
+        self._next_reconnect = 0
         self._started = queue.Queue()
         self._reset_cache()
         # exception stored here will be raised by the main thread
         self.error_exit = None
 
     def _reset_cache(self):
-        self._executions_cache = LimitedSizeDict(100)
-
-    def _sanitize_cache(self):
-        """Drop None executions from the cache.
-
-        This is to be run after every batch of items, so that the cached
-        result that "the execution doesn't exist" can be dropped, because
-        the execution might well exist on the next batch.
-        """
-        for key, execution in list(self._executions_cache.items()):
-            if execution is None:
-                self._executions_cache.pop(key)
+        self._executions_cache = ExecutionsCache(
+            EXECUTIONS_CACHE_SIZE, MISSING_EXECUTION_TTL)
 
     def start(self):
         self.error_exit = None
@@ -158,8 +315,13 @@ class DBLogEventPublisher(object):
                 raise started
 
     def process(self, message, exchange, tag):
+        metrics.messages_consumed.labels(exchange=exchange).inc()
         self._batch.put((message, exchange, tag))
 
+    def backlog(self):
+        """Number of messages received, but not yet stored"""
+        return self._batch.qsize()
+
     def connect(self):
         with setup_flask_app().app_context():
             db_url = self.config.db_url
@@ -176,35 +338,247 @@ class DBLogEventPublisher(object):
         try:
             conn = self.connect()
         except psycopg2.OperationalError as e:
-            self._started.put(e)
-            self.on_db_connection_error(e)
-        else:
-            self._started.put(True)
+            if self._spool is None:
+                self._started.put(e)
+                self.on_db_connection_error(e)
+            logger.error('Cannot connect to the database, spooling logs '
+                         'and events to %s: %s', self._spool.path, e)
+            conn = None
+            self._schedule_reconnect()
+        self._started.put(True)
         items = []
         while True:
+            if items:
+                timeout = max(
+                    self._last_commit + self._flush_interval() - time(), 0)
+            else:
+                timeout = BATCH_DELAY
             try:
-                items.append(self._batch.get(timeout=BATCH_DELAY / 2))
+                items.append(self._batch.get(timeout=timeout))
             except queue.Empty:
                 pass
-            if len(items) > 100 or \
-                    (items and (time() - self._last_commit > BATCH_DELAY)):
+            if conn is None and time() >= self._next_reconnect:
+                conn = self._reconnect()
+            if conn is not None and self._spooled:
+                conn = self._replay_spool(conn)
+            self._fill_batch(items)
+            if not items:
+                continue
+            if len(items) < self._batch_size and \
+                    time() - self._last_commit < self._flush_interval():
+                continue
+            if conn is None:
+                self._spool_items(items)
+                items = []
+                self._last_commit = time()
+                continue
+            started = time()
+            try:
+                self._store_batch(conn, items)
+            except DBConnectionLost as e:
+                conn = self._on_connection_lost(conn, e)
+                items = []
+                self._last_commit = time()
+                continue
+            duration = time() - started
+            metrics.batch_size.observe(len(items))
+            metrics.insert_latency.observe(duration)
+            self._adapt_batching(len(items), duration)
+            items = []
+            self._last_commit = time()
+
+    def _schedule_reconnect(self):
+        self._next_reconnect = time() + self._reconnect_delay
+        self._reconnect_delay = min(
+            self._reconnect_delay * 2, MAX_RECONNECT_DELAY)
+
+    def _reconnect(self):
+        """Try to connect to the db again, returning None on failure"""
+        try:
+            conn = self.connect()
+        except psycopg2.OperationalError as e:
+            logger.debug('Still cannot connect to the database: %s', e)
+            self._schedule_reconnect()
+            return None
+        logger.warning('Database connection restored')
+        self._reconnect_delay = MIN_RECONNECT_DELAY
+        return conn
+
+    def _on_connection_lost(self, conn, error):
+        """Spool the unstored items, after losing the db connection.
+
+        This is fatal if there's no spool, or the spool is full.
+        """
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._spool_items(error.unstored, error.error)
+        logger.error('Database connection lost, spooling logs and events '
+                     'to %s: %s', self._spool.path, error.error)
+        self._schedule_reconnect()
+        return None
+
+    def _spool_items(self, items, error=None):
+        try:
+            appended = self._spool is not None and self._spool.append(
+                (message, exchange) for message, exchange, _ in items)
+        except OSError as e:
+            logger.error('Cannot write to the spool %s: %s',
+                         self._spool.path, e)
+            self.on_db_connection_error(e)
+        if not appended:
+            self.on_db_connection_error(
+                error or RuntimeError('Logs and events spool is full'))
+        self._spooled = True
+        # the items are safely on disk now, so the broker can let go
+        # of them
+        for _, _, ack in items:
+            self._amqp_connection.acks_queue.put(ack)
+
+    def _replay_spool(self, conn):
+        """Store all the spooled items, in batches of the maximum size.
+
+        Returns the connection, or None if it was lost again; in that case,
+        the replay resumes after the last stored item, after reconnecting.
+        """
+        logger.info('Replaying %d bytes of spooled logs and events',
+                    self._spool.size())
+        try:
+            for chunk in self._spool.replay(MAX_BATCH_SIZE):
+                self._store_batch(conn, chunk)
+        except OSError as e:
+            logger.error('Cannot read the spool %s: %s', self._spool.path, e)
+            self.on_db_connection_error(e)
+        except DBConnectionLost as e:
+            logger.error('Database connection lost while replaying the '
+                         'spool: %s', e.error)
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+            self._schedule_reconnect()
+            return None
+        self._spooled = False
+        logger.info('Spooled logs and events replayed')
+        return conn
+
+    def _fill_batch(self, items):
+        """Add all the already-waiting items to the batch, up to its size"""
+        while len(items) < self._batch_size:
+            try:
+                items.append(self._batch.get_nowait())
+            except queue.Empty:
+                return
+
+    def _flush_interval(self):
+        """Minimum time between storing two consecutive batches.
+
+        This is about as long as storing a batch takes, so that under load,
+        the items pile up while the previous batch is being committed, and
+        the commit cost is amortized over many items. When idle, the last
+        commit was long ago, so a single item is stored right away.
+        """
+        return min(self._insert_latency, BATCH_DELAY)
+
+    def _adapt_batching(self, stored, duration):
+        """Adjust batch size and flush interval after storing a batch.
+
+        :param stored: number of items in the batch that was just stored
+        :param duration: how long it took to store the batch, in seconds
+        """
+        self._insert_latency += \
+            LATENCY_SMOOTHING * (duration - self._insert_latency)
+        backlog = self._batch.qsize()
+        if backlog >= self._batch_size:
+            self._batch_size = min(self._batch_size * 2, MAX_BATCH_SIZE)
+        elif not backlog and stored < self._batch_size // 4:
+            self._batch_size = max(self._batch_size // 2, MIN_BATCH_SIZE)
+
+    def _store_batch(self, conn, items):
+        try:
+            self._store(conn, items)
+        except psycopg2.OperationalError as e:
+            raise DBConnectionLost(e, items)
+        except Exception:
+            logger.info('Error storing %d logs+events in batch',
+                        len(items))
+            conn.rollback()
+            # in case the integrityError was caused by stale cache,
+            # clean it entirely before trying to insert the batch
+            # again, in parts.
+            # This happens rarely.
+            self._reset_cache()
+            self._store_bisect(conn, items)
+
+    def _store_bisect(self, conn, items):
+        """Store items that failed to be stored as a single batch.
+
+        The items are split in halves, and each half is stored as a batch.
+        Halves that fail again are split further, so that the erroneous
+        items are isolated in O(log n) attempts, while all the others are
+        still stored in bulk. Single items are passed to _store_nobatch,
+        which drops them if they can't be stored.
+        """
+        if len(items) <= 1:
+            self._store_nobatch(conn, items)
+            return
+        middle = len(items) // 2
+        halves = [items[:middle], items[middle:]]
+        for index, half in enumerate(halves):
+            try:
+                if len(half) == 1:
+                    self._store_nobatch(conn, half)
+                    continue
                 try:
-                    self._store(conn, items)
+                    self._store(conn, half)
                 except psycopg2.OperationalError as e:
-                    self.on_db_connection_error(e)
+                    raise DBConnectionLost(e, half)
                 except Exception:
-                    logger.info('Error storing %d logs+events in batch',
-                                len(items))
                     conn.rollback()
-                    # in case the integrityError was caused by stale cache,
-                    # clean it entirely before trying to insert without
-                    # batching.
-                    # This happens rarely.
-                    self._reset_cache()
-                    self._store_nobatch(conn, items)
-                items = []
-                self._last_commit = time()
-                self._sanitize_cache()
+                    self._store_bisect(conn, half)
+            except DBConnectionLost as e:
+                for later_half in halves[index + 1:]:
+                    e.unstored.extend(later_half)
+                raise
+
+    def _prefetch_executions(self, conn, items):
+        """Fetch all the executions of items that aren't cached yet.
+
+        This uses a single query for the whole batch, so that
+        _get_execution can then be served from the cache.
+        """
+        unknown = set()
+        hits = 0
+        for message, _, _ in items:
+            try:
+                execution_id = message['context']['execution_id']
+            except (KeyError, TypeError):
+                continue
+            if execution_id in unknown:
+                continue
+            if execution_id in self._executions_cache:
+                hits += 1
+            else:
+                unknown.add(execution_id)
+        metrics.execution_cache_hits.inc(hits)
+        metrics.execution_cache_misses.inc(len(unknown))
+        if not unknown:
+            return
+        with conn.cursor() as cur:
+            cur.execute(EXECUTIONS_SELECT_QUERY, (list(unknown), ))
+            rows = cur.fetchall()
+        executions = defaultdict(list)
+        for row in rows:
+            executions[row['id']].append(row)
+        for execution_id in unknown:
+            found = executions.get(execution_id)
+            if not found:
+                self._executions_cache[execution_id] = None
+            elif len(found) == 1:
+                self._executions_cache[execution_id] = found[0]
+            # else: ambiguous id, don't cache it, and let _get_execution
+            # report the error
 
     def _get_execution(self, conn, execution_id):
         if execution_id not in self._executions_cache:
@@ -240,6 +614,7 @@ class DBLogEventPublisher(object):
         events, logs = [], []
 
         acks = []
+        self._prefetch_executions(conn, items)
         for message, exchange, ack in items:
             acks.append(ack)
             item = self._get_db_item(conn, message, exchange)
@@ -253,28 +628,54 @@ class DBLogEventPublisher(object):
             self._insert_logs(cur, logs)
         logger.debug('commit %s', len(logs) + len(events))
         conn.commit()
+        metrics.rows_inserted.labels(table='events').inc(len(events))
+        metrics.rows_inserted.labels(table='logs').inc(len(logs))
+        self._ack(acks)
+
+    def _ack(self, acks):
+        """Let go of items that were stored, or dropped for good.
+
+        Items received from the broker are acked to it. Items replayed
+        from the spool carry their SpoolPosition instead, and the spool's
+        position is moved past them, so that they're not stored again if
+        the replay is interrupted.
+        """
+        position = None
         for ack in acks:
-            self._amqp_connection.acks_queue.put(ack)
+            if isinstance(ack, SpoolPosition):
+                position = ack
+            elif ack is not None:
+                self._amqp_connection.acks_queue.put(ack)
+        if position is not None:
+            position.spool.commit(position.offset)
 
     def _store_nobatch(self, conn, items):
         """Store the items one by one, without batching.
 
-        This is to be used in the anomalous cases where inserting the whole
+        This is to be used in the anomalous cases where inserting a
         batch throws an IntegrityError - we fall back to inserting the items
         one by one, so that only the erroneous message is dropped.
         """
-        for message, exchange, ack in items:
-            item = self._get_db_item(conn, message, exchange)
-            if item is None:
-                continue
-            insert = (self._insert_events if exchange == EVENTS_EXCHANGE_NAME
-                      else self._insert_logs)
+        metrics.fallback_stores.inc()
+        try:
+            self._prefetch_executions(conn, items)
+        except psycopg2.OperationalError as e:
+            raise DBConnectionLost(e, items)
+        for index, (message, exchange, ack) in enumerate(items):
+            item = None
             try:
-                with conn.cursor() as cur:
-                    insert(cur, [item])
-                conn.commit()
+                item = self._get_db_item(conn, message, exchange)
+                if item is not None:
+                    if exchange == EVENTS_EXCHANGE_NAME:
+                        insert, table = self._insert_events, 'events'
+                    else:
+                        insert, table = self._insert_logs, 'logs'
+                    with conn.cursor() as cur:
+                        insert(cur, [item])
+                    conn.commit()
+                    metrics.rows_inserted.labels(table=table).inc()
             except psycopg2.OperationalError as e:
-                self.on_db_connection_error(e)
+                raise DBConnectionLost(e, items[index:])
             except (psycopg2.IntegrityError, ValueError):
                 logger.debug('Error storing %s: %s', exchange, item)
                 conn.rollback()
@@ -290,18 +691,38 @@ class DBLogEventPublisher(object):
                 logger.exception('Unexpected error while storing %s: %s',
                                  exchange, item)
                 conn.rollback()
+            # the item was either stored, or it's dropped for good - either
+            # way, it's done with
+            self._ack([ack])
 
     def _insert_events(self, cursor, events):
         if not events:
             return
-        execute_values(cursor, EVENT_INSERT_QUERY, events,
-                       template=EVENT_VALUES_TEMPLATE)
+        if self.use_copy:
+            self._copy(cursor, EVENT_COPY_QUERY, EVENT_COPY_FIELDS, events)
+        else:
+            execute_values(cursor, EVENT_INSERT_QUERY, events,
+                           template=EVENT_VALUES_TEMPLATE)
 
     def _insert_logs(self, cursor, logs):
         if not logs:
             return
-        execute_values(cursor, LOG_INSERT_QUERY, logs,
-                       template=LOG_VALUES_TEMPLATE)
+        if self.use_copy:
+            self._copy(cursor, LOG_COPY_QUERY, LOG_COPY_FIELDS, logs)
+        else:
+            execute_values(cursor, LOG_INSERT_QUERY, logs,
+                           template=LOG_VALUES_TEMPLATE)
+
+    def _copy(self, cursor, query, fields, items):
+        """Store items using COPY FROM STDIN.
+
+        The rows are the same as the ones created by the INSERT queries:
+        the insertion timestamp is the db's now(), which is the transaction
+        start time, so it's fetched first in the same transaction.
+        """
+        cursor.execute(DB_NOW_QUERY)
+        timestamp = cursor.fetchone()[0]
+        cursor.copy_expert(query, _copy_rows(items, fields, timestamp))
 
     def on_db_connection_error(self, err):
         logger.critical('Database down - cannot continue')
@@ -359,22 +780,253 @@ class DBLogEventPublisher(object):
             return None
 
 
-class LimitedSizeDict(OrderedDict):
+class ShardedDBLogEventPublisher(object):
+    """Store logs and events using several db connections in parallel.
+
+    Each of the underlying DBLogEventPublishers has its own thread and
+    its own db connection. Messages are sharded by execution id, so that
+    all items of a single execution are stored by the same publisher,
+    keeping their order, while different executions are stored in parallel.
     """
-    A FIFO dictionary with a maximum size limit. If number of keys reaches
-    the limit, the elements added first will be popped
-    Implementation taken from https://stackoverflow.com/a/2437645/978089
+    def __init__(self, config, connection, writers, spool=None, **kwargs):
+        if writers < 1:
+            raise ValueError('At least one writer is required, got {0}'
+                             .format(writers))
+        self._publishers = [
+            DBLogEventPublisher(
+                config, connection,
+                spool=shard_spool,
+                **kwargs)
+            for shard_spool in (
+                spool.shards(writers) if spool else [None] * writers)
+        ]
+
+    @property
+    def error_exit(self):
+        for publisher in self._publishers:
+            if publisher.error_exit:
+                return publisher.error_exit
+        return None
+
+    def start(self):
+        for publisher in self._publishers:
+            publisher.start()
+
+    def _get_shard(self, message):
+        try:
+            execution_id = message['context']['execution_id']
+        except (KeyError, TypeError):
+            # malformed message: it will be dropped by whichever
+            # publisher gets it anyway
+            execution_id = None
+        # a stable hash, unlike hash(), which is randomized per process
+        shard = zlib.crc32(str(execution_id).encode('utf-8'))
+        return self._publishers[shard % len(self._publishers)]
+
+    def process(self, message, exchange, tag):
+        self._get_shard(message).process(message, exchange, tag)
+
+    def backlog(self):
+        return sum(publisher.backlog() for publisher in self._publishers)
+
+
+class ExecutionsCache(object):
+    """A LRU cache of executions, that also remembers missing executions.
+
+    Executions that were found are kept until they become the least
+    recently used ones, and the cache is full. Executions that were not
+    found (stored as None) are only remembered for a short while, because
+    they might be created any moment.
     """
-    def __init__(self, size_limit=None, *args, **kwds):
+    def __init__(self, size_limit, missing_ttl):
         self.size_limit = size_limit
-        OrderedDict.__init__(self, *args, **kwds)
-        self._check_size_limit()
+        self.missing_ttl = missing_ttl
+        self._executions = OrderedDict()
+        self._missing = {}
+
+    def __contains__(self, key):
+        if key in self._executions:
+            return True
+        expires = self._missing.get(key)
+        if expires is None:
+            return False
+        if expires < time():
+            del self._missing[key]
+            return False
+        return True
+
+    def __getitem__(self, key):
+        if key in self._executions:
+            self._executions.move_to_end(key)
+            return self._executions[key]
+        if key in self._missing:
+            return None
+        raise KeyError(key)
+
+    def __setitem__(self, key, execution):
+        if execution is None:
+            self._executions.pop(key, None)
+            if len(self._missing) >= self.size_limit:
+                self._drop_expired()
+            self._missing[key] = time() + self.missing_ttl
+            return
+        self._missing.pop(key, None)
+        self._executions[key] = execution
+        self._executions.move_to_end(key)
+        while len(self._executions) > self.size_limit:
+            self._executions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._executions) + len(self._missing)
+
+    def _drop_expired(self):
+        now = time()
+        for key, expires in list(self._missing.items()):
+            if expires < now:
+                del self._missing[key]
+
+
+SpoolPosition = namedtuple('SpoolPosition', ['spool', 'offset'])
 
-    def __setitem__(self, key, value):
-        OrderedDict.__setitem__(self, key, value)
-        self._check_size_limit()
 
-    def _check_size_limit(self):
-        if self.size_limit is not None:
-            while len(self) > self.size_limit:
-                self.popitem(last=False)
+class DiskSpool(object):
+    """An append-only file of messages, kept while the db is unavailable.
+
+    Messages are appended as JSON lines, and fsynced before returning,
+    so that they can be acked to the broker. The file is bounded by
+    max_size (in bytes): when it's full, appending fails.
+    Replaying remembers its position in a separate file, as the replayed
+    messages are committed, so that a replay that was interrupted (eg. by
+    the db going down again) doesn't store the same messages twice.
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.offset_path = f'{path}.offset'
+        self.max_size = max_size
+        # spools left over by a previous run, with a different number
+        # of writers; these are replayed first
+        self.leftovers = []
+
+    def shards(self, count):
+        """Separate spools for each of count writers, sharing the limit.
+
+        A single writer uses the path as is, and several writers use
+        numbered paths. Spools that a previous run left behind, using a
+        different number of writers, are replayed by the first writer.
+        """
+        if count == 1:
+            spools = [DiskSpool(self.path, self.max_size)]
+        else:
+            spools = [
+                DiskSpool(f'{self.path}.{index}', self.max_size // count)
+                for index in range(count)
+            ]
+        in_use = {spool.path for spool in spools}
+        spools[0].leftovers = [
+            DiskSpool(path, self.max_size)
+            for path in self._existing_paths() if path not in in_use
+        ]
+        return spools
+
+    def _existing_paths(self):
+        """Paths of the spools of any number of writers, that exist"""
+        paths = sorted(
+            path for path in glob.glob(f'{glob.escape(self.path)}.*')
+            if path[len(self.path) + 1:].isdigit()
+        )
+        if os.path.exists(self.path):
+            paths.insert(0, self.path)
+        return paths
+
+    def size(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        return size + sum(spool.size() for spool in self.leftovers)
+
+    def append(self, messages):
+        """Durably append the (message, exchange) pairs.
+
+        :return: False if there's not enough room left in the spool
+        """
+        data = ''.join(
+            json.dumps({'message': message, 'exchange': exchange}) + '\n'
+            for message, exchange in messages
+        ).encode('utf-8')
+        if not data:
+            return True
+        if self.size() + len(data) > self.max_size:
+            return False
+        with open(self.path, 'ab+') as f:
+            if f.tell():
+                # terminate a partial line, left by an interrupted write
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+    def replay(self, chunk_size):
+        """Yield lists of the spooled (message, exchange, position), in order.
+
+        The caller commits the position of the messages it has processed,
+        and once it asks for the next chunk, the whole previous chunk is
+        considered processed. When all the chunks have been processed,
+        the spool is cleared.
+        """
+        for spool in self.leftovers:
+            logger.info('Replaying the leftover spool %s', spool.path)
+            yield from spool.replay(chunk_size)
+        self.leftovers = []
+        if not self.size():
+            return
+        with open(self.path, 'rb') as f:
+            offset = self._read_offset()
+            f.seek(offset)
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    break
+                chunk = []
+                for line in lines:
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                        chunk.append((entry['message'], entry['exchange'],
+                                      SpoolPosition(self, offset)))
+                    except (ValueError, KeyError, TypeError):
+                        # most likely a partial write, when the process
+                        # was killed while spooling
+                        logger.warning('Skipping malformed spool entry: %r',
+                                       line)
+                if chunk:
+                    yield chunk
+                self.commit(offset)
+        self.clear()
+
+    def commit(self, offset):
+        """Mark the messages before offset as processed"""
+        self._write_offset(offset)
+
+    def clear(self):
+        for path in (self.path, self.offset_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset):
+        tmp_path = f'{self.offset_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.offset_path)
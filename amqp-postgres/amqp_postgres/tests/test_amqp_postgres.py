@@ -14,9 +14,18 @@
 # limitations under the License.
 ############
 
+import os
 import mock
+import queue
+import shutil
+import psycopg2
+import sqlalchemy
+import tempfile
+import unittest
+import zlib
+from prometheus_client import REGISTRY
 from uuid import uuid4
-from time import sleep
+from time import sleep, time
 from dateutil import parser as date_parser
 
 from cloudify.models_states import VisibilityState
@@ -27,26 +36,46 @@ from manager_rest.amqp_manager import AMQPManager
 from manager_rest.utils import get_formatted_timestamp
 from manager_rest.test.base_test import BaseServerTestCase
 
-from amqp_postgres.postgres_publisher import BATCH_DELAY, DBLogEventPublisher
+from amqp_postgres import main
+from amqp_postgres.amqp_consumer import (
+    AckingAMQPConnection,
+    AMQPLogsEventsConsumer,
+)
+from amqp_postgres.postgres_publisher import (
+    BATCH_DELAY,
+    MAX_BATCH_SIZE,
+    MIN_BATCH_SIZE,
+    DBConnectionLost,
+    DBLogEventPublisher,
+    DiskSpool,
+    ExecutionsCache,
+    ShardedDBLogEventPublisher,
+)
 
 LOG_MESSAGE = 'cloudify-logs'
 EVENT_MESSAGE = 'cloudify-events-topic'
 
 
 class TestAMQPPostgres(BaseServerTestCase):
+    use_copy = False
+
     def setUp(self):
         super(TestAMQPPostgres, self).setUp()
         self._mock_amqp_conn = mock.Mock()
-        self.db_publisher = DBLogEventPublisher(
-            self.server_configuration, self._mock_amqp_conn)
+        self.db_publisher = self._make_publisher()
         self.db_publisher.start()
 
+    def _make_publisher(self):
+        return DBLogEventPublisher(
+            self.server_configuration, self._mock_amqp_conn,
+            use_copy=self.use_copy)
+
     def publish_messages(self, messages):
         for message, message_type in messages:
             self.db_publisher.process(message, message_type, 0)
 
-        # The messages are dumped to the DB every BATCH_DELAY seconds, so
-        # we should wait before trying to query SQL
+        # The messages are dumped to the DB at most BATCH_DELAY seconds after
+        # being received, so we should wait before trying to query SQL
         sleep(BATCH_DELAY * 2)
 
     def test_insert(self):
@@ -100,6 +129,78 @@ class TestAMQPPostgres(BaseServerTestCase):
 
         self._assert_log(log_2, execution_2_logs[0])
 
+    def test_insert_special_characters(self):
+        execution_id = str(uuid4())
+        self._create_execution(execution_id)
+        message = 'tab\there\nnewline\r\\N backslash \\ zażółć'
+
+        log = self._get_log(execution_id, message=message)
+        event = self._get_event(execution_id, message=message)
+        event['context']['task_error_causes'] = [
+            {'message': message, 'traceback': 'a\nb', 'type': 'Error'}]
+
+        self.publish_messages([
+            (event, EVENT_MESSAGE),
+            (log, LOG_MESSAGE)
+        ])
+
+        db_log = self._get_db_element(models.Log)
+        db_event = self._get_db_element(models.Event)
+        self.assertEqual(db_log.message, message)
+        self.assertEqual(db_event.message, message)
+        self.assertEqual(db_event.error_causes,
+                         event['context']['task_error_causes'])
+
+    def test_insert_order(self):
+        execution_ids = [str(uuid4()) for _ in range(5)]
+        for execution_id in execution_ids:
+            self._create_execution(execution_id)
+
+        logs = {
+            execution_id: [self._get_log(execution_id, message=str(i))
+                           for i in range(20)]
+            for execution_id in execution_ids
+        }
+        self.publish_messages([
+            (logs[execution_id][i], LOG_MESSAGE)
+            for i in range(20)
+            for execution_id in execution_ids
+        ])
+
+        for execution_id in execution_ids:
+            db_logs = self.sm.list(
+                models.Log,
+                filters={'execution_id': execution_id},
+                sort={'_storage_id': 'asc'},
+                get_all_results=True,
+            )
+            self.assertEqual([log.message for log in db_logs],
+                             [str(i) for i in range(20)])
+
+    def test_adaptive_batching(self):
+        publisher = DBLogEventPublisher(
+            self.server_configuration, self._mock_amqp_conn)
+        self.assertEqual(publisher._batch_size, MIN_BATCH_SIZE)
+
+        # there's a backlog: the batches grow, up to the max size
+        for _ in range(MAX_BATCH_SIZE):
+            publisher.process({}, LOG_MESSAGE, 0)
+        publisher._adapt_batching(MIN_BATCH_SIZE, 1)
+        self.assertEqual(publisher._batch_size, MIN_BATCH_SIZE * 2)
+        for _ in range(10):
+            publisher._adapt_batching(publisher._batch_size, 1)
+        self.assertEqual(publisher._batch_size, MAX_BATCH_SIZE)
+        # ...and the flush interval follows the insert latency
+        self.assertEqual(publisher._flush_interval(), BATCH_DELAY)
+
+        # the queue is drained, and the batches are small: shrink back
+        while not publisher._batch.empty():
+            publisher._batch.get_nowait()
+        for _ in range(20):
+            publisher._adapt_batching(1, 0.001)
+        self.assertEqual(publisher._batch_size, MIN_BATCH_SIZE)
+        self.assertLess(publisher._flush_interval(), 0.1)
+
     @staticmethod
     def _get_amqp_manager():
         return AMQPManager(
@@ -206,3 +307,438 @@ class TestAMQPPostgres(BaseServerTestCase):
             },
             'timestamp': get_formatted_timestamp()
         }
+
+
+class TestAMQPPostgresCopy(TestAMQPPostgres):
+    """Run the same tests, but storing the items using COPY"""
+    use_copy = True
+
+
+class TestShardedAMQPPostgres(TestAMQPPostgres):
+    """Run the same tests, but storing the items using several writers"""
+    def _make_publisher(self):
+        return ShardedDBLogEventPublisher(
+            self.server_configuration, self._mock_amqp_conn, 3,
+            use_copy=self.use_copy)
+
+    def test_sharding(self):
+        execution_id = str(uuid4())
+        shard = self.db_publisher._get_shard(
+            self._get_log(execution_id))
+        for _ in range(10):
+            self.assertIs(
+                self.db_publisher._get_shard(self._get_log(execution_id)),
+                shard)
+            self.assertIs(
+                self.db_publisher._get_shard(self._get_event(execution_id)),
+                shard)
+
+    def test_sharding_stable(self):
+        # the same in every process, regardless of hash randomization
+        self.assertIs(
+            self.db_publisher._get_shard(self._get_log('execution1')),
+            self.db_publisher._publishers[
+                zlib.crc32(b'execution1') % 3])
+
+
+class TestExecutionsCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ExecutionsCache(2, 10)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        # b was the least recently used one
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache['c'], 3)
+
+    def test_missing_expires(self):
+        cache = ExecutionsCache(2, 10)
+        cache['a'] = None
+        self.assertIn('a', cache)
+        self.assertIsNone(cache['a'])
+        with mock.patch('amqp_postgres.postgres_publisher.time',
+                        return_value=time() + 20):
+            self.assertNotIn('a', cache)
+
+    def test_missing_replaced(self):
+        cache = ExecutionsCache(2, 10)
+        cache['a'] = None
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        cache['a'] = None
+        self.assertIsNone(cache['a'])
+
+    def test_prefetch_single_query(self):
+        publisher = DBLogEventPublisher(mock.Mock(), mock.Mock())
+        conn = mock.MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [
+            {'id': 'exc{0}'.format(i), '_storage_id': i}
+            for i in range(0, 10, 2)
+        ]
+        items = [
+            ({'context': {'execution_id': 'exc{0}'.format(i)}},
+             LOG_MESSAGE, 0)
+            for i in range(10)
+        ]
+        publisher._prefetch_executions(conn, items)
+        self.assertEqual(cursor.execute.call_count, 1)
+        for i in range(10):
+            execution = publisher._get_execution(conn, 'exc{0}'.format(i))
+            if i % 2:
+                self.assertIsNone(execution)
+            else:
+                self.assertEqual(execution['_storage_id'], i)
+        # everything was served from the cache
+        self.assertEqual(cursor.execute.call_count, 1)
+
+        # all known now - no more queries
+        publisher._prefetch_executions(conn, items)
+        self.assertEqual(cursor.execute.call_count, 1)
+
+
+def _log_items(count, invalid=()):
+    return [
+        ({
+            'context': {'execution_id': 'exc1'},
+            'level': 'info',
+            'logger': 'logger',
+            'message': {
+                'text': 'invalid' if i in invalid else str(i)
+            },
+            'timestamp': '2023-01-01T00:00:00.000Z',
+        }, LOG_MESSAGE, i)
+        for i in range(count)
+    ]
+
+
+def _cache_execution(publisher):
+    publisher._executions_cache['exc1'] = {
+        '_storage_id': 1,
+        '_tenant_id': 0,
+        '_creator_id': 0,
+        'visibility': VisibilityState.TENANT,
+    }
+
+
+class TestBisectingFallback(unittest.TestCase):
+    def setUp(self):
+        self.publisher = DBLogEventPublisher(mock.Mock(), mock.Mock())
+        _cache_execution(self.publisher)
+        self.conn = mock.MagicMock()
+        self.stored = []
+        self.inserts = 0
+
+    def _insert_logs(self, cursor, logs):
+        self.inserts += 1
+        if any(log['message'] == 'invalid' for log in logs):
+            raise psycopg2.IntegrityError()
+        self.stored.extend(log['message'] for log in logs)
+
+    def _get_items(self, count, invalid=()):
+        return _log_items(count, invalid)
+
+    def _store_batch(self, items):
+        acks = self.publisher._amqp_connection.acks_queue
+        with mock.patch.object(self.publisher, '_insert_logs',
+                               self._insert_logs), \
+                mock.patch.object(self.publisher, '_reset_cache'):
+            self.publisher._store_batch(self.conn, items)
+        return sorted(c[0][0] for c in acks.put.call_args_list)
+
+    def test_single_invalid_row(self):
+        items = self._get_items(1000, invalid={537})
+        acked = self._store_batch(items)
+        self.assertEqual(
+            self.stored, [str(i) for i in range(1000) if i != 537])
+        # all messages are done with, including the invalid one
+        self.assertEqual(acked, list(range(1000)))
+        # the failed batch, then 2 attempts on each level of the bisection
+        self.assertLessEqual(self.inserts, 1 + 2 * 10)
+
+    def test_several_invalid_rows(self):
+        invalid = {0, 1, 500, 999}
+        items = self._get_items(1000, invalid=invalid)
+        acked = self._store_batch(items)
+        self.assertEqual(
+            self.stored, [str(i) for i in range(1000) if i not in invalid])
+        self.assertEqual(acked, list(range(1000)))
+        self.assertLess(self.inserts, 100)
+
+    def test_metrics(self):
+        def _sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        stored_before = _sample(
+            'amqp_postgres_rows_inserted_total', table='logs')
+        fallbacks_before = _sample('amqp_postgres_fallback_stores_total')
+        self._store_batch(self._get_items(10, invalid={3}))
+        self.assertEqual(
+            _sample('amqp_postgres_rows_inserted_total', table='logs'),
+            stored_before + 9)
+        self.assertGreater(
+            _sample('amqp_postgres_fallback_stores_total'), fallbacks_before)
+
+
+class TestDiskSpool(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.spool = DiskSpool(os.path.join(tmpdir, 'spool'), 1024 ** 2)
+
+    def _messages(self, start, count):
+        return [
+            ({'message': {'text': str(i)}}, LOG_MESSAGE)
+            for i in range(start, start + count)
+        ]
+
+    @staticmethod
+    def _replayed(chunks):
+        return [
+            (message, exchange)
+            for chunk in chunks for message, exchange, _ in chunk
+        ]
+
+    def test_replay(self):
+        self.assertTrue(self.spool.append(self._messages(0, 5)))
+        self.assertTrue(self.spool.append(self._messages(5, 5)))
+        chunks = list(self.spool.replay(3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+        self.assertEqual(self._replayed(chunks), self._messages(0, 10))
+        self.assertEqual(self.spool.size(), 0)
+
+    def test_resume_replay(self):
+        self.spool.append(self._messages(0, 10))
+        replay = self.spool.replay(4)
+        next(replay)
+        # the second chunk is received, but never processed
+        next(replay)
+        replay.close()
+        chunks = list(self.spool.replay(4))
+        self.assertEqual(self._replayed(chunks), self._messages(4, 6))
+
+    def test_commit_position(self):
+        self.spool.append(self._messages(0, 10))
+        replay = self.spool.replay(4)
+        chunk = next(replay)
+        # only the first 2 items of the chunk were processed
+        _, _, position = chunk[1]
+        position.spool.commit(position.offset)
+        replay.close()
+        chunks = list(self.spool.replay(4))
+        self.assertEqual(self._replayed(chunks), self._messages(2, 8))
+
+    def test_max_size(self):
+        spool = DiskSpool(self.spool.path, 100)
+        self.assertFalse(spool.append(self._messages(0, 10)))
+        self.assertEqual(spool.size(), 0)
+
+    def test_partial_write(self):
+        self.spool.append(self._messages(0, 1))
+        with open(self.spool.path, 'ab') as f:
+            f.write(b'{"message": {"te')
+        self.spool.append(self._messages(1, 1))
+        chunks = list(self.spool.replay(10))
+        self.assertEqual(self._replayed(chunks), self._messages(0, 2))
+
+    def test_shards(self):
+        spools = self.spool.shards(3)
+        self.assertEqual(
+            [spool.path for spool in spools],
+            [f'{self.spool.path}.{index}' for index in range(3)])
+        self.assertEqual(spools[0].max_size, self.spool.max_size // 3)
+        self.assertEqual(self.spool.shards(1)[0].path, self.spool.path)
+
+    def test_replay_leftovers(self):
+        # spooled by a previous run with a single writer, and with 3
+        self.spool.append(self._messages(0, 2))
+        DiskSpool(f'{self.spool.path}.2', 1024).append(self._messages(2, 2))
+        spools = self.spool.shards(2)
+        self.assertEqual(
+            [spool.path for spool in spools[0].leftovers],
+            [self.spool.path, f'{self.spool.path}.2'])
+        self.assertEqual(spools[1].leftovers, [])
+        spools[0].append(self._messages(4, 2))
+
+        chunks = list(spools[0].replay(10))
+        self.assertEqual(self._replayed(chunks), self._messages(0, 6))
+        self.assertEqual(self.spool.shards(2)[0].leftovers, [])
+
+
+class TestSpooling(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.spool = DiskSpool(os.path.join(tmpdir, 'spool'), 1024 ** 2)
+        self.conn = mock.MagicMock()
+
+    def _make_publisher(self, spool):
+        publisher = DBLogEventPublisher(mock.Mock(), mock.Mock(), spool=spool)
+        _cache_execution(publisher)
+        # keep the cached execution, there's no db to fetch it from
+        patcher = mock.patch.object(publisher, '_reset_cache')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return publisher
+
+    def _lose_connection(self, publisher, items):
+        with mock.patch.object(publisher, '_insert_logs',
+                               side_effect=psycopg2.OperationalError()):
+            with self.assertRaises(DBConnectionLost) as cm:
+                publisher._store_batch(self.conn, items)
+        return publisher._on_connection_lost(self.conn, cm.exception)
+
+    def test_spool_and_replay(self):
+        publisher = self._make_publisher(self.spool)
+        self.assertIsNone(self._lose_connection(publisher, _log_items(10)))
+        acks = publisher._amqp_connection.acks_queue
+        # spooled items are done with, as far as the broker is concerned
+        self.assertEqual(
+            [c[0][0] for c in acks.put.call_args_list], list(range(10)))
+
+        stored = []
+        with mock.patch.object(
+                publisher, '_insert_logs',
+                lambda cursor, logs: stored.extend(
+                    log['message'] for log in logs)):
+            self.assertIs(publisher._replay_spool(self.conn), self.conn)
+        self.assertEqual(stored, [str(i) for i in range(10)])
+        # ...and they're not acked again when replayed
+        self.assertEqual(acks.put.call_count, 10)
+        self.assertEqual(self.spool.size(), 0)
+
+    def test_bisect_unstored(self):
+        publisher = self._make_publisher(self.spool)
+        items = _log_items(10, invalid={2})
+        inserts = []
+
+        def _insert_logs(cursor, logs):
+            inserts.append(logs)
+            if len(inserts) > 3:
+                raise psycopg2.OperationalError()
+            if any(log['message'] == 'invalid' for log in logs):
+                raise psycopg2.IntegrityError()
+
+        # the batch fails, then its first half fails, then the first
+        # quarter is stored, and the connection is lost
+        with mock.patch.object(publisher, '_insert_logs', _insert_logs):
+            with self.assertRaises(DBConnectionLost) as cm:
+                publisher._store_batch(self.conn, items)
+        self.assertEqual(
+            [tag for _, _, tag in cm.exception.unstored],
+            list(range(2, 10)))
+
+    def test_spool_write_error(self):
+        publisher = self._make_publisher(self.spool)
+        error = OSError('No space left on device')
+        with mock.patch.object(self.spool, 'append', side_effect=error):
+            with self.assertRaises(OSError):
+                self._lose_connection(publisher, _log_items(10))
+        self.assertIs(publisher.error_exit, error)
+        publisher._amqp_connection.close.assert_called_once()
+        publisher._amqp_connection.acks_queue.put.assert_not_called()
+
+    def test_replay_interrupted_while_bisecting(self):
+        publisher = self._make_publisher(self.spool)
+        self.spool.append(
+            (message, exchange)
+            for message, exchange, _ in _log_items(10, invalid={2}))
+        inserts = []
+
+        def _insert_logs(cursor, logs):
+            inserts.append([log['message'] for log in logs])
+            if len(inserts) == 4:
+                raise psycopg2.OperationalError()
+            if 'invalid' in inserts[-1]:
+                raise psycopg2.IntegrityError()
+
+        # the batch fails, then its first half fails, then the first
+        # quarter is stored, and the connection is lost
+        with mock.patch.object(publisher, '_insert_logs', _insert_logs):
+            self.assertIsNone(publisher._replay_spool(self.conn))
+            self.assertIs(publisher._replay_spool(self.conn), self.conn)
+        self.assertEqual(inserts[2], ['0', '1'])
+        # the replay resumed after the stored quarter
+        self.assertEqual(inserts[4], ['invalid', '3', '4', '5', '6', '7',
+                                      '8', '9'])
+        self.assertEqual(self.spool.size(), 0)
+
+    def test_no_spool(self):
+        publisher = self._make_publisher(None)
+        with self.assertRaises(psycopg2.OperationalError):
+            self._lose_connection(publisher, _log_items(10))
+        publisher._amqp_connection.close.assert_called_once()
+        publisher._amqp_connection.acks_queue.put.assert_not_called()
+
+
+class TestCumulativeAcks(unittest.TestCase):
+    def setUp(self):
+        self.connection = AckingAMQPConnection([])
+        self.connection.acks_queue = queue.Queue()
+        self.channel = mock.Mock(is_closed=False)
+
+    def _done(self, *tags):
+        for tag in tags:
+            self.connection.acks_queue.put((self.channel, tag))
+        self.connection._process_acks()
+
+    def test_single_ack_per_batch(self):
+        self._done(*range(1, 1001))
+        self.channel.basic_ack.assert_called_once_with(1000, multiple=True)
+
+    def test_out_of_order(self):
+        self._done(2, 3)
+        self.channel.basic_ack.assert_not_called()
+        self._done(1, 5)
+        self.channel.basic_ack.assert_called_once_with(3, multiple=True)
+        self.channel.basic_ack.reset_mock()
+        self._done(4)
+        self.channel.basic_ack.assert_called_once_with(5, multiple=True)
+
+    def test_closed_channel(self):
+        self._done(2)
+        self.channel.is_closed = True
+        self._done(1)
+        self.channel.basic_ack.assert_not_called()
+        self.assertEqual(self.connection._ack_trackers, {})
+
+    def test_dropped_messages_acked(self):
+        consumer = AMQPLogsEventsConsumer(mock.Mock(), prefetch_count=10)
+        consumer.register(self.connection, self.channel)
+        self.channel.basic_qos.assert_called_once_with(prefetch_count=10)
+        hook = mock.Mock(routing_key='events.hooks', delivery_tag=1)
+        invalid = mock.Mock(routing_key='events.#', delivery_tag=2)
+        consumer.process(self.channel, hook, None, '{}')
+        consumer.process(self.channel, invalid, None, 'invalid json')
+        self.connection._process_acks()
+        self.channel.basic_ack.assert_called_once_with(2, multiple=True)
+
+
+class TestLoadConfig(unittest.TestCase):
+    def setUp(self):
+        for patcher in [
+            mock.patch.object(main, 'setup_flask_app'),
+            mock.patch.object(main, 'sleep'),
+            mock.patch.object(main.config, 'instance'),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.db_down = sqlalchemy.exc.OperationalError('', {}, None)
+
+    def test_retry_until_db_is_up(self):
+        main.config.instance.amqp_host = None
+        main.config.instance.load_from_db.side_effect = [
+            self.db_down, self.db_down, None]
+        main._load_config_from_db()
+        self.assertEqual(main.config.instance.load_from_db.call_count, 3)
+        self.assertEqual(
+            [c[0][0] for c in main.sleep.call_args_list], [1, 2])
+
+    def test_fall_back_to_config_file(self):
+        main.config.instance.amqp_host = ['localhost']
+        main.config.instance.load_from_db.side_effect = self.db_down
+        main._load_config_from_db()
+        main.config.instance.load_from_db.assert_called_once()
+        self.assertFalse(main.config.instance.can_load_from_db)
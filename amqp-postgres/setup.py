@@ -31,6 +31,7 @@ setup(
     install_requires=[
         'cloudify-common',
         'pika',
+        'prometheus_client',
         'psycopg2',
     ],
 )
@@ -5,6 +5,7 @@ import logging
 import asyncpg
 
 NOTIFICATION_CHANNEL = 'audit_log_inserted'
+EVENTS_NOTIFICATION_CHANNEL = 'events_inserted'
 
 
 class ListenerException(Exception):
@@ -26,6 +27,9 @@ class Listener:
         self.dsn = dsn
         self.logger = logger
         self.conn_listen = None
+        # all the channels share a single connection, so that it must only
+        # be opened once, even if several channels start listening at once
+        self._connect_lock = asyncio.Lock()
         self.channels = {}
         self._loop = None
 
@@ -65,8 +69,9 @@ class Listener:
                              "removed from channel %s.", queue, channel)
 
     async def _listener(self, channel: str):
-        if not self.conn_listen:
-            self.conn_listen = await asyncpg.connect(self.dsn)
+        async with self._connect_lock:
+            if not self.conn_listen:
+                self.conn_listen = await asyncpg.connect(self.dsn)
 
         await self.conn_listen.add_listener(
             channel,
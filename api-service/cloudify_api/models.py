@@ -195,3 +195,53 @@ class PaginatedAuditLog(Paginated):
         kwargs['exclude_none'] = True
         kwargs['by_alias'] = False
         return super().dict(*args, **kwargs)
+
+
+class EventsNotification(BaseModel):
+    """Payload of the events_inserted notification.
+
+    One is sent for each execution that had events or logs stored in
+    a single statement; the new rows' ids are within the given range.
+    """
+    table: str
+    execution_fk: int
+    min_storage_id: int
+    max_storage_id: int
+
+
+class ExecutionEvent(BaseModel):
+    """An event or a log of an execution, as streamed to the clients."""
+    id: int = Field(alias='_storage_id')
+    type: str
+    timestamp: str
+    reported_timestamp: str
+    message: str | None
+    message_code: str | None
+    event_type: str | None
+    level: str | None
+    logger: str | None
+    operation: str | None
+    node_id: str | None
+    source_id: str | None
+    target_id: str | None
+    error_causes: list[Any] | None
+
+    class Config:
+        allow_population_by_field_name = True
+
+    @classmethod
+    def from_db(cls, db_record: db.Event | db.Log) -> 'ExecutionEvent':
+        if isinstance(db_record, db.Event):
+            event_type = 'cloudify_event'
+        else:
+            event_type = 'cloudify_log'
+        values = {
+            field: getattr(db_record, field, None)
+            for field in cls.__fields__
+            if field not in ('id', 'type')
+        }
+        return cls(id=db_record._storage_id, type=event_type, **values)
+
+    def json(self, *args, **kwargs):
+        kwargs.setdefault('exclude_none', True)
+        return super().json(*args, **kwargs)
@@ -1,2 +1,3 @@
 from .audit import router as audit  # noqa
+from .events import router as events  # noqa
 from .health import router as health  # noqa
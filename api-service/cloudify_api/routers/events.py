@@ -0,0 +1,229 @@
+import asyncio
+from datetime import datetime
+from typing import Sequence
+
+from fastapi import APIRouter, Depends, Header, status
+from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import parse_obj_as
+from sqlalchemy import func, or_, select
+
+from cloudify.models_states import ExecutionState, VisibilityState
+
+from cloudify_api import db, CloudifyAPI
+from cloudify_api.common import get_app, make_db_session
+from cloudify_api.listener import EVENTS_NOTIFICATION_CHANNEL
+from cloudify_api.models import EventsNotification, ExecutionEvent
+
+router = APIRouter(prefix="/executions", tags=["Events"])
+
+TABLES = {
+    db.Event.__tablename__: db.Event,
+    db.Log.__tablename__: db.Log,
+}
+# how long to wait for new events, before checking if the execution ended
+STATUS_CHECK_INTERVAL = 5
+
+
+class ExecutionEventsFanout:
+    """Fetch the events of every notification once, for all the watchers.
+
+    Watchers subscribe a queue for an execution, and get a
+    (table name, storage id, event json) tuple put in it, for each event
+    or log of that execution that is stored from then on.
+    """
+    def __init__(self, app: CloudifyAPI):
+        self._app = app
+        self._watchers: dict[int, set[asyncio.Queue]] = {}
+        self._notifications: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, execution_fk: int, queue: asyncio.Queue):
+        if self._task is None:
+            self._notifications = asyncio.Queue()
+            self._app.listener.attach_queue(
+                EVENTS_NOTIFICATION_CHANNEL, self._notifications)
+            self._task = asyncio.get_running_loop().create_task(
+                self._dispatch())
+        self._watchers.setdefault(execution_fk, set()).add(queue)
+
+    def unsubscribe(self, execution_fk: int, queue: asyncio.Queue):
+        watchers = self._watchers.get(execution_fk)
+        if watchers is None:
+            return
+        watchers.discard(queue)
+        if not watchers:
+            del self._watchers[execution_fk]
+
+    async def _dispatch(self):
+        while True:
+            data = await self._notifications.get()
+            try:
+                notification = parse_obj_as(EventsNotification, data)
+                if notification.table not in TABLES \
+                        or not self._watchers.get(notification.execution_fk):
+                    continue
+                events = await self._fetch(notification)
+            except Exception as e:
+                # keep dispatching the other notifications
+                self._app.logger.error(
+                    "Could not handle the events notification %s: %s",
+                    data, e)
+                continue
+            for queue in self._watchers.get(notification.execution_fk, []):
+                for event in events:
+                    queue.put_nowait(event)
+
+    async def _fetch(self, notification: EventsNotification) -> list[tuple]:
+        model = TABLES[notification.table]
+        events = await select_events(
+            self._app, model, notification.execution_fk,
+            model._storage_id.between(
+                notification.min_storage_id,
+                notification.max_storage_id))
+        return [
+            (notification.table, storage_id, event)
+            for storage_id, event in events
+        ]
+
+
+async def select_events(app: CloudifyAPI, model, execution_fk: int,
+                        *conditions) -> list[tuple]:
+    """(storage id, event json) of the execution's stored events"""
+    query = select(model)\
+        .where(model._execution_fk == execution_fk)\
+        .where(*conditions)\
+        .order_by(model.reported_timestamp, model._storage_id)
+    async with app.db_session_maker() as session:
+        db_records = await session.execute(query)
+    return [
+        (db_record._storage_id, ExecutionEvent.from_db(db_record).json())
+        for db_record in db_records.scalars().all()
+    ]
+
+
+def get_fanout(app: CloudifyAPI) -> ExecutionEventsFanout:
+    if not hasattr(app.state, 'events_fanout'):
+        app.state.events_fanout = ExecutionEventsFanout(app)
+    return app.state.events_fanout
+
+
+@router.get("/{execution_id}/events/stream")
+async def stream_execution_events(
+        execution_id: str,
+        since: datetime | None = None,
+        include_logs: bool = True,
+        tenant_name: str = Header(alias="Tenant"),
+        app=Depends(get_app),
+        session=Depends(make_db_session),
+) -> StreamingResponse:
+    """Stream the execution's events (and logs) as they're stored.
+
+    Like in the REST service, the execution must belong to the tenant
+    given in the Tenant header, or have global visibility. The events
+    are sent as newline-delimited JSON. If `since` is given, events
+    already stored, that were reported after it, are sent first. The
+    stream ends after the execution does.
+    """
+    app.logger.debug("Handling stream_execution_events request, "
+                     "execution_id=%s", execution_id)
+    result = await session.execute(
+        select(db.Execution._storage_id)
+        .join(db.Tenant, db.Tenant.id == db.Execution._tenant_id)
+        .where(db.Execution.id == execution_id)
+        .where(or_(
+            db.Tenant.name == tenant_name,
+            db.Execution.visibility == VisibilityState.GLOBAL,
+        ))
+        # execution ids are only unique within a tenant: prefer the
+        # current tenant's execution over a global one of another tenant
+        .order_by((db.Tenant.name == tenant_name).desc())
+    )
+    execution_fk = result.scalars().first()
+    if execution_fk is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Execution not found: `{execution_id}`"
+        )
+    models = [db.Event, db.Log] if include_logs else [db.Event]
+    return StreamingResponse(
+        execution_events_streamer(app, execution_fk, models, since),
+        media_type="application/x-ndjson")
+
+
+async def execution_events_streamer(app: CloudifyAPI,
+                                    execution_fk: int,
+                                    models: list,
+                                    since: datetime | None,
+                                    ) -> Sequence[bytes]:
+    """Stream the execution's events, until it ends.
+
+    An execution's events are all stored by the same amqp-postgres shard,
+    in order, so their storage ids only grow: the ones not greater than
+    the last id streamed were already sent (or were stored before the
+    stream started). Once no events came for STATUS_CHECK_INTERVAL, and
+    the execution has ended, the events stored but not notified yet are
+    sent, and the stream is closed.
+    """
+    fanout = get_fanout(app)
+    # subscribe before reading the stored events, so that nothing stored
+    # in between is missed
+    queue = asyncio.Queue()
+    fanout.subscribe(execution_fk, queue)
+    try:
+        last_ids = {}
+        for model in models:
+            last_ids[model.__tablename__] = \
+                await _last_storage_id(app, model, execution_fk)
+            if since is not None:
+                events = await select_events(
+                    app, model, execution_fk,
+                    model.reported_timestamp >= since,
+                    model._storage_id <= last_ids[model.__tablename__])
+                for _, event in events:
+                    yield make_streaming_response(event)
+
+        while True:
+            try:
+                table, storage_id, event = await asyncio.wait_for(
+                    queue.get(), STATUS_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                if not await _execution_ended(app, execution_fk):
+                    continue
+                for model in models:
+                    events = await select_events(
+                        app, model, execution_fk,
+                        model._storage_id > last_ids[model.__tablename__])
+                    for _, event in events:
+                        yield make_streaming_response(event)
+                return
+            if table in last_ids and storage_id > last_ids[table]:
+                last_ids[table] = storage_id
+                yield make_streaming_response(event)
+    finally:
+        fanout.unsubscribe(execution_fk, queue)
+
+
+async def _last_storage_id(app: CloudifyAPI, model, execution_fk: int) -> int:
+    async with app.db_session_maker() as session:
+        result = await session.execute(
+            select(func.max(model._storage_id))
+            .where(model._execution_fk == execution_fk)
+        )
+    return result.scalar() or 0
+
+
+async def _execution_ended(app: CloudifyAPI, execution_fk: int) -> bool:
+    async with app.db_session_maker() as session:
+        result = await session.execute(
+            select(db.Execution.status)
+            .where(db.Execution._storage_id == execution_fk)
+        )
+    execution_status = result.scalar()
+    # a deleted execution won't get any more events either
+    return execution_status is None \
+        or execution_status in ExecutionState.END_STATES
+
+
+def make_streaming_response(data: str) -> bytes:
+    return f"{data}\n".encode('utf-8', errors='ignore')
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime
+
+import mock
+
+from cloudify_api import db
+from cloudify_api.routers import events
+from cloudify_api.routers.events import ExecutionEventsFanout
+
+
+def test_fanout_fetches_once_per_notification():
+    event = ('events', 1, '{}')
+
+    async def _notify():
+        app = mock.Mock()
+        fanout = ExecutionEventsFanout(app)
+        fanout._fetch = mock.AsyncMock(return_value=[event])
+        watchers = [asyncio.Queue(), asyncio.Queue()]
+        other_watcher = asyncio.Queue()
+        for queue in watchers:
+            fanout.subscribe(1, queue)
+        fanout.subscribe(2, other_watcher)
+        app.listener.attach_queue.assert_called_once()
+
+        fanout._notifications.put_nowait({
+            'table': 'events',
+            'execution_fk': 1,
+            'min_storage_id': 1,
+            'max_storage_id': 1,
+        })
+        received = [await queue.get() for queue in watchers]
+        fanout._task.cancel()
+        return fanout, received, other_watcher
+
+    fanout, received, other_watcher = asyncio.run(_notify())
+    fanout._fetch.assert_awaited_once()
+    assert received == [event, event]
+    assert other_watcher.empty()
+
+
+def test_fanout_unsubscribe():
+    fanout = ExecutionEventsFanout(mock.Mock())
+    fanout._task = mock.Mock()
+    queue = asyncio.Queue()
+    fanout.subscribe(1, queue)
+    fanout.unsubscribe(1, queue)
+    fanout.unsubscribe(1, queue)
+    assert fanout._watchers == {}
+
+
+def test_fanout_survives_a_bad_notification():
+    event = ('events', 1, '{}')
+
+    async def _notify():
+        fanout = ExecutionEventsFanout(mock.Mock())
+        fanout._fetch = mock.AsyncMock(return_value=[event])
+        queue = asyncio.Queue()
+        fanout.subscribe(1, queue)
+        fanout._notifications.put_nowait({'table': 'events'})
+        fanout._notifications.put_nowait({
+            'table': 'events',
+            'execution_fk': 1,
+            'min_storage_id': 1,
+            'max_storage_id': 1,
+        })
+        received = await queue.get()
+        fanout._task.cancel()
+        return received
+
+    assert asyncio.run(_notify()) == event
+
+
+def test_streamer_dedups_and_ends_with_the_execution():
+    app = mock.Mock()
+    fanout = ExecutionEventsFanout(app)
+    fanout._task = mock.Mock()
+    app.state.events_fanout = fanout
+    stored = {
+        # the events reported after `since`, already stored
+        2: [(2, 'stored')],
+        # the events stored after the execution ended, not notified yet
+        1: [(5, 'last')],
+    }
+
+    async def _select_events(app, model, execution_fk, *conditions):
+        return stored[len(conditions)]
+
+    async def _stream():
+        streamer = events.execution_events_streamer(
+            app, 1, [db.Event], since=datetime(2000, 1, 1))
+        received = [await streamer.__anext__()]
+        [queue] = fanout._watchers[1]
+        for notified in [('events', 2, 'stored'),
+                         ('events', 3, 'new'),
+                         ('logs', 4, 'log'),
+                         ('events', 4, 'newer'),
+                         ('events', 3, 'new')]:
+            queue.put_nowait(notified)
+        async for event in streamer:
+            received.append(event)
+        return received
+
+    with mock.patch.object(events, 'select_events', _select_events), \
+            mock.patch.object(events, '_last_storage_id',
+                              mock.AsyncMock(return_value=2)), \
+            mock.patch.object(events, '_execution_ended',
+                              mock.AsyncMock(return_value=True)), \
+            mock.patch.object(events, 'STATUS_CHECK_INTERVAL', 0.01):
+        received = asyncio.run(_stream())
+    assert received == [b'stored\n', b'new\n', b'newer\n', b'last\n']
+    assert fanout._watchers == {}
@@ -0,0 +1,24 @@
+import asyncio
+import logging
+
+import mock
+
+from cloudify_api.listener import Listener
+
+
+def test_listen_connects_once():
+    async def _listen_twice():
+        listener = Listener('postgres://', logging.getLogger())
+        listener.listen('channel1')
+        listener.listen('channel2')
+        await asyncio.gather(*(
+            channel['task'] for channel in listener.channels.values()))
+        return listener
+
+    conn = mock.Mock(add_listener=mock.AsyncMock())
+    with mock.patch('asyncpg.connect',
+                    mock.AsyncMock(return_value=conn)) as connect:
+        listener = asyncio.run(_listen_twice())
+    connect.assert_awaited_once()
+    assert listener.conn_listen is conn
+    assert conn.add_listener.await_count == 2
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 
 import pytz
@@ -42,3 +43,39 @@ def test_select_params_as_filters():
         ('creator_name', 'admin'),
         ('execution_id', '123-456-7890')
     }
+
+
+def test_events_notification():
+    notification = models.EventsNotification.parse_obj({
+        'table': 'logs',
+        'execution_fk': 5,
+        'min_storage_id': 10,
+        'max_storage_id': 12,
+    })
+    assert notification.table == 'logs'
+    assert notification.execution_fk == 5
+    assert (notification.min_storage_id,
+            notification.max_storage_id) == (10, 12)
+
+
+def test_execution_event_from_db():
+    log = models.db.Log(
+        _storage_id=3,
+        timestamp='2023-03-28T13:24:52.000Z',
+        reported_timestamp='2023-03-28T13:24:51.000Z',
+        message='hello',
+        level='info',
+        logger='ctx',
+    )
+    event = models.ExecutionEvent.from_db(log)
+    assert event.type == 'cloudify_log'
+    assert event.id == 3
+    assert json.loads(event.json()) == {
+        'id': 3,
+        'type': 'cloudify_log',
+        'timestamp': '2023-03-28T13:24:52.000Z',
+        'reported_timestamp': '2023-03-28T13:24:51.000Z',
+        'message': 'hello',
+        'level': 'info',
+        'logger': 'ctx',
+    }
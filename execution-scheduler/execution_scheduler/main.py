@@ -15,8 +15,12 @@ from manager_rest.maintenance import get_maintenance_state
 from manager_rest.constants import MAINTENANCE_MODE_ACTIVATED
 from manager_rest.resource_manager import get_resource_manager
 from manager_rest.storage.models_base import db
-from manager_rest.storage.storage_utils import (try_acquire_lock_on_table,
-                                                unlock_table)
+from manager_rest.storage.storage_utils import (
+    create_events_logs_partitions,
+    purge_old_events_and_logs,
+    try_acquire_lock_on_table,
+    unlock_table,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +29,14 @@ SCHEDULER_LOCK_BASE = 10000
 # so we won't conflict with usage collector, which uses lock numbers 1 and 2
 
 DEFAULT_LOG_PATH = '/var/log/cloudify/execution-scheduler/scheduler.log'
+# how often to make sure the events & logs partitions exist, in seconds
+PARTITIONS_INTERVAL = 3600
+# how often to remove the events & logs past their retention period
+RETENTION_INTERVAL = 3600
+# lock numbers of the periodic tasks, so that only one manager at a time
+# runs each of them
+PARTITIONS_LOCK = 3
+RETENTION_LOCK = 4
 
 
 class LoopTimer(object):
@@ -66,6 +78,42 @@ def check_schedules():
         try_run(schedule)
 
 
+class PeriodicTask(object):
+    """Run func at most once every interval seconds.
+
+    The task is skipped while another manager runs it, ie. holds its lock.
+    """
+    def __init__(self, func, interval, lock_number):
+        self.func = func
+        self.interval = interval
+        self.lock_number = lock_number
+        self.last_run = None
+
+    def __call__(self):
+        now = datetime.now()
+        if self.last_run is not None and \
+                (now - self.last_run).total_seconds() < self.interval:
+            return
+        self.last_run = now
+        with scheduler_lock(self.lock_number) as locked:
+            if not locked:
+                logger.debug('Another manager currently runs %s',
+                             self.func.__name__)
+                db.session.rollback()
+                return
+            try:
+                self.func()
+            except Exception:
+                logger.exception('Error running %s', self.func.__name__)
+                db.session.rollback()
+
+
+def enforce_events_retention():
+    # the retention settings might have changed since the last run
+    query_service_settings()
+    purge_old_events_and_logs()
+
+
 def try_run(schedule):
     lock_num = SCHEDULER_LOCK_BASE + schedule._storage_id
     with scheduler_lock(lock_num) as locked:
@@ -140,9 +188,17 @@ def execute_workflow(schedule):
 
 
 def main():
+    periodic_tasks = [
+        PeriodicTask(create_events_logs_partitions, PARTITIONS_INTERVAL,
+                     PARTITIONS_LOCK),
+        PeriodicTask(enforce_events_retention, RETENTION_INTERVAL,
+                     RETENTION_LOCK),
+    ]
     while True:
         with LoopTimer() as t:
             check_schedules()
+            for task in periodic_tasks:
+                task()
         time.sleep(t.seconds_wait)
 
 
@@ -8,7 +8,12 @@ from manager_rest import utils
 from manager_rest.storage import models
 from manager_rest.flask_utils import setup_flask_app
 
-from execution_scheduler.main import try_run, should_run, LoopTimer
+from execution_scheduler.main import (
+    try_run,
+    should_run,
+    LoopTimer,
+    PeriodicTask,
+)
 
 
 def _get_mock_schedule(schedule_id='default', next_occurrence=None,
@@ -84,6 +89,26 @@ def test_try_run_schedule_locked(mock_should_run, mock_get_sm, mock_lock):
     assert schedule.next_occurrence == next_occurrence
 
 
+@mock.patch('execution_scheduler.main.unlock_table')
+@mock.patch('execution_scheduler.main.try_acquire_lock_on_table')
+def test_periodic_task_locked(mock_lock, mock_unlock):
+    func = mock.Mock(__name__='func')
+    task = PeriodicTask(func, 3600, 3)
+    mock_lock.return_value = False
+    with setup_flask_app().app_context():
+        task()
+    # another manager runs it
+    func.assert_not_called()
+    mock_unlock.assert_not_called()
+
+    task.last_run = None
+    mock_lock.return_value = True
+    with setup_flask_app().app_context():
+        task()
+    func.assert_called_once()
+    mock_unlock.assert_called_once_with(3)
+
+
 def test_should_run_stop_on_fail():
     schedule = _get_mock_schedule(
         stop_on_fail=True,
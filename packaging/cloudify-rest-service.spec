@@ -70,6 +70,9 @@ mkdir -p %{buildroot}/var/log/cloudify/amqp-postgres
 mkdir -p %{buildroot}/var/log/cloudify/execution-scheduler
 mkdir -p %{buildroot}/run/cloudify
 
+# Dir for the amqp-postgres spool, used while the db is unavailable
+mkdir -p %{buildroot}/var/lib/cloudify/amqp-postgres
+
 # Dir for snapshot restore marker files (CY-1821)
 mkdir -p %{buildroot}/opt/manager/snapshot_status
 
@@ -175,6 +178,9 @@ exit 0
 %dir /opt/cloudify/encryption
 /opt/cloudify/encryption/update-encryption-key
 /etc/logrotate.d/cloudify-amqp-postgres
+/etc/prometheus/targets/local_amqp_postgres.yml
+/etc/prometheus/targets/local_restservice.yml
+/etc/prometheus/alerts/restservice.yml
 /etc/logrotate.d/cloudify-execution-scheduler
 /etc/sudoers.d/cloudify-restservice
 /opt/restservice
@@ -190,4 +196,5 @@ exit 0
 %attr(750,cfyuser,cfylogs) /var/log/cloudify/amqp-postgres
 %attr(750,cfyuser,cfylogs) /var/log/cloudify/execution-scheduler
 %attr(750,cfyuser,cfyuser) /run/cloudify
+%attr(750,cfyuser,cfyuser) /var/lib/cloudify/amqp-postgres
 %attr(550,root,cfyuser) /opt/cloudify/encryption/update-encryption-key
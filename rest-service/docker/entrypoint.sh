@@ -5,7 +5,10 @@
 python -m manager_rest.configure_manager --db-wait postgresql
 python -m manager_rest.configure_manager --rabbitmq-wait rabbitmq
 
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/run/cloudify-restservice/metrics}
+
 exec gunicorn \
+  --config python:manager_rest.gunicorn_conf \
   --pid /run/cloudify-restservice/pid \
   --chdir / \
   --workers $WORKER_COUNT \
@@ -0,0 +1,90 @@
+import select
+import threading
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# the triggers notifying this channel are created by the migrations, with
+# the changed table's name as the payload
+TABLE_CHANGED_CHANNEL = 'table_changed'
+
+# how long to wait for a notification before checking that the connection
+# is still alive; a connection that died silently can make the listener
+# miss changes for up to this long
+KEEPALIVE_INTERVAL = 10
+RECONNECT_DELAY = 5
+
+
+class ChangeListener(threading.Thread):
+    """Keep track of changes to tables, using postgres notifications.
+
+    This lets the workers avoid querying the db on every request, just to
+    check if something they cache has changed. Every notification about a
+    table bumps its version; use .versions() to get the current versions
+    of some tables, and only query the db if they have changed since the
+    last time.
+
+    When not connected, the versions are unknown, and the caller must
+    query the db itself. After (re)connecting, all the versions change,
+    because any notifications sent while not listening were lost.
+    """
+
+    def __init__(self, get_dsn, logger):
+        super().__init__(name='change-listener', daemon=True)
+        self._get_dsn = get_dsn
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._connected = False
+        self._generation = 0
+        self._versions = defaultdict(int)
+        self._stopped = threading.Event()
+
+    def versions(self, *tables):
+        """The current versions of the tables, or None if they're unknown"""
+        with self._lock:
+            if not self._connected:
+                return None
+            return (self._generation, ) + tuple(
+                self._versions[table] for table in tables)
+
+    def stop(self):
+        """Stop listening, within KEEPALIVE_INTERVAL"""
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except (psycopg2.Error, OSError) as e:
+                self._logger.warning(
+                    'Lost the connection listening for db changes, '
+                    'reconnecting in %ss: %s', RECONNECT_DELAY, e)
+            with self._lock:
+                self._connected = False
+            self._stopped.wait(RECONNECT_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(self._get_dsn())
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {TABLE_CHANGED_CHANNEL}')
+            with self._lock:
+                self._generation += 1
+                self._connected = True
+            self._logger.debug('Listening for db changes')
+            while not self._stopped.is_set():
+                readable, _, _ = select.select(
+                    [conn], [], [], KEEPALIVE_INTERVAL)
+                if not readable:
+                    with conn.cursor() as cur:
+                        cur.execute('SELECT 1')
+                conn.poll()
+                if conn.notifies:
+                    with self._lock:
+                        for notify in conn.notifies:
+                            self._versions[notify.payload] += 1
+                    conn.notifies.clear()
+        finally:
+            conn.close()
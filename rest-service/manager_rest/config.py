@@ -5,7 +5,7 @@ import requests
 import time
 import yaml
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, FrozenSet, Optional
 
 from json import dump
 from datetime import datetime
@@ -63,6 +63,20 @@ class Setting(object):
         self._value = self._default
 
 
+class PermissionsSetting(Setting):
+    """The authorization permissions: lists of role names, by permission.
+
+    Setting these also compiles them into the config's
+    authorization_permission_roles, which has frozensets of role names
+    instead of lists, so that permission checks don't go through the lists.
+    """
+    def __set__(self, instance, value):
+        super().__set__(instance, value)
+        instance.authorization_permission_roles = {
+            name: frozenset(roles) for name, roles in (value or {}).items()
+        }
+
+
 class Config(object):
     # whether or not the config can be implicitly loaded from db on first use
     can_load_from_db = True
@@ -70,6 +84,9 @@ class Config(object):
     # when was the config last changed? it will be reloaded when this increases
     last_updated: Optional[datetime] = None
 
+    # compiled from authorization_permissions, see PermissionsSetting
+    authorization_permission_roles: Dict[str, FrozenSet[str]] = {}
+
     public_ip = Setting('public_ip')
     manager_hostname = Setting('manager_hostname', from_db=False)
 
@@ -167,8 +184,8 @@ class Config(object):
 
     authorization_roles = Setting('authorization_roles',
                                   from_db=False, default=None)
-    authorization_permissions = Setting('authorization_permissions',
-                                        from_db=False, default=None)
+    authorization_permissions = PermissionsSetting(
+        'authorization_permissions', from_db=False, default=None)
 
     failed_logins_before_account_lock = Setting(
         'failed_logins_before_account_lock', default=4)
@@ -181,6 +198,17 @@ class Config(object):
 
     prometheus_url = Setting('prometheus_url')
 
+    # events & logs older than this many days are removed periodically;
+    # None means keeping them forever. Can be overridden per-tenant, using
+    # a mapping of tenant name to days
+    events_retention_days = Setting('events_retention_days', default=None)
+    events_retention_tenants = Setting('events_retention_tenants',
+                                       default={})
+
+    # return a Server-Timing header with the SQL and phase timings of every
+    # request, see manager_rest.profiling
+    request_profiling = Setting('request_profiling', default=False)
+
     _logger = None
 
     def load_configuration(self, from_db=True):
@@ -279,12 +307,13 @@ class Config(object):
              'description': r.description}
             for r in stored_roles
         ]
-        self.authorization_permissions = {}
+        authorization_permissions = {}
         for perm in stored_permissions:
-            if perm.name not in self.authorization_permissions:
-                self.authorization_permissions[perm.name] = []
-            self.authorization_permissions[perm.name].append(
+            if perm.name not in authorization_permissions:
+                authorization_permissions[perm.name] = []
+            authorization_permissions[perm.name].append(
                 role_names[perm.role_id])
+        self.authorization_permissions = authorization_permissions
 
         self.ldap_ca_cert = session.query(
             models.Certificate.value
@@ -491,6 +520,7 @@ class Config(object):
             'security_encryption_key',
             'authorization_roles',
             'authorization_permissions',
+            'authorization_permission_roles',
             'failed_logins_before_account_lock',
             'account_lock_period',
             'warnings'
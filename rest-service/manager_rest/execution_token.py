@@ -14,14 +14,32 @@
 #    * limitations under the License.
 
 import hashlib
+import threading
 
-from flask import g
+from cachetools import LRUCache
+from flask import current_app, g
 from werkzeug.local import LocalProxy
+from sqlalchemy import orm
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 
 from cloudify import constants
 from manager_rest.storage import models, db
 
+# Executions by their token hash, because a workflow makes lots of requests
+# using the same token. The cached executions (with their tenant and
+# creator) are detached, and are merged into each request's session without
+# querying the db. This is only used while the app's change listener (see
+# server.CloudifyFlaskApp) is connected, and the cache is cleared whenever
+# an execution's status or token change, any of the tenants change, or a
+# user is renamed, (de)activated or deleted; logins, which update the users
+# too, don't clear it.
+EXECUTIONS_CACHE_SIZE = 1000
+EXECUTIONS_CACHE_TABLES = ['executions', 'tenants', 'users']
+
+_executions = LRUCache(EXECUTIONS_CACHE_SIZE)
+_executions_versions = None
+_executions_lock = threading.Lock()
+
 
 @LocalProxy
 def current_execution():
@@ -37,10 +55,41 @@ def set_current_execution(execution):
 
 
 def get_current_execution_by_token(execution_token):
+    global _executions_versions
     hashed = hashlib.sha256(execution_token.encode('ascii')).hexdigest()
+    listener = current_app.extensions.get('change_listener')
+    versions = listener.versions(*EXECUTIONS_CACHE_TABLES) \
+        if listener else None
+    if versions is None:
+        return _get_execution_by_token_hash(db.session, hashed)
+
+    with _executions_lock:
+        if versions != _executions_versions:
+            _executions.clear()
+            _executions_versions = versions
+        execution = _executions.get(hashed)
+    if execution is None:
+        # load it in a separate session, so that it's detached once that
+        # session is closed, and can be cached
+        session = orm.Session(bind=db.engine)
+        try:
+            execution = _get_execution_by_token_hash(session, hashed)
+        finally:
+            session.close()
+        if execution is None:
+            return None
+        # the versions were checked before loading the execution, so if
+        # they change in the meantime, it will be dropped by the next request
+        with _executions_lock:
+            if versions == _executions_versions:
+                _executions[hashed] = execution
+    return db.session.merge(execution, load=False)
+
+
+def _get_execution_by_token_hash(session, hashed):
     try:
         return (
-            models.Execution.query
+            session.query(models.Execution)
             .filter_by(token=hashed)
             # tenant and creator are going to be fetched soon, so join them
             .options(db.joinedload(models.Execution.tenant))
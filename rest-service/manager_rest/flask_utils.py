@@ -77,13 +77,27 @@ def get_tenant_by_name(tenant_name):
     return tenant
 
 
+# the tables that config.load_from_db reads the last update time from
+SETTINGS_TABLES = ['roles', 'config', 'certificates']
+
+
 def query_service_settings():
     """Check for when was the config updated, and if needed, reload it.
 
     This makes sure that config updates will (eventually) be propagated
     to all workers, and that every worker always has the most recent
     config/permissions settings available.
+
+    If the app has a change listener (see server.CloudifyFlaskApp), the
+    db is only checked after it was notified of changes to the settings
+    tables, or when it isn't connected.
     """
+    listener = current_app.extensions.get('change_listener')
+    versions = listener.versions(*SETTINGS_TABLES) if listener else None
+    if versions is not None and \
+            versions == current_app.extensions.get('settings_versions'):
+        return
+
     last_updated_subquery = (
         db.session.query(models.Role.updated_at.label('updated_at'))
         .union_all(
@@ -105,3 +119,4 @@ def query_service_settings():
         current_app.logger.warning('Config has changed - reloading')
         config.instance.load_from_db()
         current_app.logger.setLevel(config.instance.rest_service_log_level)
+    current_app.extensions['settings_versions'] = versions
@@ -0,0 +1,34 @@
+"""Gunicorn configuration for the REST service.
+
+Use it with `gunicorn --config python:manager_rest.gunicorn_conf`. It
+serves the REST service's Prometheus metrics from the gunicorn master,
+aggregated from all the workers (see manager_rest.metrics).
+"""
+import os
+import shutil
+
+DEFAULT_METRICS_PORT = 8017
+
+# use 0 to disable serving the metrics
+metrics_port = int(os.environ.get('REST_METRICS_PORT', DEFAULT_METRICS_PORT))
+metrics_address = os.environ.get('REST_METRICS_ADDRESS', 'localhost')
+
+
+def on_starting(server):
+    # metrics left over from the previous run would be served as well
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+
+
+def when_ready(server):
+    if metrics_port:
+        from manager_rest.metrics import start_metrics_server
+        start_metrics_server(metrics_port, metrics_address)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -16,7 +16,7 @@
 
 import traceback
 from datetime import datetime
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 from io import StringIO
 
 from cloudify.models_states import ExecutionState
@@ -54,7 +54,7 @@ def maintenance_mode_handler():
     if not request.endpoint:
         return
 
-    state = get_maintenance_state()
+    state = get_cached_maintenance_state()
     if not state:
         return
 
@@ -63,7 +63,7 @@ def maintenance_mode_handler():
         return
 
     if state['status'] == MAINTENANCE_MODE_ACTIVATING:
-        if not get_running_executions():
+        if not has_running_executions():
             state = store_maintenance_state(
                 status=MAINTENANCE_MODE_ACTIVATED,
                 activated_at=datetime.utcnow()
@@ -129,6 +129,14 @@ def get_running_executions():
     return running_executions
 
 
+def has_running_executions():
+    return db.session.query(
+        models.Execution.query
+        .filter(models.Execution.status.notin_(ExecutionState.END_STATES))
+        .exists()
+    ).scalar()
+
+
 def is_bypass_maintenance_mode():
     return utils.is_bypass_maintenance_mode(request)
 
@@ -164,6 +172,29 @@ def get_maintenance_state():
     return inst.to_dict()
 
 
+def get_cached_maintenance_state():
+    """Like get_maintenance_state, but cached in this worker.
+
+    The cached state is only used while the app's change listener (see
+    server.CloudifyFlaskApp) is connected, and it wasn't notified of any
+    changes to the maintenance_mode table since it was cached.
+    """
+    listener = current_app.extensions.get('change_listener')
+    versions = listener.versions('maintenance_mode') if listener else None
+    cached = current_app.extensions.get('maintenance_state')
+    if versions is not None and cached and cached[0] == versions:
+        return cached[1]
+    # the versions are checked before querying, so that a change committed
+    # in the meantime will still make the next request query again
+    state = get_maintenance_state()
+    current_app.extensions['maintenance_state'] = (versions, state)
+    return state
+
+
+def _forget_cached_maintenance_state():
+    current_app.extensions.pop('maintenance_state', None)
+
+
 def store_maintenance_state(**state):
     inst = db.session.query(models.MaintenanceMode).first()
     if inst:
@@ -173,6 +204,7 @@ def store_maintenance_state(**state):
         inst = models.MaintenanceMode(**state)
     db.session.add(inst)
     db.session.commit()
+    _forget_cached_maintenance_state()
     return inst.to_dict()
 
 
@@ -182,6 +214,7 @@ def remove_maintenance_state():
         state = inst.to_dict()
         db.session.delete(inst)
         db.session.commit()
+        _forget_cached_maintenance_state()
     else:
         state = {}
     state['status'] = MAINTENANCE_MODE_DEACTIVATED
@@ -0,0 +1,123 @@
+"""Prometheus metrics of the REST service.
+
+The metrics are updated by request hooks (see server.CloudifyFlaskApp),
+and served over HTTP by the gunicorn master process (see gunicorn_conf),
+for the manager's Prometheus to scrape, same as the other manager
+services.
+
+The gunicorn workers are separate processes, so the metrics are kept
+in the directory given by the PROMETHEUS_MULTIPROC_DIR environment
+variable, and aggregated when serving them. Without it, every process
+only serves its own metrics.
+"""
+import logging
+import os
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    multiprocess,
+    start_http_server,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'restservice'
+
+requests_total = Counter(
+    f'{METRICS_PREFIX}_requests',
+    'Number of handled requests',
+    ['method', 'endpoint', 'status'],
+)
+request_latency = Histogram(
+    f'{METRICS_PREFIX}_request_latency_seconds',
+    'Time it took to handle a request, not including streaming the response',
+    ['method', 'endpoint'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60),
+)
+request_sql_statements = Histogram(
+    f'{METRICS_PREFIX}_request_sql_statements',
+    'Number of SQL statements executed while handling a request',
+    ['method', 'endpoint'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+requests_in_progress = Gauge(
+    f'{METRICS_PREFIX}_requests_in_progress',
+    'Number of requests currently being handled',
+    multiprocess_mode='livesum',
+)
+db_pool_checkout_wait = Histogram(
+    f'{METRICS_PREFIX}_db_pool_checkout_wait_seconds',
+    'Time it took to check out a db connection from the pool, including '
+    'waiting for a free one, and opening a new one',
+    buckets=(.0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 30),
+)
+
+
+class MeteredQueuePool(QueuePool):
+    """A QueuePool recording how long checking out connections takes"""
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started_at)
+
+
+def request_started():
+    """Start measuring the request. Meant to be an early before_request"""
+    g.metrics_started_at = time.perf_counter()
+    g.metrics_sql_statements = 0
+    requests_in_progress.inc()
+
+
+def request_finished(response):
+    started_at = g.get('metrics_started_at')
+    if started_at is None:
+        return response
+    endpoint = request.endpoint or ''
+    requests_total.labels(
+        request.method, endpoint, response.status_code).inc()
+    request_latency.labels(request.method, endpoint).observe(
+        time.perf_counter() - started_at)
+    request_sql_statements.labels(request.method, endpoint).observe(
+        g.metrics_sql_statements)
+    return response
+
+
+def request_torn_down(exc=None):
+    if g.pop('metrics_started_at', None) is not None:
+        requests_in_progress.dec()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_executed(conn, cursor, statement, parameters, context,
+                        executemany):
+    if has_request_context() and 'metrics_sql_statements' in g:
+        g.metrics_sql_statements += 1
+
+
+def start_metrics_server(port, address='localhost'):
+    """Serve the metrics over HTTP, in a background thread.
+
+    Failing to do so is not fatal: the REST service must go on regardless.
+    """
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    try:
+        start_http_server(port, addr=address, registry=registry)
+    except Exception as e:
+        logger.error('Could not serve metrics on %s:%s: %s',
+                     address, port, e)
+    else:
+        logger.info('Serving metrics on %s:%s', address, port)
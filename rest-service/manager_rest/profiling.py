@@ -0,0 +1,126 @@
+"""Opt-in profiling of REST requests.
+
+When the request_profiling setting is enabled, every request records how
+many SQL statements it ran and how long they took, and how long each
+phase of handling it took. These are returned in the Server-Timing
+response header, and logged with the response.
+"""
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from manager_rest import config
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_duration = 0.0
+        # durations of the request phases, in seconds, by phase name
+        self.phases = {}
+
+    def add(self, phase_name, duration):
+        self.phases[phase_name] = self.phases.get(phase_name, 0) + duration
+
+    def server_timing(self):
+        """Render the profile as a Server-Timing header value"""
+        metrics = [
+            f'sql;dur={self.sql_duration * 1000:.1f};'
+            f'desc="{self.sql_statements} statements"'
+        ]
+        metrics += [
+            f'{phase_name};dur={duration * 1000:.1f}'
+            for phase_name, duration in self.phases.items()
+        ]
+        return ', '.join(metrics)
+
+
+def current_profile():
+    """The profile of the current request, or None if not profiling"""
+    if not has_app_context():
+        return None
+    return g.get('request_profile')
+
+
+@contextmanager
+def phase(phase_name):
+    """Record the time spent in the block, if the request is profiled"""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(phase_name, time.perf_counter() - started_at)
+
+
+def start_profiling():
+    """Start profiling the request, if enabled.
+
+    This is meant to be the first before_request hook, and the
+    before_request phase lasts until end_before_request.
+    """
+    if config.instance.request_profiling:
+        g.request_profile = RequestProfile()
+
+
+def end_before_request():
+    profile = current_profile()
+    if profile is not None:
+        profile.add('before_request',
+                    time.perf_counter() - profile.started_at)
+
+
+def add_server_timing(response):
+    """Return the request profile in the response headers, and log it.
+
+    This is meant to be the last after_request hook. Note that streamed
+    responses are still being generated at this point, so the profile
+    doesn't include generating them.
+    """
+    profile = current_profile()
+    if profile is None:
+        return response
+    profile.add('total', time.perf_counter() - profile.started_at)
+    server_timing = profile.server_timing()
+    response.headers.add('Server-Timing', server_timing)
+    current_app.logger.info('Profile of %s %s (%s): %s',
+                            request.method, request.path, response.status,
+                            server_timing)
+    return response
+
+
+# The start time of a statement is kept on its execution context, which is
+# discarded along with it, whether the statement succeeds or fails.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context,
+                       executemany):
+    if context is not None and current_profile() is not None:
+        context._profiling_started_at = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context,
+                        executemany):
+    _record_statement(context)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _statement_failed(exception_context):
+    _record_statement(exception_context.execution_context)
+
+
+def _record_statement(context):
+    profile = current_profile()
+    started_at = getattr(context, '_profiling_started_at', None)
+    if profile is None or started_at is None:
+        return
+    del context._profiling_started_at
+    profile.sql_statements += 1
+    profile.sql_duration += time.perf_counter() - started_at
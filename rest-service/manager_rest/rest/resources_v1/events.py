@@ -14,11 +14,18 @@
 #  * limitations under the License.
 #
 
+import base64
+import binascii
+import json
+import operator
 from functools import reduce
 
 from sqlalchemy import (
+    Text,
+    and_ as sql_and,
     asc,
     bindparam,
+    cast,
     desc,
     literal_column,
     or_ as sql_or
@@ -26,10 +33,14 @@ from sqlalchemy import (
 from cloudify.models_states import VisibilityState
 
 from manager_rest import manager_exceptions, utils
-from manager_rest.rest.rest_decorators import insecure_rest_method
+from manager_rest.rest.rest_decorators import (
+    escape_like,
+    insecure_rest_method,
+)
 from manager_rest.security import SecuredResource
 from manager_rest.security.authorization import authorize
 from manager_rest.storage.models_base import db
+from manager_rest.storage.storage_manager import COUNT_EXACT, count_query
 from manager_rest.storage.resource_models import (
     Blueprint,
     Deployment,
@@ -65,6 +76,9 @@ class Events(SecuredResource):
         'event_type': (Event.event_type, 'in'),
         'level': (Log.level, 'in'),
         'message': ('message', 'ilike'),
+        # case-insensitive substring search, using the trigram indexes on
+        # the message columns
+        'message_contains': ('message', 'contains'),
     }
 
     # Map from old Elasticsearch field name to PostgreSQL one
@@ -72,6 +86,18 @@ class Events(SecuredResource):
         'message.text': 'message',
     }
 
+    # The only sort fields allowed with cursor pagination: with a cursor,
+    # the results are always ordered by reported_timestamp, and these only
+    # choose the direction
+    CURSOR_SORT_FIELDS = {'timestamp', 'reported_timestamp'}
+
+    # Columns that are always selected, even if not included in the
+    # projection: the sorting, the cursors, and the mapping of the results
+    # depend on them
+    REQUIRED_COLUMNS = {
+        '_storage_id', 'timestamp', 'reported_timestamp', 'type',
+    }
+
     @staticmethod
     def _apply_filters(query, model, filters):
         """Apply filters to the query.
@@ -113,10 +139,15 @@ class Events(SecuredResource):
             elif filter_type == 'ilike':
                 for filter_element in filter_:
                     query = query.filter(model_field.ilike(filter_element))
+            elif filter_type == 'contains':
+                for filter_element in filter_:
+                    query = query.filter(model_field.ilike(
+                        '%{0}%'.format(escape_like(filter_element)),
+                        escape='\\'))
             else:
                 raise ValueError(
                     'Unknown filter type: {0}. '
-                    'Allowed values: ilike, in'
+                    'Allowed values: contains, ilike, in'
                     .format(filter_type)
                 )
 
@@ -207,7 +238,87 @@ class Events(SecuredResource):
         return query
 
     @staticmethod
-    def _build_select_query(filters, sort, range_filters, tenant_id):
+    def _encode_cursor(sql_event):
+        """Encode the position of sql_event as an opaque cursor.
+
+        The cursor is the event's sort key: (reported_timestamp, type,
+        _storage_id). The type is needed, because events and logs have
+        separate storage ids. The timestamp is the full-precision one,
+        selected as _cursor_timestamp.
+        """
+        position = [
+            sql_event._cursor_timestamp,
+            sql_event.type,
+            sql_event._storage_id,
+        ]
+        return base64.urlsafe_b64encode(
+            json.dumps(position).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        """Decode a cursor returned by _encode_cursor.
+
+        An empty cursor means the start of the results, and is decoded
+        as None.
+        """
+        if not cursor:
+            return None
+        try:
+            timestamp, event_type, storage_id = json.loads(
+                base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, TypeError, binascii.Error):
+            raise manager_exceptions.BadParametersError(
+                'Invalid cursor: {0}'.format(cursor))
+        if not isinstance(storage_id, int) \
+                or not isinstance(event_type, str) \
+                or not isinstance(timestamp, str):
+            raise manager_exceptions.BadParametersError(
+                'Invalid cursor: {0}'.format(cursor))
+        return timestamp, event_type, storage_id
+
+    @staticmethod
+    def _apply_cursor(query, model, position, direction):
+        """Only select the rows that come after position.
+
+        The rows are ordered by (reported_timestamp, type, _storage_id),
+        and the type is constant for each of the models, so this reduces
+        to a condition on reported_timestamp and _storage_id. It always
+        bounds reported_timestamp, so that the index and the partitions
+        can be used.
+
+        :param position: Decoded cursor, see _decode_cursor
+        :type position: tuple(str, str, int)
+        :param direction: Sorting direction (asc/desc)
+        :type direction: str
+        """
+        timestamp, event_type, storage_id = position
+        if direction == 'desc':
+            after, not_before = operator.lt, operator.le
+        else:
+            after, not_before = operator.gt, operator.ge
+        model_type = Events._model_type(model)
+        reported_timestamp = model.reported_timestamp
+        if model_type == event_type:
+            condition = sql_and(
+                not_before(reported_timestamp, timestamp),
+                sql_or(
+                    after(reported_timestamp, timestamp),
+                    after(model._storage_id, storage_id),
+                ),
+            )
+        elif after(model_type, event_type):
+            condition = not_before(reported_timestamp, timestamp)
+        else:
+            condition = after(reported_timestamp, timestamp)
+        return query.filter(condition)
+
+    @staticmethod
+    def _model_type(model):
+        return 'cloudify_{0}'.format(model.__name__.lower())
+
+    @staticmethod
+    def _build_select_query(filters, sort, range_filters, tenant_id,
+                            cursor=None, count=COUNT_EXACT, include=None):
         """Build query used to list events for a given execution.
 
         :param filters:
@@ -239,6 +350,21 @@ class Events(SecuredResource):
             `@` inherited from the old Elasticsearch implementation):
                 {'timestamp': {'from': <iso8601-date>, 'to': <iso8601-date>}}
         :type range_filters: dict(str, str)
+        :param cursor:
+            Use keyset pagination instead of OFFSET: only return the events
+            after the one the cursor was created for (see _encode_cursor).
+            An empty string means starting from the first event. The query
+            then has no `offset` parameter, and selects _cursor_timestamp
+            additionally.
+        :type cursor: str
+        :param count:
+            How to compute the total, see
+            :func:`manager_rest.storage.storage_manager.count_query`
+        :type count: str
+        :param include:
+            Names of the columns to select; None means all of them. The
+            REQUIRED_COLUMNS and the sort fields are always selected.
+        :type include: list(str)
         :returns:
             A SQL query that returns the events found that match the conditions
             passed as arguments.
@@ -248,38 +374,51 @@ class Events(SecuredResource):
         assert isinstance(filters, dict), \
             'Filters is expected to be a dictionary'
 
-        subqueries = []
-        if (('type' not in filters or 'cloudify_event' in filters['type']) and
-                ('level' not in filters)):
-            events_query = Events._build_select_subquery(
-                Event, filters, range_filters, tenant_id)
-            subqueries.append(events_query)
-
-        if (('type' not in filters or 'cloudify_log' in filters['type']) and
-                ('event_type' not in filters)):
-            logs_query = Events._build_select_subquery(
-                Log, filters, range_filters, tenant_id)
-            subqueries.append(logs_query)
-
-        if subqueries:
-            query = reduce(
-                lambda left, right: left.union_all(right),
-                subqueries,
-            )
-            total = query.count()
-            query = Events._apply_sort(query, sort)
-            if sort:
-                _, sort_direction = dict(sort).popitem()
+        if sort:
+            _, sort_direction = dict(sort).popitem()
+        else:
+            sort_direction = 'asc'
+
+        if include is not None:
+            include = set(include) | Events.REQUIRED_COLUMNS | {
+                field.lstrip('@') for field in sort or {}
+            }
+
+        query = Events._build_union(
+            filters, range_filters, tenant_id, include=include)
+        if query is not None:
+            total = count_query(query, count)
+            if cursor is not None:
+                unknown_sort = {
+                    field.lstrip('@') for field in sort or {}
+                } - Events.CURSOR_SORT_FIELDS
+                if unknown_sort:
+                    raise manager_exceptions.BadParametersError(
+                        'Cannot sort by {0} when using a cursor'
+                        .format(', '.join(sorted(unknown_sort))))
+                query = Events._build_union(
+                    filters, range_filters, tenant_id,
+                    include=include,
+                    keyset=True,
+                    position=Events._decode_cursor(cursor),
+                    direction=sort_direction,
+                )
+                query = Events._apply_sort(query, {
+                    'reported_timestamp': sort_direction,
+                    'type': sort_direction,
+                    '_storage_id': sort_direction,
+                })
+                query = query.limit(bindparam('limit'))
             else:
-                sort_direction = 'asc'
-            query = Events._apply_sort(query, {
-                'timestamp': sort_direction, '_storage_id': sort_direction
-            })
-            query = (
-                query
-                .limit(bindparam('limit'))
-                .offset(bindparam('offset'))
-            )
+                query = Events._apply_sort(query, sort)
+                query = Events._apply_sort(query, {
+                    'timestamp': sort_direction, '_storage_id': sort_direction
+                })
+                query = (
+                    query
+                    .limit(bindparam('limit'))
+                    .offset(bindparam('offset'))
+                )
         else:
             # Simple query that returns no results
             # Used when filtering by a field that doesn't exist for a type
@@ -287,12 +426,43 @@ class Events(SecuredResource):
                 db.session.query(Event.timestamp)
                 .filter(Event.timestamp is None)
             )
-            total = query.count()
+            total = count_query(query, count)
 
         return query, total
 
     @staticmethod
-    def _build_select_subquery(model, filters, range_filters, tenant_id):
+    def _build_union(filters, range_filters, tenant_id, include=None,
+                     keyset=False, position=None, direction='asc'):
+        """Build the UNION ALL of the events and logs subqueries.
+
+        Returns None if the filters exclude both events and logs.
+        The include, keyset, position and direction arguments are passed to
+        _build_select_subquery.
+        """
+        subqueries = []
+        if (('type' not in filters or 'cloudify_event' in filters['type']) and
+                ('level' not in filters)):
+            subqueries.append(Events._build_select_subquery(
+                Event, filters, range_filters, tenant_id,
+                include, keyset, position, direction))
+
+        if (('type' not in filters or 'cloudify_log' in filters['type']) and
+                ('event_type' not in filters)):
+            subqueries.append(Events._build_select_subquery(
+                Log, filters, range_filters, tenant_id,
+                include, keyset, position, direction))
+
+        if not subqueries:
+            return None
+        return reduce(
+            lambda left, right: left.union_all(right),
+            subqueries,
+        )
+
+    @staticmethod
+    def _build_select_subquery(model, filters, range_filters, tenant_id,
+                               include=None, keyset=False, position=None,
+                               direction='asc'):
         """Build select subquery.
 
         :param model: Model used to build the query (either Event or Log)
@@ -303,6 +473,14 @@ class Events(SecuredResource):
         :type filters: dict(str, list(str))
         :param range_filters: Range filtres passed as request argument
         :type range_filters: dict(str, dict(str))
+        :param include: Names of the columns to select, or None for all
+        :type include: set(str)
+        :param keyset: Select _cursor_timestamp, used for creating cursors
+        :type keyset: bool
+        :param position: Decoded cursor, see _apply_cursor
+        :type position: tuple(str, str, int)
+        :param direction: Sorting direction used with the cursor (asc/desc)
+        :type direction: str
         :returns: Select events query
         :rtype: :class:`sqlalchemy.orm.query.Query`
 
@@ -325,34 +503,44 @@ class Events(SecuredResource):
                 return getattr(model, column_name).label(label)
             return literal_column('NULL').label(label)
 
+        columns = [
+            select_column('_storage_id'),
+            select_column('timestamp'),
+            select_column('reported_timestamp'),
+            Blueprint.id.label('blueprint_id'),
+            Deployment.id.label('deployment_id'),
+            Deployment.display_name.label('deployment_display_name'),
+            Execution.id.label('execution_id'),
+            ExecutionGroup.id.label('execution_group_id'),
+            Execution.workflow_id.label('workflow_id'),
+            select_column('message'),
+            select_column('message_code'),
+            select_column('error_causes'),
+            select_column('event_type'),
+            select_column('operation'),
+            select_column('node_id'),
+            select_column('source_id'),
+            select_column('target_id'),
+            select_column('manager_name'),
+            select_column('agent_name'),
+            NodeInstance.id.label('node_instance_id'),
+            Node.id.label('node_name'),
+            select_column('logger'),
+            select_column('level'),
+            literal_column("'{0}'".format(Events._model_type(model)))
+            .label('type'),
+        ]
+        if include is not None:
+            # the same columns, in the same order, for both events and
+            # logs, so that they can be UNIONed
+            columns = [column for column in columns if column.name in include]
+        if keyset:
+            # the full-precision timestamp, to create the next cursor from
+            columns.append(
+                cast(model.reported_timestamp, Text)
+                .label('_cursor_timestamp'))
         query = (
-            db.session.query(
-                select_column('_storage_id'),
-                select_column('timestamp'),
-                select_column('reported_timestamp'),
-                Blueprint.id.label('blueprint_id'),
-                Deployment.id.label('deployment_id'),
-                Deployment.display_name.label('deployment_display_name'),
-                Execution.id.label('execution_id'),
-                ExecutionGroup.id.label('execution_group_id'),
-                Execution.workflow_id.label('workflow_id'),
-                select_column('message'),
-                select_column('message_code'),
-                select_column('error_causes'),
-                select_column('event_type'),
-                select_column('operation'),
-                select_column('node_id'),
-                select_column('source_id'),
-                select_column('target_id'),
-                select_column('manager_name'),
-                select_column('agent_name'),
-                NodeInstance.id.label('node_instance_id'),
-                Node.id.label('node_name'),
-                select_column('logger'),
-                select_column('level'),
-                literal_column("'cloudify_{}'".format(model.__name__.lower()))
-                .label('type'),
-            )
+            db.session.query(*columns)
             .filter(
                 sql_or(
                     model._tenant_id == tenant_id,
@@ -372,6 +560,8 @@ class Events(SecuredResource):
 
         query = Events._apply_filters(query, model, filters)
         query = Events._apply_range_filters(query, model, range_filters)
+        if position is not None:
+            query = Events._apply_cursor(query, model, position, direction)
         return query
 
     @staticmethod
@@ -399,6 +589,7 @@ class Events(SecuredResource):
         }
         event['@timestamp'] = event['timestamp']
         del event['reported_timestamp']
+        event.pop('_cursor_timestamp', None)
 
         event['message'] = {
             'text': event['message']
@@ -429,8 +620,9 @@ class Events(SecuredResource):
         elif event['type'] == 'cloudify_log':
             del event['event_type']
 
-        # Keep only keys passed in the _include request argument
-        # TBD: Do the projection at the database level
+        # Keep only keys passed in the _include request argument. Those are
+        # the restructured fields, which don't match the columns, so the
+        # projection can't be done at the database level
         if _include is not None:
             event = {k: v for k, v in event.items() if k in _include}
 
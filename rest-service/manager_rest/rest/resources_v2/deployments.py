@@ -52,6 +52,7 @@ class Deployments(resources_v1.Deployments):
     @rest_decorators.search_multiple_parameters(
         {'_search': 'id', '_search_name': 'display_name'})
     @rest_decorators.filter_id
+    @rest_decorators.streamable
     def get(self, _include=None, filters=None, pagination=None, sort=None,
             all_tenants=None, search=None, filter_id=None, **kwargs):
         """
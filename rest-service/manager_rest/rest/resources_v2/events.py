@@ -33,6 +33,10 @@ from manager_rest.storage.resource_models import (
     Log,
 )
 from manager_rest.storage import ListResult
+from manager_rest.storage.storage_manager import (
+    COUNT_EXACT,
+    COUNT_ESTIMATED,
+)
 from manager_rest.security.authorization import authorize
 
 
@@ -61,7 +65,7 @@ class Events(resources_v1.Events):
         """List events using a SQL backend.
 
         :param _include:
-            Projection used to get records from database (not currently used)
+            Projection used to get records from database
         :type _include: list(str)
         :param filters:
             Filter selection.
@@ -73,11 +77,19 @@ class Events(resources_v1.Events):
 
             Also it's used to get only events for a particular execution:
                 {'execution_id': '<some uuid>'}
+            or to search the messages for a case-insensitive substring:
+                {'message_contains': ['<some text>']}
         :type filters: dict(str, str)
         :param pagination:
             Parameters used to limit results returned in a single query.
             Expected values `size` and `offset` are mapped into SQL as `LIMIT`
             and `OFFSET`.
+            Alternatively, `cursor` can be passed instead of `offset`: an
+            empty cursor to get the first page, and then the `next_cursor`
+            returned in the pagination metadata, to get each next page.
+            Fetching any page then costs the same as fetching the first one.
+            With a cursor, the total is estimated, unless `count` asks
+            otherwise: an exact count would cost as much as an OFFSET.
         :type pagination: dict(str, int)
         :param sort:
             Result sorting order. The only allowed and expected value is to
@@ -96,18 +108,24 @@ class Events(resources_v1.Events):
         """
         size = pagination.get('size', self.DEFAULT_SEARCH_SIZE)
         offset = pagination.get('offset', 0)
-        params = {
-            'limit': size,
-            'offset': offset,
-        }
+        cursor = pagination.get('cursor')
+        params = {'limit': size}
+        if cursor is None:
+            params['offset'] = offset
 
+        count = pagination.get(
+            'count', COUNT_EXACT if cursor is None else COUNT_ESTIMATED)
         select_query, total = self._build_select_query(
-            filters, sort, range_filters, self.current_tenant.id
+            filters, sort, range_filters, self.current_tenant.id,
+            cursor=cursor,
+            count=count,
+            include=self._db_projection(_include),
         )
 
+        events = select_query.params(**params).all()
         results = [
             self._map_event_to_dict(_include, event)
-            for event in select_query.params(**params).all()
+            for event in events
         ]
 
         metadata = {
@@ -117,8 +135,25 @@ class Events(resources_v1.Events):
                 'total': total,
             }
         }
+        if count != COUNT_EXACT:
+            metadata['pagination']['count'] = count
+        if cursor is not None:
+            # a short page means there's nothing more to fetch
+            metadata['pagination']['next_cursor'] = (
+                self._encode_cursor(events[-1])
+                if events and len(events) == size else None
+            )
         return ListResult(results, metadata)
 
+    @staticmethod
+    def _db_projection(_include):
+        """Names of the columns to select, for the given _include.
+
+        The fields returned here are restructured from the columns (see
+        _map_event_to_dict), so all the columns are needed.
+        """
+        return None
+
     def post(self):
         raise manager_exceptions.MethodNotAllowedError()
 
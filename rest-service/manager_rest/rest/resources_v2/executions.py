@@ -53,6 +53,7 @@ class Executions(resources_v1.Executions):
     @rest_decorators.paginate
     @rest_decorators.sortable(models.Execution)
     @rest_decorators.all_tenants
+    @rest_decorators.streamable
     def get(self, _include=None, filters=None, pagination=None,
             sort=None, all_tenants=None, **kwargs):
         """
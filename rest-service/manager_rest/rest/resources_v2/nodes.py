@@ -102,6 +102,7 @@ class NodeInstances(resources_v1.NodeInstances):
     @rest_decorators.sortable(models.NodeInstance)
     @rest_decorators.all_tenants
     @rest_decorators.search('id')
+    @rest_decorators.streamable
     def get(self, _include=None, filters=None, pagination=None,
             sort=None, all_tenants=None, search=None, **kwargs):
         """
@@ -28,7 +28,7 @@ class Events(v2_Events):
     stored in the SQL database.
     """
 
-    UNUSED_FIELDS = ['id', 'node_id', 'message_code']
+    UNUSED_FIELDS = ['id', 'node_id', 'message_code', '_cursor_timestamp']
 
     @authorize('event_create', allow_if_execution=True)
     @detach_globals
@@ -129,6 +129,13 @@ class Events(v2_Events):
             **exc_params,
         )
 
+    @staticmethod
+    def _db_projection(_include):
+        """The returned fields are the selected columns, so select only
+        the ones in _include.
+        """
+        return _include
+
     @staticmethod
     def _map_event_to_dict(_include, sql_event):
         """Map event to a dictionary to be sent as an API response.
@@ -155,14 +162,16 @@ class Events(v2_Events):
             if unused_field in event:
                 del event[unused_field]
 
+        # with a projection, these might not have been selected at all
         if event['type'] == 'cloudify_event':
-            del event['logger']
-            del event['level']
+            event.pop('logger', None)
+            event.pop('level', None)
         elif event['type'] == 'cloudify_log':
-            del event['event_type']
+            event.pop('event_type', None)
 
-        # Keep only keys passed in the _include request argument
-        # TBD: Do the projection at the database level
+        # Keep only keys passed in the _include request argument. The
+        # projection was done at the database level already (see
+        # _db_projection), but some columns are always selected
         if _include is not None:
             event = {k: v for k, v in event.items() if k in _include}
 
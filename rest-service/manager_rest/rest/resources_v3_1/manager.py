@@ -352,9 +352,9 @@ class MonitoringAuth(Resource):
         # don't have any CSRF protection, and this one is read-only anyway.
         if token := request.cookies.get('XSRF-TOKEN'):
             user = get_token_status(token)
-            monitoring_allowed_roles = set(
-                config.instance.authorization_permissions
-                .get('monitoring', [])
+            monitoring_allowed_roles = (
+                config.instance.authorization_permission_roles
+                .get('monitoring', frozenset())
             )
             if (
                 user.is_bootstrap_admin
@@ -414,6 +414,10 @@ class CapabilitiesSearches(ResourceSearches):
             '_get_all_results',
             request.args.get('_get_all_results', False)
         )
+        # `filtered` and the total are recomputed from the deployments'
+        # total below, so that must be counted exactly
+        if pagination:
+            pagination.pop('count', None)
 
         deployments = get_storage_manager().list(
             models.Deployment,
@@ -9,6 +9,7 @@ from manager_rest.rest import responses
 from manager_rest.security import SecuredResource
 from manager_rest.security.authorization import (authorize,
                                                  is_user_action_allowed)
+from manager_rest.security.user_handler import forget_token
 from manager_rest.storage import models, get_storage_manager
 from manager_rest.storage.models_base import db
 from manager_rest.rest.rest_decorators import (
@@ -66,6 +67,7 @@ class TokensId(SecuredResource):
         token = sm.get(models.Token, token_id, fail_silently=True)
         if token and _can_manage_token(token):
             sm.delete(token)
+            forget_token(token_id)
             return None, 204
         else:
             raise NotFoundError(f'Could not find token {token_id}')
@@ -96,6 +98,9 @@ def _purge_expired_user_tokens():
         models.Token.expiration_date <= datetime.utcnow()
     ).all()
     if expired:
+        expired_ids = [token.id for token in expired]
         for token in expired:
             db.session.delete(token)
         db.session.commit()
+        for token_id in expired_ids:
+            forget_token(token_id)
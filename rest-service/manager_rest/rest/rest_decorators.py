@@ -1,4 +1,5 @@
 import inspect
+import json
 from functools import wraps
 from collections import OrderedDict
 from typing import Dict
@@ -6,10 +7,10 @@ from datetime import datetime
 
 from flask_restful import fields, marshal
 from flask_restful.utils import unpack
-from flask import request, current_app
+from flask import request, current_app, Response, stream_with_context
 
 from cloudify.models_states import ExecutionState
-from manager_rest import config, manager_exceptions
+from manager_rest import config, manager_exceptions, profiling
 from manager_rest.utils import current_tenant
 from manager_rest.security.authorization import is_user_action_allowed
 from manager_rest.storage.models_base import SQLModelBase, db
@@ -98,41 +99,65 @@ class marshal_with(object):
                 kwargs['_include'] = list(fields_to_include.keys())
 
             response = f(*args, **kwargs)
+            with profiling.phase('marshal'):
+                return self._marshal_response(response, fields_to_include)
 
-            def wrap_list_items(response):
-                wrapped_items = self.wrap_with_response_object(
-                    response.items, fields_to_include)
-                if self._include_hash():
-                    fields_to_include['password_hash'] = fields.String
-                response.items = marshal(wrapped_items, fields_to_include)
-                return response
-
-            if isinstance(response, ListResponse):
-                return marshal(wrap_list_items(response),
-                               ListResponse.resource_fields)
-            if isinstance(response, tuple):
-                data, code, headers = unpack(response)
-                if isinstance(data, ListResponse):
-                    data = wrap_list_items(data)
-                    return (marshal(data, ListResponse.resource_fields),
-                            code,
-                            headers)
-                else:
-                    data = self.wrap_with_response_object(
-                        data, fields_to_include)
-
-                    if data is None:
-                        return None, code, headers
-
-                    return marshal(data, fields_to_include), code, headers
-            elif response is None:
-                return None, 204
+        return wrapper
+
+    def _marshal_response(self, response, fields_to_include):
+        def wrap_list_items(response):
+            wrapped_items = self.wrap_with_response_object(
+                response.items, fields_to_include)
+            if self._include_hash():
+                fields_to_include['password_hash'] = fields.String
+            response.items = marshal(wrapped_items, fields_to_include)
+            return response
+
+        if isinstance(response, ListResponse):
+            if response.metadata.get('pagination', {}).get('stream'):
+                return self.stream_list_items(response, fields_to_include)
+            return marshal(wrap_list_items(response),
+                           ListResponse.resource_fields)
+        if isinstance(response, tuple):
+            data, code, headers = unpack(response)
+            if isinstance(data, ListResponse):
+                data = wrap_list_items(data)
+                return (marshal(data, ListResponse.resource_fields),
+                        code,
+                        headers)
             else:
-                response = self.wrap_with_response_object(
-                    response, fields_to_include)
-                return marshal(response, fields_to_include)
+                data = self.wrap_with_response_object(
+                    data, fields_to_include)
 
-        return wrapper
+                if data is None:
+                    return None, code, headers
+
+                return marshal(data, fields_to_include), code, headers
+        elif response is None:
+            return None, 204
+        else:
+            response = self.wrap_with_response_object(
+                response, fields_to_include)
+            return marshal(response, fields_to_include)
+
+    def stream_list_items(self, response, fields_to_include):
+        """Send the list as newline-delimited JSON.
+
+        The first line is the metadata, and each following line is one
+        item, marshalled as soon as it's fetched from the db.
+        """
+        item_fields = dict(fields_to_include)
+        if self._include_hash():
+            item_fields['password_hash'] = fields.String
+
+        def generate():
+            yield json.dumps({'metadata': response.metadata}) + '\n'
+            for item in response.items:
+                data = self.wrap_with_response_object(item, fields_to_include)
+                yield json.dumps(marshal(data, item_fields)) + '\n'
+
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
 
     def wrap_with_response_object(self, data, fields_to_include):
         if isinstance(data, dict):
@@ -311,12 +336,20 @@ def all_tenants(func):
     return is_all_tenants
 
 
+def escape_like(pattern):
+    """Escape the LIKE wildcards in pattern, to match it literally.
+
+    Use it with escape='\\' in the like/ilike call.
+    """
+    for char in SPECIAL_CHARS:
+        pattern = pattern.replace(char, '\\{0}'.format(char))
+    return pattern
+
+
 def _get_search_pattern(parameter):
     pattern = request.args.get(parameter)
     if pattern:
-        pattern = normalize_value(pattern)
-        for char in SPECIAL_CHARS:
-            pattern = pattern.replace(char, '\\{0}'.format(char))
+        pattern = escape_like(normalize_value(pattern))
     return pattern
 
 
@@ -389,6 +422,8 @@ def paginate(func):
         pagination_params = Pagination.parse_obj(request.args).dict(
             exclude_none=True,
         )
+        if not getattr(func, 'streamable', False):
+            pagination_params.pop('stream', None)
 
         result = func(pagination=pagination_params, *args, **kw)
         return ListResponse(items=result.items, metadata=result.metadata)
@@ -396,6 +431,19 @@ def paginate(func):
     return verify_and_create_pagination_params
 
 
+def streamable(func):
+    """Decorator allowing to stream the list results, see `paginate`.
+
+    When the `_stream` parameter is passed, the storage manager fetches the
+    items lazily, and marshal_with sends them as newline-delimited JSON.
+    Only use this for endpoints that return the storage manager's list
+    result as-is, without going over its items. Must be applied below
+    `paginate`.
+    """
+    func.streamable = True
+    return func
+
+
 def create_filters(response_class=None):
     """
     Decorator for extracting filter parameters from the request arguments and
@@ -1,4 +1,5 @@
 from typing import (
+    Literal,
     Optional,
     List,
 )
@@ -23,6 +24,19 @@ class Pagination(BaseModel):
     offset: Optional[NonNegativeInt] = Field(
         alias='_offset',
     )
+    # opaque keyset pagination cursor; only supported by some endpoints
+    cursor: Optional[str] = Field(
+        alias='_cursor',
+    )
+    # how to compute the total: see storage_manager.count_query
+    count: Optional[Literal['exact', 'estimated', 'none']] = Field(
+        alias='_count',
+    )
+    # send the items as newline-delimited JSON, as they're fetched from
+    # the db; only supported by some endpoints, see rest_decorators.streamable
+    stream: Optional[bool] = Field(
+        alias='_stream',
+    )
 
 
 class Range(BaseModel):
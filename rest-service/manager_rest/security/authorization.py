@@ -1,18 +1,43 @@
+import threading
 from functools import wraps
 
-from flask import request
+from cachetools import LRUCache
+from flask import current_app, request
 from flask_security import current_user
+from sqlalchemy import orm
 
-from manager_rest import config, utils
+from manager_rest import config, profiling, utils
 from manager_rest.execution_token import current_execution
 from manager_rest.security import audit
 from manager_rest.storage.models import Tenant
-from manager_rest.storage import get_storage_manager
+from manager_rest.storage import db, get_storage_manager
 from manager_rest.constants import CLOUDIFY_TENANT_HEADER
 from manager_rest.manager_exceptions import NotFoundError, ForbiddenError
 from manager_rest.rest.rest_utils import (get_json_and_verify_params,
                                           request_use_all_tenants)
 
+# the tables that the users' effective roles are computed from
+USER_ROLES_TABLES = [
+    'roles',
+    'tenants',
+    'users_roles',
+    'users_groups',
+    'users_tenants',
+    'groups_roles',
+    'groups_tenants',
+]
+USER_ROLES_CACHE_SIZE = 1000
+
+_user_roles = LRUCache(USER_ROLES_CACHE_SIZE)
+_user_roles_versions = None
+_user_roles_lock = threading.Lock()
+
+TENANTS_CACHE_SIZE = 1000
+
+_tenants = LRUCache(TENANTS_CACHE_SIZE)
+_tenants_versions = None
+_tenants_lock = threading.Lock()
+
 
 def authorize(action,
               get_tenant_from='header',
@@ -40,11 +65,8 @@ def authorize(action,
 
             if tenant_name:
                 try:
-                    tenant = get_storage_manager().get(
-                        Tenant,
-                        None,
-                        filters={'name': tenant_name}
-                    )
+                    with profiling.phase('authorization'):
+                        tenant = _get_tenant(tenant_name)
                     utils.set_current_tenant(tenant)
                     audit.set_tenant(tenant.name)
                 except NotFoundError:
@@ -57,7 +79,9 @@ def authorize(action,
             if config.instance.test_mode:
                 return func(*args, **kwargs)
 
-            check_user_action_allowed(action, tenant_name, allow_all_tenants)
+            with profiling.phase('authorization'):
+                check_user_action_allowed(
+                    action, tenant_name, allow_all_tenants)
 
             return func(*args, **kwargs)
 
@@ -65,22 +89,102 @@ def authorize(action,
     return authorize_dec
 
 
+def _get_tenant(tenant_name):
+    """The tenant of that name, for the current request.
+
+    Every request looks its tenant up, so the tenants are cached in each
+    worker, detached, and merged into the request's session without
+    querying the db. The cache is only used while the app's change listener
+    (see server.CloudifyFlaskApp) is connected, and it's cleared whenever
+    the tenants change.
+    """
+    global _tenants_versions
+    listener = current_app.extensions.get('change_listener')
+    versions = listener.versions('tenants') if listener else None
+    if versions is None:
+        return get_storage_manager().get(
+            Tenant,
+            None,
+            filters={'name': tenant_name}
+        )
+
+    with _tenants_lock:
+        if versions != _tenants_versions:
+            _tenants.clear()
+            _tenants_versions = versions
+        tenant = _tenants.get(tenant_name)
+    if tenant is None:
+        # load it in a separate session, so that it's detached once that
+        # session is closed, and can be cached
+        session = orm.Session(bind=db.engine)
+        try:
+            tenant = session.query(Tenant).filter_by(name=tenant_name).first()
+        finally:
+            session.close()
+        if tenant is None:
+            raise NotFoundError(f'Tenant not found: {tenant_name}')
+        # the versions were checked before loading the tenant, so if they
+        # change in the meantime, it will be dropped by the next request
+        with _tenants_lock:
+            if versions == _tenants_versions:
+                _tenants[tenant_name] = tenant
+    return db.session.merge(tenant, load=False)
+
+
 def get_current_user_roles(tenant_name=None, allow_all_tenants=False):
     if not current_user.is_authenticated:
         return []
 
-    tenant_roles = []
+    system_roles, tenant_roles = _get_user_roles(current_user)
+    use_all_tenants = allow_all_tenants and request_use_all_tenants()
 
     # extracting tenant roles for user in the tenant
-    for t in current_user.all_tenants:
-        if (allow_all_tenants and request_use_all_tenants()) \
-                or t.name == tenant_name:
-            tenant_roles += current_user.all_tenants[t]
+    user_roles = []
+    for t, roles in tenant_roles.items():
+        if use_all_tenants or t == tenant_name:
+            user_roles += roles
 
     # joining user's system role with his tenant roles
-    user_roles = [role.name for role in tenant_roles] \
-        + current_user.system_roles
-    return user_roles
+    return user_roles + system_roles
+
+
+def _get_user_roles(user):
+    """The user's system role names, and role names by tenant name.
+
+    Computing these requires going through all the user's tenants and
+    groups, so they're cached in each worker. The cache is only used while
+    the app's change listener (see server.CloudifyFlaskApp) is connected,
+    and it's cleared whenever any of USER_ROLES_TABLES change.
+    """
+    global _user_roles_versions
+    listener = current_app.extensions.get('change_listener')
+    versions = listener.versions(*USER_ROLES_TABLES) if listener else None
+    if versions is None:
+        return _compute_user_roles(user)
+
+    with _user_roles_lock:
+        if versions != _user_roles_versions:
+            _user_roles.clear()
+            _user_roles_versions = versions
+        cached = _user_roles.get(user.id)
+    if cached is not None:
+        return cached
+
+    # the versions were checked before computing the roles, so if they
+    # change in the meantime, these will be dropped by the next request
+    roles = _compute_user_roles(user)
+    with _user_roles_lock:
+        if versions == _user_roles_versions:
+            _user_roles[user.id] = roles
+    return roles
+
+
+def _compute_user_roles(user):
+    tenant_roles = {
+        tenant.name: [role.name for role in roles]
+        for tenant, roles in user.all_tenants.items()
+    }
+    return user.system_roles, tenant_roles
 
 
 def is_user_action_allowed(action, tenant_name=None, allow_all_tenants=False):
@@ -88,8 +192,8 @@ def is_user_action_allowed(action, tenant_name=None, allow_all_tenants=False):
         # bootstrap admin is allowed to do _everything_
         return True
     user_roles = get_current_user_roles(tenant_name, allow_all_tenants)
-    action_roles = config.instance.authorization_permissions[action]
-    return set(user_roles) & set(action_roles)
+    action_roles = config.instance.authorization_permission_roles[action]
+    return not action_roles.isdisjoint(user_roles)
 
 
 def check_user_action_allowed(action, tenant_name=None,
@@ -20,7 +20,7 @@ from flask_restful.utils import unpack
 from werkzeug.exceptions import HTTPException
 from flask import request, Response, jsonify
 
-from manager_rest import premium_enabled
+from manager_rest import premium_enabled, profiling
 from manager_rest.manager_exceptions import MissingPremiumPackage
 from .authentication import authenticate as auth_user
 
@@ -48,7 +48,8 @@ def authenticate(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        auth_response = auth_user(request)
+        with profiling.phase('auth'):
+            auth_response = auth_user(request)
         auth_headers = getattr(auth_response, 'response_headers', {})
         if isinstance(auth_response, Response):
             return auth_response
@@ -1,14 +1,17 @@
 from datetime import datetime
+import hashlib
 import string
+import threading
 from typing import Optional
 
+from cachetools import TTLCache
 from flask import current_app, Response, abort, Request
 from flask_security.utils import verify_password
 
 from cloudify.workflows import tasks
 from cloudify.models_states import ExecutionState
 
-from manager_rest.storage.models import Token, User
+from manager_rest.storage.models import Operation, TasksGraph, Token, User
 from manager_rest.storage.models_base import db
 from manager_rest.manager_exceptions import (
     NoAuthProvided,
@@ -28,6 +31,35 @@ from manager_rest.utils import (
     check_unauthenticated_endpoint
 )
 
+# Tokens whose secret was recently verified, keyed by a digest of the whole
+# token value, because verify_password is slow on purpose. This is only used
+# while the app's change listener (see server.CloudifyFlaskApp) is
+# connected, and the cache is cleared whenever tokens are deleted, by any
+# worker or manager. last_used is only stored when the token is verified,
+# ie. at most once per TOKEN_CACHE_TTL seconds for each token and worker.
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TTL = 60
+
+_verified_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+_verified_tokens_versions = None
+_verified_tokens_lock = threading.Lock()
+
+# Whether a cancelled execution still has operations that aren't finished,
+# which allows it to keep using its token. Its workflow makes lots of
+# requests while finishing those, so don't check on each of them. The key
+# contains the status and the end time, so a status change invalidates the
+# entry; the operations can finish without changing those, so the entries
+# also expire soon.
+CANCELLED_EXECUTIONS_CACHE_SIZE = 1000
+CANCELLED_EXECUTIONS_CACHE_TTL = 10
+
+_cancelled_executions = TTLCache(maxsize=CANCELLED_EXECUTIONS_CACHE_SIZE,
+                                 ttl=CANCELLED_EXECUTIONS_CACHE_TTL)
+_cancelled_executions_lock = threading.Lock()
+
+# API tokens (see Token.value) are never execution tokens
+API_TOKEN_PREFIX = 'ctok-'
+
 
 def user_loader(request: Request) -> Optional[User]:
     """Load a user object based on the request.
@@ -67,6 +99,10 @@ def _get_user_from_execution_token(request):
     token = get_token_from_request(request)
     if not execution_token and not token:
         return None
+    if not execution_token and token.startswith(API_TOKEN_PREFIX):
+        # no need to look for an execution with that token
+        set_current_execution(None)
+        return None
 
     # Support using the exec token as an auth token for workflows
     execution = get_current_execution_by_token(execution_token or token)
@@ -107,11 +143,27 @@ def _is_valid_cancelled_execution():
     if current_execution.status != ExecutionState.CANCELLED:
         return False
 
-    for graph in current_execution.tasks_graphs:
-        for operation in graph.operations:
-            if operation.state not in tasks.TERMINATED_STATES:
-                return True
-    return False
+    key = (
+        current_execution._storage_id,
+        current_execution.status,
+        current_execution.ended_at,
+    )
+    with _cancelled_executions_lock:
+        is_valid = _cancelled_executions.get(key)
+    if is_valid is None:
+        is_valid = db.session.query(
+            db.session.query(Operation)
+            .join(TasksGraph, Operation._tasks_graph_fk ==
+                  TasksGraph._storage_id)
+            .filter(
+                TasksGraph._execution_fk == current_execution._storage_id,
+                Operation.state.notin_(tasks.TERMINATED_STATES),
+            )
+            .exists()
+        ).scalar()
+        with _cancelled_executions_lock:
+            _cancelled_executions[key] = is_valid
+    return is_valid
 
 
 def _get_user_from_external_auth(request):
@@ -176,6 +228,7 @@ def get_token_from_request(request):
 
 
 def get_token_status(token):
+    global _verified_tokens_versions
     user = None
     error = None
 
@@ -183,6 +236,24 @@ def get_token_status(token):
     if len(token_parts) == 3:
         _, tok_id, tok_secret = token_parts
 
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        listener = current_app.extensions.get('change_listener')
+        versions = listener.versions('tokens') if listener else None
+        with _verified_tokens_lock:
+            if versions != _verified_tokens_versions:
+                _verified_tokens.clear()
+                _verified_tokens_versions = versions
+            cached = _verified_tokens.get(digest)
+        if cached is not None:
+            _, user_id, expiration_date = cached
+            if expiration_date is not None and is_expired(expiration_date):
+                forget_token(tok_id)
+                raise UnauthorizedError('Token is expired')
+            user = user_datastore.find_user(id=user_id)
+            if not user:
+                raise NoAuthProvided()
+            return user
+
         sm = get_storage_manager()
         token = sm.get(Token, tok_id, fail_silently=True)
 
@@ -199,6 +270,13 @@ def get_token_status(token):
         if not error:
             token.last_used = datetime.utcnow()
             db.session.commit()
+            # the versions were checked before loading the token, so if
+            # it's deleted in the meantime, the next request will drop it
+            if user and versions is not None:
+                with _verified_tokens_lock:
+                    if versions == _verified_tokens_versions:
+                        _verified_tokens[digest] = (
+                            token.id, token._user_fk, token.expiration_date)
     else:
         error = 'Invalid token structure'
 
@@ -209,3 +287,16 @@ def get_token_status(token):
         raise NoAuthProvided()
 
     return user
+
+
+def forget_token(token_id):
+    """Remove the token from the cache of verified tokens.
+
+    Call this when the token is deleted, so that this worker stops
+    accepting it right away, without waiting for the change listener
+    to be notified.
+    """
+    with _verified_tokens_lock:
+        for digest, (cached_id, _, _) in list(_verified_tokens.items()):
+            if cached_id == token_id:
+                _verified_tokens.pop(digest, None)
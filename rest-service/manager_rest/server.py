@@ -19,7 +19,8 @@ from pydantic import ValidationError
 from manager_rest import (config,
                           premium_enabled,
                           manager_exceptions)
-from manager_rest import persistent_storage
+from manager_rest import metrics, persistent_storage, profiling
+from manager_rest.change_listener import ChangeListener
 from manager_rest.storage import db, user_datastore
 from manager_rest.security.user_handler import user_loader
 from manager_rest.security import audit
@@ -80,7 +81,25 @@ def _validation_error(e):
     ), manager_exceptions.BadParametersError.status_code
 
 
+# set in the pool's connection info, once a connection was checked to be to
+# the primary db, and not to a hot standby
+PRIMARY_CHECKED = 'primary_checked'
+
+
+@event.listens_for(Pool, 'connect')
+def reset_primary_check(dbapi_conn, conn_record):
+    # a new connection (eg. after a connection error) might be to a different
+    # db, so it will need to be checked again
+    conn_record.info.pop(PRIMARY_CHECKED, None)
+
+
 def cope_with_db_failover():
+    """Make sure the session's connection is to the primary db.
+
+    Every connection is only checked once, when it's first checked out
+    from the pool: after that, the check result is kept in the connection's
+    info, and requests reusing that connection don't query the db here.
+    """
     # These two when multiplied together should be over 30 seconds as that's
     # about how long a failover can take in reasonable (not overcommitted)
     # conditions.
@@ -88,6 +107,9 @@ def cope_with_db_failover():
     attempt_delay = 1
     for attempt in range(1, max_attempts + 1):
         try:
+            connection = db.session.connection()
+            if connection.info.get(PRIMARY_CHECKED):
+                break
             standby = db.session.execute(
                 'SELECT pg_is_in_recovery()').fetchall()[0][0]
             if standby:
@@ -99,6 +121,7 @@ def cope_with_db_failover():
                 close_all_sessions()
                 time.sleep(attempt_delay)
             else:
+                connection.info[PRIMARY_CHECKED] = True
                 break
         except OperationalError as err:
             current_app.logger.warning(
@@ -130,8 +153,19 @@ class CloudifyFlaskApp(Flask):
                 config.instance.can_load_from_db = False
             self._set_sql_alchemy()
 
-        # This must be the first before_request, otherwise db access may break
-        # after db failovers
+        if load_config:
+            # lets the workers only check for config changes when notified
+            self.extensions['change_listener'] = ChangeListener(
+                lambda: config.instance.db_url, self.logger)
+            self.extensions['change_listener'].start()
+
+        # These don't access the db, so they can come before
+        # cope_with_db_failover, and measure it as well
+        self.before_request(profiling.start_profiling)
+        self.before_request(metrics.request_started)
+        self.teardown_request(metrics.request_torn_down)
+        # This must be the first before_request that accesses the db,
+        # otherwise db access may break after db failovers
         self.before_request(cope_with_db_failover)
 
         # These two need to be called after the configuration was loaded
@@ -143,6 +177,9 @@ class CloudifyFlaskApp(Flask):
         else:
             self.external_auth = None
 
+        # after_request hooks run in reverse order, so this one runs last
+        self.after_request(profiling.add_server_timing)
+        self.after_request(metrics.request_finished)
         self.before_request(log_request)
         self.before_request(query_service_settings)
         self.before_request(init_storage_handler)
@@ -150,6 +187,7 @@ class CloudifyFlaskApp(Flask):
         self.after_request(log_response)
         self.before_request(audit.reset)
         self.after_request(audit.extend_headers)
+        self.before_request(profiling.end_before_request)
         self._set_flask_security()
 
         with self.app_context():
@@ -196,6 +234,7 @@ class CloudifyFlaskApp(Flask):
         self.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
             'pool_size': 1,
             'client_encoding': 'utf-8',
+            'poolclass': metrics.MeteredQueuePool,
         }
         self.update_db_uri()
         self.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -321,7 +321,7 @@ class User(CreatedAtMixin, SQLModelBase, UserMixin):
 
     def has_role_in(self, tenant, list_of_roles):
         user_roles = self.roles_in_tenant(tenant)
-        return any(r in user_roles for r in list_of_roles)
+        return not user_roles.isdisjoint(list_of_roles)
 
     def roles_in_tenant(self, tenant):
         tenant_roles = set(self.system_roles)
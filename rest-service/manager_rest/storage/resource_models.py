@@ -1746,10 +1746,30 @@ class Event(SQLResourceBase):
             'events_node_id_visibility_idx',
             'node_id', 'visibility'
         ),
+        # for cursor pagination of an execution's events
+        db.Index(
+            'events__execution_fk_reported_timestamp_idx',
+            '_execution_fk', 'reported_timestamp', '_storage_id'
+        ),
+        # for purging a tenant's old events, see storage_utils
+        db.Index(
+            'events__tenant_id_reported_timestamp_idx',
+            '_tenant_id', 'reported_timestamp', '_storage_id'
+        ),
+        # for the message substring search; needs the pg_trgm extension
+        db.Index(
+            'events_message_trgm_idx',
+            'message',
+            postgresql_using='gin',
+            postgresql_ops={'message': 'gin_trgm_ops'},
+        ),
         CheckConstraint(
             '(_execution_fk IS NOT NULL) != (_execution_group_fk IS NOT NULL)',
             name='events__one_fk_not_null'
         ),
+        # partitions are created by the migrations, and then periodically
+        # by storage_utils.create_events_logs_partitions
+        {'postgresql_partition_by': 'RANGE (reported_timestamp)'},
     )
     id = None  # this is just to override the parent class attribute
     timestamp = db.Column(
@@ -1758,7 +1778,9 @@ class Event(SQLResourceBase):
         nullable=False,
         index=True,
     )
-    reported_timestamp = db.Column(UTCDateTime, nullable=False)
+    # part of the primary key, because it's the partitioning column
+    reported_timestamp = db.Column(UTCDateTime, nullable=False,
+                                   primary_key=True)
     message = db.Column(db.Text)
     message_code = db.Column(db.Text)
     event_type = db.Column(db.Text)
@@ -1807,10 +1829,30 @@ class Log(SQLResourceBase):
             'logs_node_id_visibility_execution_fk_idx',
             'node_id', 'visibility', '_execution_fk'
         ),
+        # for cursor pagination of an execution's logs
+        db.Index(
+            'logs__execution_fk_reported_timestamp_idx',
+            '_execution_fk', 'reported_timestamp', '_storage_id'
+        ),
+        # for purging a tenant's old logs, see storage_utils
+        db.Index(
+            'logs__tenant_id_reported_timestamp_idx',
+            '_tenant_id', 'reported_timestamp', '_storage_id'
+        ),
+        # for the message substring search; needs the pg_trgm extension
+        db.Index(
+            'logs_message_trgm_idx',
+            'message',
+            postgresql_using='gin',
+            postgresql_ops={'message': 'gin_trgm_ops'},
+        ),
         CheckConstraint(
             '(_execution_fk IS NOT NULL) != (_execution_group_fk IS NOT NULL)',
             name='logs__one_fk_not_null'
         ),
+        # partitions are created by the migrations, and then periodically
+        # by storage_utils.create_events_logs_partitions
+        {'postgresql_partition_by': 'RANGE (reported_timestamp)'},
     )
     id = None  # this is just to override the parent class attribute
     timestamp = db.Column(
@@ -1819,7 +1861,9 @@ class Log(SQLResourceBase):
         nullable=False,
         index=True,
     )
-    reported_timestamp = db.Column(UTCDateTime, nullable=False)
+    # part of the primary key, because it's the partitioning column
+    reported_timestamp = db.Column(UTCDateTime, nullable=False,
+                                   primary_key=True)
     message = db.Column(db.Text)
     message_code = db.Column(db.Text)
     logger = db.Column(db.Text)
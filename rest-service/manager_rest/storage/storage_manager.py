@@ -33,6 +33,8 @@ from sqlalchemy.exc import (
     MultipleResultsFound,
 )
 from sqlalchemy.ext.associationproxy import AssociationProxyInstance
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from flask import current_app, has_request_context
 from sqlalchemy.orm.attributes import flag_modified
 
@@ -50,6 +52,17 @@ from psycopg2 import DatabaseError as Psycopg2DBError
 from psycopg2.errors import CheckViolation
 sql_errors = (SQLAlchemyError, Psycopg2DBError, CheckViolation, IntegrityError)
 
+# How to compute the total count in the pagination metadata:
+# exactly, by running a COUNT query; approximately, using the planner's
+# estimate of the row count; or not at all
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATED = 'estimated'
+COUNT_NONE = 'none'
+
+# When streaming list results, how many rows to fetch from the
+# server-side cursor at a time
+STREAM_CHUNK_SIZE = 500
+
 
 def no_autoflush(f):
     @wraps(f)
@@ -60,6 +73,38 @@ def no_autoflush(f):
     return wrapper
 
 
+class _Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) the given statement, without running it"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, 'postgresql')
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) {0}'.format(
+        compiler.process(element.statement, **kw))
+
+
+def count_query(query, count=COUNT_EXACT):
+    """Count the rows returned by query, as requested by count.
+
+    :param query: The SQLAlchemy query to count the results of
+    :param count: One of COUNT_EXACT, COUNT_ESTIMATED, COUNT_NONE
+    :return: The number of rows, or None when count is COUNT_NONE.
+             The estimate is the planner's, so it is only as accurate
+             as the table statistics are.
+    """
+    query = query.order_by(None)
+    if count == COUNT_NONE:
+        return None
+    if count == COUNT_ESTIMATED:
+        plan = db.session.execute(_Explain(query.statement)).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+    return query.count()
+
+
 class _Transaction(object):
     """A transaction controller yielded by `sm.transaction()`
 
@@ -462,9 +507,12 @@ class SQLStorageManager(object):
         """Paginate the query by size and offset
 
         :param query: Current SQLAlchemy query object
-        :param pagination: An optional dict with size and offset keys
+        :param pagination: An optional dict with size and offset keys,
+            count - how to compute the total, see count_query - and stream:
+            whether to fetch the results lazily, using a server-side cursor
         :return: A tuple with four elements:
-        - results: `size` items starting from `offset`
+        - results: `size` items starting from `offset`; if streaming, an
+          iterable fetching them from the db as it's iterated over
         - the total count of items
         - `size` [default: 0]
         - `offset` [default: 0]
@@ -474,20 +522,40 @@ class SQLStorageManager(object):
             size = pagination.get('size', config.instance.default_page_size)
             SQLStorageManager._validate_pagination(size)
             offset = pagination.get('offset', 0)
+            count = pagination.get('count', COUNT_EXACT)
+            stream = pagination.get('stream', False)
         else:
             size = config.instance.default_page_size
             offset = 0
+            count = COUNT_EXACT
+            stream = False
 
-        total = query.order_by(None).count()
+        total = count_query(query, count)
         if locking:
             query = query.with_for_update(of=model_class)
-        if get_all_results:
-            results = query.all()
+        if not get_all_results:
+            query = query.limit(size).offset(offset)
+        if stream:
+            results = query.yield_per(STREAM_CHUNK_SIZE)
         else:
-            results = query.limit(size).offset(offset).all()
+            results = query.all()
 
         return results, total, size, offset
 
+    @staticmethod
+    def _can_stream(model_class, include):
+        """Can the results be fetched lazily, from a server-side cursor?
+
+        SQLAlchemy only allows that if no collection is eager-loaded
+        using a join, which is what including a collection does.
+        """
+        for field_name in include or []:
+            field = getattr(model_class, field_name, None)
+            prop = getattr(field, 'prop', None)
+            if isinstance(prop, RelationshipProperty) and prop.uselist:
+                return False
+        return True
+
     @staticmethod
     def _validate_pagination(pagination_size):
         if pagination_size < 0:
@@ -678,9 +746,13 @@ class SQLStorageManager(object):
         :param distinct: An optional list of columns names to get distinct
                          results by.
         :param filter_rules: A list of filter rules.
-        :return: A (possibly empty) list of `model_class` results
+        :return: A (possibly empty) list of `model_class` results; when
+                 streaming (see _paginate), the items are an iterable instead
         """
         self._validate_available_memory()
+        if pagination and pagination.get('stream') \
+                and not self._can_stream(model_class, include):
+            pagination = dict(pagination, stream=False)
 
         if filters:
             msg = 'List `{0}` with filter {1}'.format(model_class.__name__,
@@ -706,13 +778,21 @@ class SQLStorageManager(object):
             get_all_results,
             locking=locking,
         )
+        count = (pagination or {}).get('count', COUNT_EXACT)
+        stream = (pagination or {}).get('stream', False)
         pagination = {'total': total, 'size': size, 'offset': offset}
-        if filter_rules:
-            filtered = self._add_tenant_filter(
+        if count != COUNT_EXACT:
+            pagination['count'] = count
+        if stream:
+            pagination['stream'] = True
+        if filter_rules and total is not None:
+            # estimates of both counts might not add up, so don't let
+            # the difference go negative
+            filtered = max(count_query(self._add_tenant_filter(
                 model_class.query,
                 model_class,
                 all_tenants=all_tenants,
-            ).count() - total
+            ), count) - total, 0)
         else:
             filtered = None
         current_app.logger.debug('Returning: %s', results)
@@ -13,10 +13,62 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 
-from manager_rest.storage.models import Node
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+from psycopg2.errors import LockNotAvailable
+from sqlalchemy import text
+
+from manager_rest import config
+from manager_rest.storage.models import Node, Tenant
 from manager_rest.storage import db, get_storage_manager
 from manager_rest.manager_exceptions import NotFoundError
 
+logger = logging.getLogger(__name__)
+
+# the tables whose old rows are removed by purge_old_events_and_logs
+RETENTION_TABLES = ['events', 'logs']
+# how many rows to delete in a single transaction, and how long to wait
+# between those, so that the purge doesn't starve the ingestion
+PURGE_CHUNK_SIZE = 1000
+PURGE_CHUNK_PAUSE = 0.1
+# How long to wait for the lock on the parent table when detaching an old
+# partition. A plain DETACH PARTITION (the only one allowed when the table
+# has a default partition, as events and logs do) takes an ACCESS EXCLUSIVE
+# lock, and while it waits for it, every insert into the table queues up
+# behind it. So only wait very briefly: when the table is busy, the
+# partition is left for one of the next runs, and its rows are deleted in
+# chunks, like the other old rows, meanwhile.
+PARTITION_DETACH_LOCK_TIMEOUT = '200ms'
+# a concurrent detach doesn't block the inserts, so it can wait longer
+PARTITION_DETACH_CONCURRENTLY_LOCK_TIMEOUT = '5s'
+
+PARTITIONS_QUERY = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), i.inhdetachpending
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:table_name AS regclass)
+"""
+HAS_DEFAULT_PARTITION_QUERY = """
+    SELECT partdefid <> 0 FROM pg_partitioned_table
+    WHERE partrelid = CAST(:table_name AS regclass)
+"""
+PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+PURGE_CHUNK_QUERY = """
+    DELETE FROM {table_name}
+    WHERE (_storage_id, reported_timestamp) IN (
+        SELECT _storage_id, reported_timestamp
+        FROM {table_name}
+        WHERE _tenant_id = :tenant_id
+            AND reported_timestamp < :cutoff
+            AND (reported_timestamp, _storage_id) > (:last_timestamp, :last_id)
+        ORDER BY reported_timestamp, _storage_id
+        LIMIT :chunk_size
+    )
+    RETURNING reported_timestamp, _storage_id
+"""
+
 
 def get_node(deployment_id, node_id):
     """Return the single node associated with a given ID and Dep ID
@@ -44,3 +96,141 @@ def unlock_table(lock_number):
     # make sure a flask app exists before calling this function
     db.session.execute('SELECT pg_advisory_unlock(:lock_number)',
                        {'lock_number': lock_number})
+
+
+def create_events_logs_partitions(months_ahead=3):
+    """Create the monthly partitions of events and logs, in advance.
+
+    Partitions that already exist are skipped, so this is safe to run
+    repeatedly, and from several managers at once.
+    """
+    # make sure a flask app exists before calling this function
+    db.session.execute('SELECT create_events_logs_partitions(:months_ahead)',
+                       {'months_ahead': months_ahead})
+    db.session.commit()
+
+
+def get_events_retention():
+    """Retention period, in days, of events & logs, for each tenant.
+
+    Returns a dict of tenant _storage_id to the number of days, or None
+    for the tenants whose events are to be kept forever.
+    """
+    default_days = config.instance.events_retention_days
+    tenant_days = config.instance.events_retention_tenants or {}
+    return {
+        tenant_id: tenant_days.get(tenant_name, default_days)
+        for tenant_id, tenant_name
+        in db.session.query(Tenant._storage_id, Tenant.name)
+    }
+
+
+def purge_old_events_and_logs(now=None):
+    """Remove events & logs older than their tenant's retention period.
+
+    Whole partitions are dropped when all of their rows are past the
+    retention period of every tenant. The remaining old rows are deleted
+    per tenant, in small chunks ordered by (reported_timestamp, id),
+    committing after each chunk, so that the locks are short-lived.
+    """
+    # make sure a flask app exists before calling this function
+    now = now or datetime.utcnow()
+    retention = get_events_retention()
+    db.session.rollback()
+    if not any(retention.values()):
+        return
+    for table_name in RETENTION_TABLES:
+        if all(retention.values()):
+            longest_retention = max(retention.values())
+            _drop_old_partitions(
+                table_name, now - timedelta(days=longest_retention))
+        for tenant_id, days in retention.items():
+            if days:
+                _purge_tenant_rows(
+                    table_name, tenant_id, now - timedelta(days=days))
+
+
+def _drop_old_partitions(table_name, cutoff):
+    """Drop the partitions of table_name whose rows are all before cutoff.
+
+    The partitions are detached first, and only dropped once they're no
+    longer part of the table. Detaching CONCURRENTLY doesn't block the
+    queries on the table, but postgres doesn't allow it when the table
+    has a default partition; then, the partition is detached with a very
+    short lock timeout instead, see PARTITION_DETACH_LOCK_TIMEOUT.
+    """
+    params = {'table_name': table_name}
+    partitions = db.session.execute(PARTITIONS_QUERY, params).fetchall()
+    concurrently = not db.session.execute(
+        HAS_DEFAULT_PARTITION_QUERY, params).scalar()
+    db.session.rollback()
+    for partition_name, bound, detach_pending in partitions:
+        match = PARTITION_UPPER_BOUND.search(bound or '')
+        if not match:
+            continue
+        upper_bound = datetime.fromisoformat(match.group(1))
+        if upper_bound > cutoff:
+            continue
+        logger.info('Dropping partition %s of %s: older than %s',
+                    partition_name, table_name, cutoff)
+        try:
+            _detach_partition(
+                table_name, partition_name, concurrently, detach_pending)
+            db.session.commit()
+            db.session.execute(f'DROP TABLE IF EXISTS "{partition_name}"')
+            db.session.commit()
+        except Exception as e:
+            if isinstance(getattr(e, 'orig', None), LockNotAvailable):
+                logger.info('Not dropping partition %s: %s is busy, '
+                            'will retry on the next run',
+                            partition_name, table_name)
+            else:
+                logger.warning('Could not drop partition %s: %s',
+                               partition_name, e)
+            db.session.rollback()
+
+
+def _detach_partition(table_name, partition_name, concurrently,
+                      detach_pending=False):
+    detach = f'ALTER TABLE "{table_name}" DETACH PARTITION "{partition_name}"'
+    if detach_pending:
+        # a concurrent detach was interrupted on a previous run
+        db.session.execute(f'{detach} FINALIZE')
+    elif concurrently:
+        # this can't run in a transaction block
+        with db.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(
+                "SET lock_timeout = "
+                f"'{PARTITION_DETACH_CONCURRENTLY_LOCK_TIMEOUT}'"))
+            try:
+                conn.execute(text(f'{detach} CONCURRENTLY'))
+            finally:
+                conn.execute(text('RESET lock_timeout'))
+    else:
+        db.session.execute(
+            f"SET LOCAL lock_timeout = '{PARTITION_DETACH_LOCK_TIMEOUT}'")
+        db.session.execute(detach)
+
+
+def _purge_tenant_rows(table_name, tenant_id, cutoff):
+    query = PURGE_CHUNK_QUERY.format(table_name=table_name)
+    last_timestamp, last_id = datetime.min, 0
+    total = 0
+    while True:
+        deleted = db.session.execute(query, {
+            'tenant_id': tenant_id,
+            'cutoff': cutoff,
+            'last_timestamp': last_timestamp,
+            'last_id': last_id,
+            'chunk_size': PURGE_CHUNK_SIZE,
+        }).fetchall()
+        db.session.commit()
+        total += len(deleted)
+        if len(deleted) < PURGE_CHUNK_SIZE:
+            break
+        last_timestamp, last_id = max(deleted)
+        time.sleep(PURGE_CHUNK_PAUSE)
+    if total:
+        logger.info('Removed %d rows from %s of tenant %s, older than %s',
+                    total, table_name, tenant_id, cutoff)
@@ -13,6 +13,14 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 
+from unittest.mock import patch
+
+import sqlalchemy
+
+from prometheus_client import REGISTRY
+
+from manager_rest import config, profiling
+from manager_rest.storage import db
 from manager_rest.test import base_test
 
 
@@ -27,3 +35,54 @@ class AppTestCase(base_test.BaseServerTestCase):
         """
         resp = self.app.get('/')
         self.assertEqual(404, resp.status_code)
+
+    def test_no_server_timing_by_default(self):
+        resp = self.get('/blueprints')
+        self.assertEqual(200, resp.status_code)
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_request_profiling(self):
+        with patch.object(config.instance, 'request_profiling', True):
+            resp = self.get('/blueprints')
+        self.assertEqual(200, resp.status_code)
+        metrics = {
+            metric.split(';')[0]: metric
+            for metric in resp.headers['Server-Timing'].split(', ')
+        }
+        self.assertIn('statements', metrics['sql'])
+        self.assertNotIn('"0 statements"', metrics['sql'])
+        for phase_name in ['before_request', 'auth', 'marshal', 'total']:
+            self.assertIn(phase_name, metrics)
+
+    def test_profiling_failed_statement(self):
+        profile = profiling.RequestProfile()
+        with patch.object(profiling, 'current_profile',
+                          return_value=profile):
+            with self.assertRaises(sqlalchemy.exc.ProgrammingError):
+                db.session.execute('SELECT * FROM no_such_table')
+            db.session.rollback()
+            db.session.execute('SELECT 1')
+        self.assertEqual(profile.sql_statements, 2)
+
+    def test_request_metrics(self):
+        labels = {'method': 'GET', 'endpoint': 'version'}
+
+        def _sample(name, **extra_labels):
+            return REGISTRY.get_sample_value(
+                name, dict(labels, **extra_labels)) or 0
+
+        requests_before = _sample('restservice_requests_total', status='200')
+        latencies_before = _sample('restservice_request_latency_seconds_count')
+        in_progress_before = REGISTRY.get_sample_value(
+            'restservice_requests_in_progress')
+        resp = self.app.get('/api/version')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(
+            _sample('restservice_requests_total', status='200'),
+            requests_before + 1)
+        self.assertEqual(
+            _sample('restservice_request_latency_seconds_count'),
+            latencies_before + 1)
+        self.assertEqual(
+            REGISTRY.get_sample_value('restservice_requests_in_progress'),
+            in_progress_before)
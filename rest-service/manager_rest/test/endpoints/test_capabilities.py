@@ -243,6 +243,23 @@ class CapabilitiesTestCase(base_test.BaseServerTestCase):
         capabilities = self.client.deployments.capabilities.get('deployment')
         self.assertEqual(capabilities['capabilities'], {})
 
+    def test_search_capabilities_without_count(self):
+        """The capabilities search always counts the total exactly"""
+        deployment_id = 'deployment'
+        self._deploy(deployment_id, 'blueprint_with_capabilities.yaml')
+        for count in ['none', 'estimated']:
+            response = self.post(
+                '/searches/capabilities',
+                {},
+                query_params={'deployment_id': deployment_id,
+                              '_count': count},
+            )
+            self.assertEqual(response.status_code, 200)
+            pagination = response.json['metadata']['pagination']
+            self.assertEqual(pagination['total'], 1)
+            self.assertNotIn('count', pagination)
+            self.assertEqual(response.json['metadata']['filtered'], 0)
+
 
 class TestGetGroupCapability(base_test.BaseServerTestCase):
     def test_get_capability(self):
@@ -476,6 +476,39 @@ class SelectEventsFilterTest(SelectEventsBaseTest):
         """Filter events by message.text."""
         self.filter_by_message_helper('message.text')
 
+    def _select_message_contains(self, text):
+        filters = {
+            'message_contains': [text],
+            'type': ['cloudify_event', 'cloudify_log']
+        }
+        query, event_count = EventsV1._build_select_query(
+            filters,
+            self.DEFAULT_SORT,
+            self.DEFAULT_RANGE_FILTERS,
+            self.tenant.id
+        )
+        events = query.params(**self.DEFAULT_PAGINATION).all()
+        return [event._storage_id for event in events], event_count
+
+    def test_filter_by_message_contains(self):
+        """Search event messages for a case-insensitive substring."""
+        text = self.events[0].message[4:12]
+        event_ids, event_count = self._select_message_contains(text.upper())
+
+        expected_event_ids = [
+            event._storage_id
+            for event in self.events
+            if text in event.message
+        ]
+        self.assertListEqual(event_ids, expected_event_ids)
+        self.assertEqual(event_count, len(expected_event_ids))
+
+    def test_filter_by_message_contains_wildcards(self):
+        """LIKE wildcards are searched for literally."""
+        event_ids, event_count = self._select_message_contains('%')
+        self.assertListEqual(event_ids, [])
+        self.assertEqual(event_count, 0)
+
     def test_filter_by_unknown(self):
         """Filter events by an unknown field."""
         filters = {
@@ -644,6 +677,127 @@ class SelectEventsSortTest(SelectEventsBaseTest):
         self._sort_by_timestamp('@timestamp', 'desc')
 
 
+class SelectEventsCursorTest(SelectEventsBaseTest):
+
+    """Paginate events using a cursor."""
+
+    FILTERS = {
+        'type': ['cloudify_event', 'cloudify_log']
+    }
+    PAGE_SIZE = 7
+
+    def _select(self, sort, cursor, size):
+        query, event_count = EventsV1._build_select_query(
+            self.FILTERS,
+            sort,
+            {},
+            self.tenant.id,
+            cursor=cursor,
+        )
+        return query.params(limit=size).all(), event_count
+
+    def _paginate(self, direction):
+        """Fetch all events page by page, and compare with a single page."""
+        sort = {'@timestamp': direction}
+        all_events, event_count = self._select(sort, '', len(self.events))
+        self.assertEqual(event_count, len(self.events))
+        self.assertEqual(len(all_events), len(self.events))
+
+        paginated = []
+        cursor = ''
+        while True:
+            page, page_event_count = self._select(
+                sort, cursor, self.PAGE_SIZE)
+            # the total is still all the events, not only the ones left
+            self.assertEqual(page_event_count, event_count)
+            paginated.extend(page)
+            if len(page) < self.PAGE_SIZE:
+                break
+            cursor = EventsV1._encode_cursor(page[-1])
+
+        self.assertListEqual(
+            [event.message for event in paginated],
+            [event.message for event in all_events],
+        )
+        reported_timestamps = [
+            event.reported_timestamp for event in all_events]
+        self.assertListEqual(
+            reported_timestamps,
+            sorted(reported_timestamps, reverse=direction == 'desc'),
+        )
+
+    def test_cursor_ascending(self):
+        self._paginate('asc')
+
+    def test_cursor_descending(self):
+        self._paginate('desc')
+
+    def test_cursor_invalid(self):
+        with self.assertRaises(BadParametersError):
+            self._select({}, 'invalid', self.PAGE_SIZE)
+
+    def test_cursor_sort_unsupported(self):
+        with self.assertRaises(BadParametersError):
+            self._select({'message': 'asc'}, '', self.PAGE_SIZE)
+
+    def test_cursor_estimated_count(self):
+        response = self.get('/events', query_params={
+            '_cursor': '', '_size': self.PAGE_SIZE})
+        self.assertEqual(response.status_code, 200)
+        pagination = response.json['metadata']['pagination']
+        self.assertEqual(pagination['count'], 'estimated')
+        self.assertIsNotNone(pagination['next_cursor'])
+
+        response = self.get('/events', query_params={
+            '_cursor': '', '_size': self.PAGE_SIZE, '_count': 'exact'})
+        pagination = response.json['metadata']['pagination']
+        self.assertNotIn('count', pagination)
+        self.assertEqual(pagination['total'], len(self.events))
+
+
+class SelectEventsProjectionTest(SelectEventsBaseTest):
+
+    """Select only the included columns."""
+
+    def _select(self, include, sort=None):
+        query, event_count = EventsV1._build_select_query(
+            {'type': ['cloudify_event', 'cloudify_log']},
+            sort or {'timestamp': 'asc'},
+            {},
+            self.tenant.id,
+            include=include,
+        )
+        columns = [
+            column['name'] for column in query.column_descriptions]
+        return query.params(limit=100, offset=0).all(), columns
+
+    def test_projection(self):
+        events, columns = self._select(['message'])
+        self.assertListEqual(
+            columns,
+            ['_storage_id', 'timestamp', 'reported_timestamp', 'message',
+             'type'],
+        )
+        self.assertListEqual(
+            [event.message for event in events],
+            [event.message for event in self.events],
+        )
+        self.assertListEqual(
+            [EventsV3._map_event_to_dict(['message'], event)
+             for event in events],
+            [{'message': event.message} for event in self.events],
+        )
+
+    def test_projection_sort_column(self):
+        _, columns = self._select(['message'], sort={'operation': 'asc'})
+        self.assertIn('operation', columns)
+
+    def test_no_projection(self):
+        _, columns = self._select(None)
+        self.assertIn('error_causes', columns)
+        self.assertIn('deployment_id', columns)
+
+
 class SelectEventsRangeFilterTest(SelectEventsBaseTest):
 
     """Filter out events not included in a range."""
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from itertools import dropwhile
 from unittest import mock
 
+from cachetools import LRUCache
 from flask import Flask
 
 from cloudify_rest_client import exceptions
@@ -13,7 +14,7 @@ from cloudify.workflows import tasks as cloudify_tasks
 from cloudify.constants import CLOUDIFY_EXECUTION_TOKEN_HEADER
 
 from manager_rest.storage import models, db
-from manager_rest import manager_exceptions
+from manager_rest import execution_token, manager_exceptions, server
 from manager_rest.test.base_test import BaseServerTestCase
 
 
@@ -1067,6 +1068,65 @@ class ExecutionsTestCase(BaseServerTestCase):
         executions = client.executions.list()
         assert len(executions) == 3   # bp upload + create dep.env + install
 
+    def test_execution_token_cancelled(self):
+        token = uuid.uuid4().hex
+        execution_id = self._create_execution_and_update_token(
+            'deployment_1', token)
+        execution = self.sm.get(models.Execution, execution_id)
+        tasks_graph = self.sm.put(models.TasksGraph(
+            _execution_fk=execution._storage_id,
+            name='install',
+            created_at=datetime.utcnow()
+        ))
+        self.sm.put(models.Operation(
+            _tasks_graph_fk=tasks_graph._storage_id,
+            state=cloudify_tasks.TASK_STARTED,
+            created_at=datetime.utcnow()
+        ))
+
+        # a cancelled execution can still use its token, while it has
+        # operations that aren't finished
+        self._modify_execution_status_in_database(
+            execution, ExecutionState.CANCELLED)
+        self._assert_valid_execution_token(token)
+        self._assert_valid_execution_token(token)
+
+        self._modify_execution_status_in_database(
+            execution, ExecutionState.FAILED)
+        self._assert_invalid_execution_token(token)
+
+    def test_execution_token_cached(self):
+        token = uuid.uuid4().hex
+        execution_id = self._create_execution_and_update_token(
+            'deployment_1', token)
+        listener = mock.Mock()
+        listener.versions.return_value = (1, 1, 1, 1)
+        with mock.patch.dict(server.app.extensions,
+                             {'change_listener': listener}), \
+                mock.patch.object(execution_token, '_executions',
+                                  LRUCache(10)), \
+                mock.patch.object(execution_token, '_executions_versions',
+                                  None):
+            execution = execution_token.get_current_execution_by_token(token)
+            self.assertEqual(execution.id, execution_id)
+            self.assertIn(execution, db.session)
+            self._assert_valid_execution_token(token)
+
+            with mock.patch.object(
+                    execution_token, '_get_execution_by_token_hash',
+                    wraps=execution_token._get_execution_by_token_hash,
+            ) as get_execution:
+                execution = \
+                    execution_token.get_current_execution_by_token(token)
+                self.assertEqual(execution.id, execution_id)
+                self.assertEqual(execution.creator.id, self.user.id)
+                get_execution.assert_not_called()
+
+                # eg. the status of an execution changed
+                listener.versions.return_value = (1, 2, 1, 1)
+                execution_token.get_current_execution_by_token(token)
+                get_execution.assert_called_once()
+
     def test_duplicate_execution_token(self):
         token = uuid.uuid4().hex
         self._create_execution_and_update_token('deployment_1', token)
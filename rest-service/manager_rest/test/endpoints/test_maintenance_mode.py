@@ -14,15 +14,19 @@
 #  * limitations under the License.
 
 import uuid
-from unittest.mock import patch
+from datetime import datetime
+from unittest.mock import Mock, patch
 
 from cloudify_rest_client import exceptions
 from cloudify.models_states import BlueprintUploadState, ExecutionState
 
-from manager_rest.storage import models
+from manager_rest import server
+from manager_rest.storage import db, models
 from manager_rest.test.base_test import BaseServerTestCase
 from manager_rest.maintenance import (
+    get_cached_maintenance_state,
     get_maintenance_state,
+    has_running_executions,
     remove_maintenance_state,
 )
 from manager_rest.constants import (
@@ -100,6 +104,37 @@ class MaintenanceModeTest(BaseServerTestCase):
             self._activate_maintenance_mode()
         self.assertEqual(304, cm.exception.status_code)
 
+    def test_has_running_executions(self):
+        self.assertFalse(has_running_executions())
+        execution = self._start_maintenance_transition_mode()
+        self.assertTrue(has_running_executions())
+        self._terminate_execution(execution.id)
+        self.assertFalse(has_running_executions())
+
+    def test_cached_state(self):
+        listener = Mock()
+        listener.versions.return_value = (1, 1)
+        with patch.dict(server.app.extensions,
+                        {'change_listener': listener}):
+            self.assertIsNone(get_cached_maintenance_state())
+            db.session.add(models.MaintenanceMode(
+                status=MAINTENANCE_MODE_ACTIVATED,
+                activation_requested_at=datetime.utcnow(),
+                requested_by=self.user,
+            ))
+            db.session.commit()
+            # not notified about the change yet
+            self.assertIsNone(get_cached_maintenance_state())
+
+            listener.versions.return_value = (1, 2)
+            state = get_cached_maintenance_state()
+            self.assertEqual(state['status'], MAINTENANCE_MODE_ACTIVATED)
+
+            # no longer connected, so the db is always checked
+            listener.versions.return_value = None
+            remove_maintenance_state()
+            self.assertIsNone(get_cached_maintenance_state())
+
     def test_transition_to_active(self):
         execution = self._start_maintenance_transition_mode()
         response = self.client.maintenance_mode.status()
@@ -23,9 +23,11 @@ from flask import Flask
 from pydantic import ValidationError
 
 from manager_rest.rest.rest_decorators import (
+    escape_like,
     paginate,
     rangeable,
     sortable,
+    streamable,
 )
 
 
@@ -75,6 +77,32 @@ class PaginateTest(TestCase):
             with self.assertRaises(ValidationError):
                 paginate(verify)()
 
+    def test_count(self):
+        """The count mode is passed, and only known modes are accepted."""
+        def verify(pagination):
+            self.assertEqual(pagination['count'], 'estimated')
+            return Mock()
+
+        with self.app.test_request_context('/?_count=estimated'):
+            paginate(verify)()
+        with self.app.test_request_context('/?_count=approximately'):
+            with self.assertRaises(ValidationError):
+                paginate(verify)()
+
+    def test_stream(self):
+        """Streaming is only requested from endpoints that allow it."""
+        def verify(pagination):
+            self.assertNotIn('stream', pagination)
+            return Mock()
+
+        def verify_streamable(pagination):
+            self.assertTrue(pagination['stream'])
+            return Mock()
+
+        with self.app.test_request_context('/?_stream=true'):
+            paginate(verify)()
+            paginate(streamable(verify_streamable))()
+
 
 class RangeableTest(TestCase):
     """Rangeable decorator test cases."""
@@ -250,3 +278,9 @@ class SortableTest(TestCase):
         with self.app.test_request_context('/?_sort=%20abcd'):
             with self.assertRaises(ValidationError):
                 sortable()(Mock)()
+
+
+class EscapeLikeTest(TestCase):
+    def test_escape(self):
+        self.assertEqual(escape_like('abc'), 'abc')
+        self.assertEqual(escape_like('100%_a\\b'), '100\\%\\_a\\\\b')
@@ -0,0 +1,46 @@
+import logging
+import time
+
+from manager_rest import config
+from manager_rest.change_listener import ChangeListener
+from manager_rest.test import base_test
+from manager_rest.storage import db, models
+
+
+class TestChangeListener(base_test.BaseServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listener = ChangeListener(
+            lambda: config.instance.db_url, logging.getLogger())
+        self.listener.start()
+        self.addCleanup(self.listener.stop)
+
+    def _wait_for(self, predicate, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            result = predicate()
+            if result:
+                return result
+            time.sleep(0.1)
+        self.fail('Timed out waiting for the change listener')
+
+    def test_versions_change(self):
+        versions = self._wait_for(
+            lambda: self.listener.versions('config', 'roles'))
+        generation, config_version, roles_version = versions
+
+        conf = models.Config.query.first()
+        conf.admin_only = not conf.admin_only
+        db.session.commit()
+
+        new_versions = self._wait_for(
+            lambda: self.listener.versions('config', 'roles') != versions
+            and self.listener.versions('config', 'roles'))
+        self.assertEqual(
+            new_versions, (generation, config_version + 1, roles_version))
+
+    def test_versions_unknown_when_stopped(self):
+        self._wait_for(lambda: self.listener.versions('config'))
+        self.listener.stop()
+        self._wait_for(lambda: self.listener.versions('config') is None,
+                       timeout=15)
@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+from manager_rest import server
+from manager_rest.storage import db
+from manager_rest.test import base_test
+
+
+class TestCopeWithDbFailover(base_test.BaseServerTestCase):
+    def _count_statements(self):
+        statements = []
+        engine = db.get_engine()
+
+        def _before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        self.addCleanup(
+            event.remove, engine, 'before_cursor_execute', _before_execute)
+        return statements
+
+    def test_checked_once_per_connection(self):
+        db.session.connection().info.pop(server.PRIMARY_CHECKED, None)
+        statements = self._count_statements()
+        server.cope_with_db_failover()
+        self.assertEqual(statements, ['SELECT pg_is_in_recovery()'])
+        self.assertTrue(db.session.connection().info[server.PRIMARY_CHECKED])
+
+        server.cope_with_db_failover()
+        self.assertEqual(len(statements), 1)
+
+    def test_checked_again_after_reconnect(self):
+        server.cope_with_db_failover()
+        db.session.connection().invalidate()
+        db.session.rollback()
+        statements = self._count_statements()
+        server.cope_with_db_failover()
+        self.assertEqual(statements, ['SELECT pg_is_in_recovery()'])
@@ -13,6 +13,8 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 #
+import json
+
 from manager_rest.test.infrastructure.base_list_test import BaseListTest
 
 
@@ -76,3 +78,40 @@ class ResourceListTestCase(BaseListTest):
     def test_snapshots_list_paginated(self):
         self._put_n_snapshots(3)
         self._test_pagination(self.client.snapshots.list, 3)
+
+    def test_list_without_total(self):
+        self._put_n_deployments(id_prefix='test', number_of_deployments=2)
+        response = self.client.blueprints.list(_count='none')
+        self.assertIsNone(response.metadata.pagination.total)
+        self.assertEqual(len(response.items), 2)
+
+    def test_list_estimated_total(self):
+        self._put_n_deployments(id_prefix='test', number_of_deployments=2)
+        response = self.client.blueprints.list(_count='estimated')
+        self.assertIsInstance(response.metadata.pagination.total, int)
+        self.assertEqual(response.metadata.pagination['count'], 'estimated')
+        self.assertEqual(len(response.items), 2)
+
+    def test_list_streamed(self):
+        self._put_n_deployments(id_prefix='test', number_of_deployments=3)
+        response = self.get('/deployments', query_params={
+            '_stream': 'true',
+            '_size': 2,
+            '_include': 'id',
+            '_sort': 'id',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        pagination = lines[0]['metadata']['pagination']
+        self.assertEqual(pagination['total'], 3)
+        self.assertTrue(pagination['stream'])
+        self.assertEqual(lines[1:], [
+            {'id': 'test0_deployment'},
+            {'id': 'test1_deployment'},
+        ])
+
+    def test_list_stream_unsupported(self):
+        self._put_n_deployments(id_prefix='test', number_of_deployments=2)
+        response = self.client.blueprints.list(_stream=True)
+        self.assertEqual(len(response.items), 2)
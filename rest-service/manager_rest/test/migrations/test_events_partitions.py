@@ -0,0 +1,232 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from manager_rest import config
+from manager_rest.test import base_test
+from manager_rest.storage import db, models, storage_utils
+from manager_rest.storage.storage_utils import (
+    create_events_logs_partitions,
+    purge_old_events_and_logs,
+)
+
+
+class TestEventsPartitions(base_test.BaseServerTestCase):
+    def _partitions(self, table_name):
+        return {
+            name for name, in db.session.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE parent.relname = :table_name',
+                {'table_name': table_name},
+            )
+        }
+
+    def test_tables_partitioned(self):
+        for table_name in ['events', 'logs']:
+            kind = db.session.execute(
+                'SELECT relkind FROM pg_class WHERE relname = :table_name',
+                {'table_name': table_name},
+            ).scalar()
+            self.assertEqual(kind, 'p')
+            self.assertIn(f'{table_name}_legacy',
+                          self._partitions(table_name))
+            self.assertIn(f'{table_name}_default',
+                          self._partitions(table_name))
+
+    def test_create_partitions(self):
+        now = datetime.utcnow()
+        year, month = divmod(now.year * 12 + now.month - 1 + 12, 12)
+        partition_name = f'{year}_{month + 1:02d}'
+
+        # can run repeatedly
+        create_events_logs_partitions(12)
+        create_events_logs_partitions(12)
+
+        for table_name in ['events', 'logs']:
+            self.assertIn(f'{table_name}_{partition_name}',
+                          self._partitions(table_name))
+
+
+class TestEventsDefaultPartition(base_test.BaseServerTestCase):
+    """Rows outside of the monthly partitions go to the default one.
+
+    The changes are never committed, so that the partitions created or
+    detached here don't affect the other tests.
+    """
+    def setUp(self):
+        super().setUp()
+        self.execution = self._add_execution(
+            self._add_deployment(self._add_blueprint()))
+        self.addCleanup(db.session.rollback)
+
+    def _store(self, model, reported_timestamp):
+        item = model(
+            message='test',
+            execution=self.execution,
+            reported_timestamp=reported_timestamp,
+        )
+        db.session.add(item)
+        db.session.flush()
+        return item
+
+    def _partition_of(self, item):
+        return db.session.execute(
+            f'SELECT tableoid::regclass::text FROM {item.__tablename__} '
+            'WHERE _storage_id = :storage_id',
+            {'storage_id': item._storage_id},
+        ).scalar()
+
+    def test_future_rows(self):
+        reported_timestamp = datetime.utcnow() + timedelta(days=2 * 366)
+        for model in [models.Event, models.Log]:
+            item = self._store(model, reported_timestamp)
+            self.assertEqual(self._partition_of(item),
+                             f'{item.__tablename__}_default')
+
+            # creating the partition of that month moves the row to it
+            db.session.execute('SELECT create_events_logs_partitions(30)')
+            self.assertEqual(
+                self._partition_of(item),
+                f'{item.__tablename__}_'
+                f'{reported_timestamp.strftime("%Y_%m")}')
+
+    def test_old_rows(self):
+        for model in [models.Event, models.Log]:
+            table_name = model.__tablename__
+            # as if the legacy partition was dropped by the retention
+            db.session.execute(
+                f'ALTER TABLE {table_name} '
+                f'DETACH PARTITION {table_name}_legacy')
+            item = self._store(model, datetime(2000, 1, 1))
+            self.assertEqual(self._partition_of(item),
+                             f'{table_name}_default')
+
+
+class TestEventsRetention(base_test.BaseServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.execution = self._add_execution(
+            self._add_deployment(self._add_blueprint()))
+        self.now = datetime.utcnow()
+        for days_ago in [1, 5, 20, 20, 20, 20, 30]:
+            for model in [models.Event, models.Log]:
+                self.sm.put(model(
+                    message=f'{days_ago} days ago',
+                    execution=self.execution,
+                    reported_timestamp=self.now - timedelta(days=days_ago),
+                ))
+        self.addCleanup(self._reset_retention)
+
+    def _reset_retention(self):
+        config.instance.events_retention_days = None
+        config.instance.events_retention_tenants = {}
+
+    def _remaining(self, model):
+        return sorted(
+            int(item.message.split()[0])
+            for item in model.query.all()
+        )
+
+    def test_keep_forever(self):
+        purge_old_events_and_logs(now=self.now)
+        for model in [models.Event, models.Log]:
+            self.assertEqual(len(self._remaining(model)), 7)
+
+    def test_purge_in_chunks(self):
+        config.instance.events_retention_days = 10
+        with mock.patch.object(storage_utils, 'PURGE_CHUNK_SIZE', 2), \
+                mock.patch.object(storage_utils, 'PURGE_CHUNK_PAUSE', 0):
+            purge_old_events_and_logs(now=self.now)
+        for model in [models.Event, models.Log]:
+            self.assertEqual(self._remaining(model), [1, 5])
+
+    def test_tenant_override(self):
+        config.instance.events_retention_days = 10
+        config.instance.events_retention_tenants = {self.tenant.name: None}
+        purge_old_events_and_logs(now=self.now)
+        self.assertEqual(len(self._remaining(models.Event)), 7)
+
+        config.instance.events_retention_tenants = {self.tenant.name: 3}
+        purge_old_events_and_logs(now=self.now)
+        self.assertEqual(self._remaining(models.Event), [1])
+
+    def test_drop_old_partitions(self):
+        db.session.execute("""
+            CREATE TABLE retention_test (reported_timestamp timestamp)
+                PARTITION BY RANGE (reported_timestamp);
+            CREATE TABLE retention_test_old PARTITION OF retention_test
+                FOR VALUES FROM ('2000-01-01') TO ('2000-02-01');
+            CREATE TABLE retention_test_new PARTITION OF retention_test
+                FOR VALUES FROM ('2000-02-01') TO ('2000-03-01');
+        """)
+        db.session.commit()
+        self.addCleanup(self._drop_test_table)
+
+        storage_utils._drop_old_partitions(
+            'retention_test', datetime(2000, 2, 15))
+        self.assertEqual(self._test_partitions(), {'retention_test_new'})
+        self.assertIsNone(db.session.execute(
+            "SELECT to_regclass('retention_test_old')").scalar())
+
+    def test_drop_old_partitions_with_default(self):
+        # can't be detached concurrently
+        db.session.execute("""
+            CREATE TABLE retention_test (reported_timestamp timestamp)
+                PARTITION BY RANGE (reported_timestamp);
+            CREATE TABLE retention_test_old PARTITION OF retention_test
+                FOR VALUES FROM ('2000-01-01') TO ('2000-02-01');
+            CREATE TABLE retention_test_default PARTITION OF retention_test
+                DEFAULT;
+        """)
+        db.session.commit()
+        self.addCleanup(self._drop_test_table)
+
+        storage_utils._drop_old_partitions(
+            'retention_test', datetime(2000, 2, 15))
+        self.assertEqual(self._test_partitions(),
+                         {'retention_test_default'})
+        self.assertIsNone(db.session.execute(
+            "SELECT to_regclass('retention_test_old')").scalar())
+
+    def test_drop_old_partitions_busy(self):
+        db.session.execute("""
+            CREATE TABLE retention_test (reported_timestamp timestamp)
+                PARTITION BY RANGE (reported_timestamp);
+            CREATE TABLE retention_test_old PARTITION OF retention_test
+                FOR VALUES FROM ('2000-01-01') TO ('2000-02-01');
+            CREATE TABLE retention_test_default PARTITION OF retention_test
+                DEFAULT;
+        """)
+        db.session.commit()
+        self.addCleanup(self._drop_test_table)
+
+        # as if rows were being inserted in another transaction
+        with db.engine.connect() as conn, conn.begin():
+            conn.execute(
+                'LOCK TABLE retention_test IN ROW EXCLUSIVE MODE')
+            storage_utils._drop_old_partitions(
+                'retention_test', datetime(2000, 2, 15))
+        self.assertEqual(
+            self._test_partitions(),
+            {'retention_test_old', 'retention_test_default'})
+
+        # not busy anymore: dropped on the next run
+        storage_utils._drop_old_partitions(
+            'retention_test', datetime(2000, 2, 15))
+        self.assertEqual(self._test_partitions(),
+                         {'retention_test_default'})
+
+    def _test_partitions(self):
+        return {
+            name for name, in db.session.execute(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid '
+                "WHERE i.inhparent = 'retention_test'::regclass"
+            )
+        }
+
+    def _drop_test_table(self):
+        db.session.rollback()
+        db.session.execute('DROP TABLE IF EXISTS retention_test')
+        db.session.commit()
@@ -0,0 +1,96 @@
+from unittest.mock import Mock, patch
+
+from cachetools import LRUCache
+
+from manager_rest import config, constants, server
+from manager_rest.manager_exceptions import NotFoundError
+from manager_rest.security import authorization
+from manager_rest.storage import db, models, user_datastore
+from manager_rest.test.base_test import BaseServerTestCase
+
+
+class UserRolesCacheTest(BaseServerTestCase):
+    def _add_tenant(self, name):
+        tenant = models.Tenant(name=name)
+        self.user.tenant_associations.append(models.UserTenantAssoc(
+            user=self.user,
+            tenant=tenant,
+            role=user_datastore.find_role(constants.DEFAULT_TENANT_ROLE),
+        ))
+        user_datastore.commit()
+
+    def test_not_cached_without_listener(self):
+        system_roles, tenant_roles = authorization._get_user_roles(self.user)
+        self.assertEqual(system_roles, ['sys_admin'])
+        self.assertEqual(tenant_roles, {
+            constants.DEFAULT_TENANT_NAME: [constants.DEFAULT_TENANT_ROLE],
+        })
+        self._add_tenant('tenant1')
+        _, tenant_roles = authorization._get_user_roles(self.user)
+        self.assertIn('tenant1', tenant_roles)
+
+    def test_cached_until_changed(self):
+        listener = Mock()
+        listener.versions.return_value = (1, 1)
+        with patch.dict(server.app.extensions,
+                        {'change_listener': listener}), \
+                patch.object(authorization, '_user_roles_versions', None):
+            roles = authorization._get_user_roles(self.user)
+            self._add_tenant('tenant1')
+            # not notified about the change yet
+            self.assertIs(authorization._get_user_roles(self.user), roles)
+
+            listener.versions.return_value = (1, 2)
+            _, tenant_roles = authorization._get_user_roles(self.user)
+            self.assertIn('tenant1', tenant_roles)
+
+
+class TenantsCacheTest(BaseServerTestCase):
+    def test_cached_until_changed(self):
+        listener = Mock()
+        listener.versions.return_value = (1, 1)
+        with patch.dict(server.app.extensions,
+                        {'change_listener': listener}), \
+                patch.object(authorization, '_tenants', LRUCache(10)), \
+                patch.object(authorization, '_tenants_versions', None):
+            tenant = authorization._get_tenant(constants.DEFAULT_TENANT_NAME)
+            self.assertEqual(tenant.id, self.tenant.id)
+            self.assertIn(tenant, db.session)
+            with self.assertRaises(NotFoundError):
+                authorization._get_tenant('tenant1')
+
+            self.sm.put(models.Tenant(name='tenant1'))
+            # not cached, so found right away
+            self.assertEqual(
+                authorization._get_tenant('tenant1').name, 'tenant1')
+            with patch.object(authorization.orm, 'Session') as session:
+                authorization._get_tenant('tenant1')
+            session.assert_not_called()
+
+            listener.versions.return_value = (1, 2)
+            with patch.object(authorization.orm, 'Session',
+                              wraps=authorization.orm.Session) as session:
+                authorization._get_tenant('tenant1')
+            session.assert_called_once()
+
+
+class PermissionRolesTest(BaseServerTestCase):
+    def test_permissions_compiled(self):
+        permissions = config.instance.authorization_permissions
+        self.assertTrue(permissions)
+        self.assertEqual(
+            config.instance.authorization_permission_roles,
+            {name: frozenset(roles) for name, roles in permissions.items()},
+        )
+
+    def test_action_allowed(self):
+        with patch.object(authorization, 'current_user',
+                          Mock(is_bootstrap_admin=False)), \
+                patch.object(authorization, 'get_current_user_roles',
+                             return_value=['role1', 'role2']), \
+                patch.object(config.instance,
+                             'authorization_permission_roles',
+                             {'action1': frozenset(['role2', 'role3']),
+                              'action2': frozenset(['role3'])}):
+            self.assertTrue(authorization.is_user_action_allowed('action1'))
+            self.assertFalse(authorization.is_user_action_allowed('action2'))
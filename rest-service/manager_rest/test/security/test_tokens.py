@@ -1,11 +1,16 @@
+from collections import defaultdict
 from datetime import datetime
+from unittest import mock
 
 import pytest
+from cachetools import TTLCache
 
 from cloudify_rest_client.exceptions import UserUnauthorizedError
 
+from manager_rest import server
 from manager_rest.constants import CLOUDIFY_TENANT_HEADER
-from manager_rest.storage import user_datastore
+from manager_rest.security import user_handler
+from manager_rest.storage import db, models, user_datastore
 from manager_rest.test.token_utils import (
     create_expired_token,
     sm_create_token_for_user,
@@ -78,6 +83,43 @@ class TokenTests(SecurityTestBase):
         # Allow some time in case tests are running on a potato
         assert last_used_diff.seconds < 10
 
+    def test_deleted_token_fails_auth(self):
+        with self.use_secured_client(username='alice',
+                                     password='alice_password'):
+            token = self.client.tokens.create()
+        # use the token first, so that it's verified and cached
+        self._assert_user_authorized(token=token.value)
+        with self.use_secured_client(username='alice',
+                                     password='alice_password'):
+            self.client.tokens.delete(token.id)
+        self._assert_token_unauthorized(token=token.value)
+
+    def test_token_deleted_elsewhere_fails_auth(self):
+        """A token deleted by another worker is forgotten when notified"""
+        with self.use_secured_client(username='alice',
+                                     password='alice_password'):
+            token = self.client.tokens.create()
+        table_versions = defaultdict(int)
+        listener = mock.Mock()
+        listener.versions.side_effect = lambda *tables: (1, ) + tuple(
+            table_versions[table] for table in tables)
+        with mock.patch.dict(server.app.extensions,
+                             {'change_listener': listener}), \
+                mock.patch.object(user_handler, '_verified_tokens',
+                                  TTLCache(maxsize=10, ttl=60)), \
+                mock.patch.object(user_handler, '_verified_tokens_versions',
+                                  None):
+            self._assert_user_authorized(token=token.value)
+            self.assertEqual(len(user_handler._verified_tokens), 1)
+
+            # not using the endpoint, so that the token isn't forgotten
+            # by forget_token, but by the change notification
+            models.Token.query.filter_by(id=token.id).delete()
+            db.session.commit()
+            self.assertEqual(len(user_handler._verified_tokens), 1)
+            table_versions['tokens'] += 1
+            self._assert_token_unauthorized(token=token.value)
+
     def test_mangled_token_id(self):
         with self.use_secured_client(username='alice',
                                      password='alice_password'):
@@ -137,8 +137,8 @@ def all_tenants_authorization(user=None):
         user = current_user
     return (
         user.id == constants.BOOTSTRAP_ADMIN_ID or
-        any(r in user.system_roles
-            for r in config.instance.authorization_permissions['all_tenants'])
+        not config.instance.authorization_permission_roles['all_tenants']
+        .isdisjoint(user.system_roles)
     )
 
 
@@ -152,10 +152,10 @@ def tenant_specific_authorization(tenant, resource_name, action='list'):
     try:
         permission_name = '{0}_{1}'.format(resource_name, action)
         permission_roles = \
-            config.instance.authorization_permissions[permission_name]
+            config.instance.authorization_permission_roles[permission_name]
     except KeyError:
-        permission_roles = \
-            config.instance.authorization_permissions[resource_name.lower()]
+        permission_roles = config.instance.authorization_permission_roles[
+            resource_name.lower()]
     return current_user.has_role_in(tenant, permission_roles)
 
 
@@ -168,14 +168,14 @@ def is_administrator(tenant, user=None):
         user.is_bootstrap_admin or
         user.has_role_in(
             tenant,
-            config.instance.authorization_permissions['administrators'],
+            config.instance.authorization_permission_roles['administrators'],
         )
     )
 
 
 def is_create_global_permitted(tenant):
-    create_global_roles = \
-        config.instance.authorization_permissions['create_global_resource']
+    create_global_roles = config.instance.authorization_permission_roles[
+        'create_global_resource']
     return (
         current_user.id == constants.BOOTSTRAP_ADMIN_ID or
         current_user.has_role_in(tenant, create_global_roles)
@@ -183,8 +183,8 @@ def is_create_global_permitted(tenant):
 
 
 def can_execute_global_workflow(tenant):
-    execute_global_roles = \
-        config.instance.authorization_permissions['execute_global_workflow']
+    execute_global_roles = config.instance.authorization_permission_roles[
+        'execute_global_workflow']
     return (
         current_user.id == constants.BOOTSTRAP_ADMIN_ID or
         current_user.has_role_in(tenant, execute_global_roles)
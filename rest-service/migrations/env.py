@@ -3,6 +3,7 @@ from __future__ import with_statement
 import contextlib
 import logging
 import os
+import re
 
 from flask import current_app
 from alembic import context
@@ -19,6 +20,17 @@ config = context.config
 # This line sets up loggers basically.
 logger = logging.getLogger('alembic.env')
 
+# partitions of the partitioned tables aren't declared in the models: they
+# are created as needed (see the 7.0 to 7.1 migration)
+PARTITION_NAME = re.compile(r'^(events|logs)_(legacy|default|\d{4}_\d{2})$')
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Skip the partitions when autogenerating migrations"""
+    if type_ == 'table' and reflected and compare_to is None:
+        return not PARTITION_NAME.match(name)
+    return True
+
 
 @contextlib.contextmanager
 def default_config_path():
@@ -87,6 +99,7 @@ def run_migrations_online():
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      include_object=include_object,
                       **current_app.extensions['migrate'].configure_args)
 
     try:
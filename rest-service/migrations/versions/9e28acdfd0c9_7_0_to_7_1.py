@@ -0,0 +1,504 @@
+"""Cloudify 7.0 to 7.1 DB migration
+
+Revision ID: 9e28acdfd0c9
+Revises: edd6d829a209
+Create Date: 2023-04-03 11:02:31.513417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from manager_rest.storage.models_base import JSONString
+
+
+# revision identifiers, used by Alembic.
+revision = '9e28acdfd0c9'
+down_revision = 'edd6d829a209'
+branch_labels = None
+depends_on = None
+
+# tables that are range-partitioned by reported_timestamp
+partitioned_tables = ['events', 'logs']
+
+# how many monthly partitions to create in advance; more are created
+# periodically by the execution-scheduler, see
+# manager_rest.storage.storage_utils.create_events_logs_partitions
+PARTITIONS_AHEAD = 3
+
+config_table = sa.table(
+    'config',
+    sa.Column('name', sa.Text),
+    sa.Column('value', JSONString()),
+    sa.Column('schema', JSONString()),
+    sa.Column('is_editable', sa.Boolean),
+    sa.Column('scope', sa.Text),
+)
+retention_config_names = ['events_retention_days', 'events_retention_tenants']
+
+# tables whose changes are notified to the rest-service workers, see
+# manager_rest.change_listener
+notified_tables = [
+    'roles',
+    'config',
+    'certificates',
+    'maintenance_mode',
+    'tenants',
+    'users_roles',
+    'users_groups',
+    'users_tenants',
+    'groups_roles',
+    'groups_tenants',
+]
+
+
+def upgrade():
+    for table_name in partitioned_tables:
+        partition_table(table_name)
+    create_function_create_events_logs_partitions()
+    op.execute(f'SELECT create_events_logs_partitions({PARTITIONS_AHEAD})')
+    add_retention_config()
+    create_retention_indexes()
+    create_cursor_pagination_indexes()
+    add_events_logs_notify()
+    create_message_trgm_indexes()
+    add_table_changed_notify()
+    add_request_profiling_config()
+
+
+def downgrade():
+    drop_request_profiling_config()
+    drop_table_changed_notify()
+    drop_message_trgm_indexes()
+    drop_events_logs_notify()
+    drop_cursor_pagination_indexes()
+    drop_retention_indexes()
+    drop_retention_config()
+    drop_function_create_events_logs_partitions()
+    for table_name in partitioned_tables:
+        unpartition_table(table_name)
+
+
+def partition_table(table_name):
+    """Turn table_name into a table partitioned by reported_timestamp.
+
+    The existing table is renamed, and becomes the first partition of the
+    new table, containing all the existing rows; this avoids having to
+    copy them over.
+    The new table has the same columns, constraints and indexes (under the
+    same names), except that the primary key must contain the partitioning
+    column as well. Monthly partitions for the new rows are then created
+    by create_events_logs_partitions. Rows that no other partition covers
+    (eg. timestamps in the far future, or older than the oldest partition
+    once the legacy one is dropped) go to the default partition.
+    """
+    op.execute(f"""
+    DO $$
+        DECLARE
+            _index_defs text[];
+            _index_def text;
+            _index_name text;
+            _fk record;
+            _sequence text;
+            _upper_bound timestamp;
+        BEGIN
+            -- remember the indexes, to recreate them on the new table
+            SELECT coalesce(array_agg(pg_get_indexdef(indexrelid)), '{{}}')
+                INTO _index_defs
+                FROM pg_index
+                WHERE indrelid = '{table_name}'::regclass AND NOT indisprimary;
+
+            -- move the existing table and its indexes out of the way,
+            -- so that their names can be reused
+            ALTER TABLE {table_name} RENAME TO {table_name}_legacy;
+            FOR _index_name IN
+                SELECT c.relname
+                FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = '{table_name}_legacy'::regclass
+            LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I',
+                               _index_name, _index_name || '_legacy');
+            END LOOP;
+
+            CREATE TABLE {table_name} (
+                LIKE {table_name}_legacy
+                INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+            ) PARTITION BY RANGE (reported_timestamp);
+            ALTER TABLE {table_name}
+                ADD CONSTRAINT {table_name}_pkey
+                PRIMARY KEY (_storage_id, reported_timestamp);
+            FOR _fk IN
+                SELECT conname, pg_get_constraintdef(oid) AS def
+                FROM pg_constraint
+                WHERE conrelid = '{table_name}_legacy'::regclass
+                    AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE {table_name} ADD CONSTRAINT %I %s',
+                               _fk.conname, _fk.def);
+            END LOOP;
+            FOREACH _index_def IN ARRAY _index_defs LOOP
+                EXECUTE _index_def;
+            END LOOP;
+
+            -- the id sequence must not be dropped together with the
+            -- legacy partition
+            _sequence := pg_get_serial_sequence(
+                '{table_name}_legacy', '_storage_id');
+            EXECUTE format(
+                'ALTER SEQUENCE %s OWNED BY {table_name}._storage_id',
+                _sequence);
+
+            -- the legacy partition holds everything up to the end of the
+            -- current month (or of the latest month it has data for)
+            SELECT greatest(
+                date_trunc('month', now() at time zone 'utc'),
+                date_trunc('month', max(reported_timestamp))
+            ) + interval '1 month'
+                INTO _upper_bound
+                FROM {table_name}_legacy;
+            EXECUTE format(
+                'ALTER TABLE {table_name} '
+                'ATTACH PARTITION {table_name}_legacy '
+                'FOR VALUES FROM (MINVALUE) TO (%L)', _upper_bound);
+
+            CREATE TABLE {table_name}_default
+                PARTITION OF {table_name} DEFAULT;
+        END;
+    $$;
+    """)
+
+
+def unpartition_table(table_name):
+    """Turn the partitioned table_name back into a regular table.
+
+    This copies all the rows from all the partitions into a new table.
+    """
+    op.execute(f"""
+    DO $$
+        DECLARE
+            _index_defs text[];
+            _index_def text;
+            _index_name text;
+            _fk record;
+            _sequence text;
+        BEGIN
+            SELECT coalesce(array_agg(
+                replace(pg_get_indexdef(indexrelid), ' ON ONLY ', ' ON ')
+            ), '{{}}')
+                INTO _index_defs
+                FROM pg_index
+                WHERE indrelid = '{table_name}'::regclass AND NOT indisprimary;
+
+            ALTER TABLE {table_name} RENAME TO {table_name}_partitioned;
+            FOR _index_name IN
+                SELECT c.relname
+                FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = '{table_name}_partitioned'::regclass
+            LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I',
+                               _index_name, _index_name || '_partitioned');
+            END LOOP;
+
+            CREATE TABLE {table_name} (
+                LIKE {table_name}_partitioned
+                INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+            );
+            INSERT INTO {table_name} SELECT * FROM {table_name}_partitioned;
+            ALTER TABLE {table_name}
+                ADD CONSTRAINT {table_name}_pkey PRIMARY KEY (_storage_id);
+            FOR _fk IN
+                SELECT conname, pg_get_constraintdef(oid) AS def
+                FROM pg_constraint
+                WHERE conrelid = '{table_name}_partitioned'::regclass
+                    AND contype = 'f'
+            LOOP
+                EXECUTE format('ALTER TABLE {table_name} ADD CONSTRAINT %I %s',
+                               _fk.conname, _fk.def);
+            END LOOP;
+            FOREACH _index_def IN ARRAY _index_defs LOOP
+                EXECUTE _index_def;
+            END LOOP;
+
+            _sequence := pg_get_serial_sequence(
+                '{table_name}_partitioned', '_storage_id');
+            EXECUTE format(
+                'ALTER SEQUENCE %s OWNED BY {table_name}._storage_id',
+                _sequence);
+
+            -- this drops all the partitions as well
+            DROP TABLE {table_name}_partitioned;
+        END;
+    $$;
+    """)
+
+
+def create_function_create_events_logs_partitions():
+    op.execute("""
+    CREATE OR REPLACE FUNCTION create_events_logs_partitions(
+        months_ahead integer
+    ) RETURNS void AS $$
+        DECLARE
+            _table_name text;
+            _partition_name text;
+            _month timestamp;
+        BEGIN
+            FOREACH _table_name IN ARRAY ARRAY['events', 'logs'] LOOP
+                FOR _i IN 0..months_ahead LOOP
+                    _month := date_trunc('month', now() at time zone 'utc')
+                        + make_interval(months => _i);
+                    _partition_name :=
+                        _table_name || '_' || to_char(_month, 'YYYY_MM');
+                    BEGIN
+                        EXECUTE format(
+                            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I '
+                            'FOR VALUES FROM (%L) TO (%L)',
+                            _partition_name,
+                            _table_name,
+                            _month,
+                            _month + interval '1 month'
+                        );
+                    EXCEPTION
+                        -- this month is already covered by another partition
+                        -- (eg. the legacy one, holding the rows from before
+                        -- partitioning), or was just created concurrently
+                        WHEN invalid_object_definition OR duplicate_table THEN
+                            NULL;
+                        -- the default partition already has rows of this
+                        -- month: move them over to the new partition
+                        WHEN check_violation THEN
+                            EXECUTE format(
+                                'CREATE TABLE %I (LIKE %I '
+                                'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                                _partition_name, _table_name);
+                            EXECUTE format(
+                                'WITH moved AS ('
+                                '    DELETE FROM %I WHERE reported_timestamp '
+                                '    >= %L AND reported_timestamp < %L '
+                                '    RETURNING *'
+                                ') INSERT INTO %I SELECT * FROM moved',
+                                _table_name || '_default',
+                                _month,
+                                _month + interval '1 month',
+                                _partition_name);
+                            EXECUTE format(
+                                'ALTER TABLE %I ATTACH PARTITION %I '
+                                'FOR VALUES FROM (%L) TO (%L)',
+                                _table_name,
+                                _partition_name,
+                                _month,
+                                _month + interval '1 month');
+                    END;
+                END LOOP;
+            END LOOP;
+        END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+
+def drop_function_create_events_logs_partitions():
+    op.execute('DROP FUNCTION create_events_logs_partitions')
+
+
+def add_retention_config():
+    op.bulk_insert(
+        config_table,
+        [
+            {
+                'name': 'events_retention_days',
+                'value': None,
+                'scope': 'rest',
+                'schema': {'type': ['integer', 'null'], 'minimum': 1},
+                'is_editable': True,
+            },
+            {
+                'name': 'events_retention_tenants',
+                'value': {},
+                'scope': 'rest',
+                'schema': {
+                    'type': 'object',
+                    'additionalProperties': {
+                        'type': ['integer', 'null'],
+                        'minimum': 1,
+                    },
+                },
+                'is_editable': True,
+            },
+        ]
+    )
+
+
+def drop_retention_config():
+    for name in retention_config_names:
+        op.execute(
+            config_table.delete().where(
+                (config_table.c.name == op.inline_literal(name))
+                & (config_table.c.scope == op.inline_literal('rest'))
+            )
+        )
+
+
+def create_retention_indexes():
+    """Indexes for purging each tenant's old rows, in chunks"""
+    for table_name in partitioned_tables:
+        op.create_index(
+            op.f(f'{table_name}__tenant_id_reported_timestamp_idx'),
+            table_name,
+            ['_tenant_id', 'reported_timestamp', '_storage_id'],
+            unique=False,
+        )
+
+
+def drop_retention_indexes():
+    for table_name in partitioned_tables:
+        op.drop_index(
+            op.f(f'{table_name}__tenant_id_reported_timestamp_idx'),
+            table_name=table_name,
+        )
+
+
+def create_cursor_pagination_indexes():
+    for table_name in partitioned_tables:
+        op.create_index(
+            op.f(f'{table_name}__execution_fk_reported_timestamp_idx'),
+            table_name,
+            ['_execution_fk', 'reported_timestamp', '_storage_id'],
+            unique=False,
+        )
+
+
+def drop_cursor_pagination_indexes():
+    for table_name in partitioned_tables:
+        op.drop_index(
+            op.f(f'{table_name}__execution_fk_reported_timestamp_idx'),
+            table_name=table_name,
+        )
+
+
+def add_events_logs_notify():
+    """Notify the events_inserted channel about new events & logs.
+
+    This is a statement-level trigger, so that the bulk inserts done by
+    amqp-postgres only send one small notification per execution, carrying
+    the range of the new rows' ids, instead of the rows themselves.
+    """
+    op.execute("""CREATE OR REPLACE FUNCTION notify_new_events_logs()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify(
+                'events_inserted'::text,
+                json_build_object(
+                    'table', TG_TABLE_NAME,
+                    'execution_fk', _execution_fk,
+                    'min_storage_id', min(_storage_id),
+                    'max_storage_id', max(_storage_id)
+                )::text
+            )
+            FROM new_rows
+            WHERE _execution_fk IS NOT NULL
+            GROUP BY _execution_fk;
+            RETURN NULL;
+        END;
+    $$ LANGUAGE plpgsql;""")
+    for table_name in partitioned_tables:
+        op.execute(f"""CREATE TRIGGER {table_name}_inserted
+                      AFTER INSERT ON {table_name}
+                      REFERENCING NEW TABLE AS new_rows
+                      FOR EACH STATEMENT
+                      EXECUTE PROCEDURE notify_new_events_logs();""")
+
+
+def drop_events_logs_notify():
+    for table_name in partitioned_tables:
+        op.execute(f"""DROP TRIGGER {table_name}_inserted ON {table_name};""")
+    op.execute("""DROP FUNCTION notify_new_events_logs();""")
+
+
+def create_message_trgm_indexes():
+    # pg_trgm is a trusted extension, so this doesn't require a superuser
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table_name in partitioned_tables:
+        op.create_index(
+            op.f(f'{table_name}_message_trgm_idx'),
+            table_name,
+            ['message'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'message': 'gin_trgm_ops'},
+        )
+
+
+def drop_message_trgm_indexes():
+    for table_name in partitioned_tables:
+        op.drop_index(
+            op.f(f'{table_name}_message_trgm_idx'),
+            table_name=table_name,
+        )
+
+
+def add_table_changed_notify():
+    op.execute("""CREATE OR REPLACE FUNCTION notify_table_changed()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('table_changed'::text, TG_TABLE_NAME::text);
+            RETURN NULL;
+        END;
+    $$ LANGUAGE plpgsql;""")
+    for table_name in notified_tables:
+        op.execute(f"""CREATE TRIGGER {table_name}_changed
+                      AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+                      ON {table_name}
+                      FOR EACH STATEMENT
+                      EXECUTE PROCEDURE notify_table_changed();""")
+    # executions are updated all the time while they run, but only changes
+    # to their status and token are of interest
+    op.execute("""CREATE TRIGGER executions_changed
+                  AFTER UPDATE OF status, token OR DELETE OR TRUNCATE
+                  ON executions
+                  FOR EACH STATEMENT
+                  EXECUTE PROCEDURE notify_table_changed();""")
+    # users are updated on every login (last_login_at), so only notify
+    # about changes to what a cached execution's creator is checked for
+    op.execute("""CREATE TRIGGER users_changed
+                  AFTER UPDATE OF username, active OR DELETE OR TRUNCATE
+                  ON users
+                  FOR EACH STATEMENT
+                  EXECUTE PROCEDURE notify_table_changed();""")
+    # tokens' last_used is updated when they're used, but only deleted
+    # tokens need to be forgotten
+    op.execute("""CREATE TRIGGER tokens_changed
+                  AFTER DELETE OR TRUNCATE
+                  ON tokens
+                  FOR EACH STATEMENT
+                  EXECUTE PROCEDURE notify_table_changed();""")
+
+
+def drop_table_changed_notify():
+    op.execute("""DROP TRIGGER executions_changed ON executions;""")
+    op.execute("""DROP TRIGGER users_changed ON users;""")
+    op.execute("""DROP TRIGGER tokens_changed ON tokens;""")
+    for table_name in notified_tables:
+        op.execute(f"""DROP TRIGGER {table_name}_changed ON {table_name};""")
+    op.execute("""DROP FUNCTION notify_table_changed();""")
+
+
+def add_request_profiling_config():
+    op.bulk_insert(
+        config_table,
+        [
+            {
+                'name': 'request_profiling',
+                'value': False,
+                'scope': 'rest',
+                'schema': {'type': 'boolean'},
+                'is_editable': True,
+            },
+        ]
+    )
+
+
+def drop_request_profiling_config():
+    op.execute(
+        config_table.delete().where(
+            (config_table.c.name == op.inline_literal('request_profiling'))
+            & (config_table.c.scope == op.inline_literal('rest'))
+        )
+    )
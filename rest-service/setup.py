@@ -33,6 +33,7 @@ install_requires = [
     'jsonschema',
     'packaging',
     'pika',
+    'prometheus_client',
     'psutil>5,<6',
     'psycopg2',
     'pydantic<2',